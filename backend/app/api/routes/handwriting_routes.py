@@ -1,9 +1,16 @@
+import asyncio
+import json
 from fastapi import APIRouter, HTTPException, Body
-from typing import List, Optional, Dict, Any
+from fastapi.responses import StreamingResponse
+from typing import List, Optional, Dict, Any, Tuple
 import os
 import tempfile
-import numpy as np
+from app.core.config import settings
+from app.services.documents import DocumentStore, carry_over_strokes
 from app.services.handwriting import Hand, LayoutConfig, TextSegment
+from app.services.single_flight import SingleFlight, request_key
+from app.services.stroke_cache import default_shared_cache_path
+from app.services.worker_pool import WorkerPool
 from app.utils import drawing  # Import drawing module for character validation
 
 router = APIRouter(
@@ -11,8 +18,138 @@ router = APIRouter(
     tags=["handwriting"],
 )
 
-# Initialize the handwriting model
-hand = Hand()
+# Initialize the handwriting model, in worker processes if configured. The
+# model itself loads during the startup warm-up, not at import.
+if settings.worker_processes > 0:
+    # The sampling settings are the workers', they make up the cache keys here
+    hand = Hand(
+        max_workers=settings.inference_workers,
+        load_model=False,
+        prime_cache=settings.prime_cache,
+        engine=settings.engine,
+        precision=settings.precision,
+        seeded_on_numpy=settings.seeded_on_numpy,
+    )
+    hand.enable_worker_pool(
+        WorkerPool(
+            num_workers=settings.worker_processes,
+            intra_op_threads=settings.worker_intra_op_threads or None,
+            engine=settings.engine,
+            weights_path=settings.weights_path,
+            precision=settings.precision,
+        )
+    )
+else:
+    hand = Hand(
+        max_workers=settings.inference_workers,
+        prime_cache=settings.prime_cache,
+        engine=settings.engine,
+        weights_path=settings.weights_path,
+        engine_threads=settings.engine_threads or None,
+        precision=settings.precision,
+        seeded_on_numpy=settings.seeded_on_numpy,
+        lazy=True,
+    )
+
+if settings.batching_enabled:
+    hand.enable_batching(
+        max_wait_ms=settings.batch_max_wait_ms,
+        max_batch_size=settings.batch_max_size,
+    )
+
+if settings.stroke_cache_mb > 0:
+    hand.enable_stroke_cache(int(settings.stroke_cache_mb * 1024 * 1024))
+
+if settings.shared_cache_path:
+    hand.enable_shared_cache(
+        (
+            default_shared_cache_path()
+            if settings.shared_cache_path == "default"
+            else settings.shared_cache_path
+        ),
+        int(settings.shared_cache_mb * 1024 * 1024),
+    )
+
+if settings.disk_cache_dir:
+    hand.enable_disk_cache(
+        settings.disk_cache_dir, int(settings.disk_cache_mb * 1024 * 1024)
+    )
+
+if settings.word_library_mb > 0:
+    hand.enable_word_library(
+        int(settings.word_library_mb * 1024 * 1024),
+        max_variants=settings.word_variants,
+        reuse_rate=settings.word_reuse_rate,
+    )
+
+# Sampled documents kept for re-rendering, see /documents
+documents = (
+    DocumentStore(int(settings.document_store_mb * 1024 * 1024))
+    if settings.document_store_mb > 0
+    else None
+)
+
+# Concurrent identical generations share one run of the model
+flights = SingleFlight() if settings.single_flight else None
+
+
+async def coalesce(key: str, func):
+    """Await func(), sharing its result with identical requests in flight."""
+    if flights is None:
+        return await func()
+    return await flights.run(key, func)
+
+
+# Tasks running after their request was answered, referenced until they are
+# done so they aren't garbage collected
+background_tasks = set()
+
+
+def run_in_background(coro):
+    """Run a coroutine without waiting for it."""
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+# Future of the warm-up started by warm_up_model()
+warmup_future: Optional[asyncio.Future] = None
+
+
+async def warm_up_model():
+    """
+    Warm the model up in the background so the server can answer readiness
+    probes meanwhile. Registered as a startup handler by app.main, on the
+    app rather than this router, which would run it once more.
+    """
+    global warmup_future
+
+    if settings.warmup_enabled:
+        batch_sizes, tsteps = settings.warmup_batch_sizes, settings.warmup_tsteps
+    else:
+        batch_sizes, tsteps = (), ()
+
+    warmup_future = asyncio.get_running_loop().run_in_executor(
+        hand.executor, hand.warmup, batch_sizes, tsteps
+    )
+    warmup_future.add_done_callback(report_warmup)
+
+
+def report_warmup(future: asyncio.Future):
+    """Log the error the warm-up failed with, if any."""
+    error = warmup_error()
+    if error is not None:
+        print(f"Model warm-up failed: {error}")
+
+
+def warmup_error() -> Optional[str]:
+    """The error the warm-up failed with, or None if it hasn't failed."""
+    if warmup_future is None or not warmup_future.done():
+        return None
+    if warmup_future.cancelled():
+        return "warm-up was cancelled"
+    error = warmup_future.exception()
+    return f"{type(error).__name__}: {error}" if error is not None else None
 
 
 @router.post("/generate")
@@ -22,38 +159,72 @@ async def generate_handwriting(
     styles: Optional[List[int]] = Body(None),
     stroke_colors: Optional[List[str]] = Body(None),
     stroke_widths: Optional[List[int]] = Body(None),
+    seed: Optional[int] = Body(None, ge=0),
 ):
     """
-    Generate handwriting from the provided text lines
+    Generate handwriting from the provided text lines. With a seed the same
+    request always produces the same handwriting. Identical requests in
+    flight at the same time share one generation.
     """
-    try:
+
+    def per_line(values, default):
+        # Fill in the defaults write() would use, so equivalent requests
+        # coalesce
+        return [
+            values[i] if values and i < len(values) else default
+            for i in range(len(lines))
+        ]
+
+    biases = per_line(biases, 0.5)
+    styles = per_line(styles, 0)
+    stroke_colors = per_line(stroke_colors, "black")
+    stroke_widths = per_line(stroke_widths, 2.0)
+
+    async def render():
         # Create a temporary file for the SVG output
         with tempfile.NamedTemporaryFile(suffix=".svg", delete=False) as temp_file:
             output_path = temp_file.name
 
-        # Generate the handwriting
-        hand.write(
-            filename=output_path,
-            lines=lines,
-            biases=biases,
-            styles=styles,
-            stroke_colors=stroke_colors,
-            stroke_widths=stroke_widths,
-        )
+        try:
+            # Generate the handwriting off the event loop
+            await hand.awrite(
+                filename=output_path,
+                lines=lines,
+                biases=biases,
+                styles=styles,
+                stroke_colors=stroke_colors,
+                stroke_widths=stroke_widths,
+                seed=seed,
+            )
 
-        # Read the generated SVG file
-        with open(output_path, "r") as f:
-            svg_content = f.read()
+            # Read the generated SVG file
+            with open(output_path, "r") as f:
+                return f.read()
+        finally:
+            # Clean up the temporary file
+            os.unlink(output_path)
 
-        print(svg_content)
+    try:
+        svg_content = await coalesce(
+            request_key(
+                "generate",
+                lines=lines,
+                biases=biases,
+                styles=styles,
+                stroke_colors=stroke_colors,
+                stroke_widths=[float(width) for width in stroke_widths],
+                seed=seed,
+            ),
+            render,
+        )
 
-        # Clean up the temporary file
-        os.unlink(output_path)
+        print(svg_content)
 
         return {
             "status": "success",
             "svg_content": svg_content,
             "message": "Handwriting generated successfully",
+            "seed": seed,
         }
     except Exception as e:
         raise HTTPException(
@@ -67,21 +238,7 @@ async def list_styles():
     List all available handwriting styles
     """
     try:
-        # Get style files from the styles directory
-        style_files = os.listdir("styles")
-
-        # Extract unique style IDs
-        style_ids = set()
-        for file in style_files:
-            if file.startswith("style-") and file.endswith(
-                ("-chars.npy", "-strokes.npy")
-            ):
-                # Extract the style ID from filenames like "style-0-chars.npy"
-                style_id = int(file.split("-")[1].split("-")[0])
-                style_ids.add(style_id)
-
-        # Sort the style IDs
-        styles_list = sorted(list(style_ids))
+        styles_list = hand.styles.ids()
 
         return {
             "status": "success",
@@ -98,33 +255,19 @@ async def get_style(style_id: int):
     Get information about a specific handwriting style
     """
     try:
-        # Check if style files exist
-        chars_path = f"styles/style-{style_id}-chars.npy"
-        strokes_path = f"styles/style-{style_id}-strokes.npy"
-
-        if not (os.path.exists(chars_path) and os.path.exists(strokes_path)):
+        style = hand.styles.get(style_id)
+        if style is None:
             raise HTTPException(status_code=404, detail=f"Style {style_id} not found")
 
-        # Load the style data
-        try:
-            chars_data = np.load(chars_path).tobytes().decode("utf-8")
-
-            # Get some metadata about the style
-            strokes_data = np.load(strokes_path)
-            stroke_count = len(strokes_data)
-            sample_text = chars_data.strip()
-
-            return {
-                "status": "success",
-                "style_id": style_id,
-                "stroke_count": stroke_count,
-                "sample_text": sample_text,
-                "preview": generate_preview(style_id, sample_text),
-            }
-        except Exception as e:
-            raise HTTPException(
-                status_code=500, detail=f"Error loading style data: {str(e)}"
-            )
+        sample_text = style.text.strip()
+
+        return {
+            "status": "success",
+            "style_id": style_id,
+            "stroke_count": style.strokes_len,
+            "sample_text": sample_text,
+            "preview": await generate_preview(style_id, sample_text),
+        }
 
     except HTTPException:
         raise
@@ -132,30 +275,36 @@ async def get_style(style_id: int):
         raise HTTPException(status_code=500, detail=f"Error retrieving style: {str(e)}")
 
 
-def generate_preview(style_id: int, sample_text: str):
+async def generate_preview(style_id: int, sample_text: str):
     """
     Generate a preview SVG for a specific style
     """
-    try:
+    preview_text = sample_text[:30]  # Use first 30 chars of sample text
+
+    async def render():
         # Create a temporary file for the SVG output
         with tempfile.NamedTemporaryFile(suffix=".svg", delete=False) as temp_file:
             output_path = temp_file.name
 
-        # Generate a preview using the style
-        hand.write(
-            filename=output_path,
-            lines=[sample_text[:30]],  # Use first 30 chars of sample text
-            styles=[style_id],
-        )
-
-        # Read the generated SVG file
-        with open(output_path, "r") as f:
-            svg_content = f.read()
+        try:
+            # Generate a preview using the style
+            await hand.awrite(
+                filename=output_path,
+                lines=[preview_text],
+                styles=[style_id],
+            )
 
-        # Clean up the temporary file
-        os.unlink(output_path)
+            # Read the generated SVG file
+            with open(output_path, "r") as f:
+                return f.read()
+        finally:
+            # Clean up the temporary file
+            os.unlink(output_path)
 
-        return svg_content
+    try:
+        return await coalesce(
+            request_key("preview", style_id=style_id, text=preview_text), render
+        )
     except Exception as e:
         return f"Error generating preview: {str(e)}"
 
@@ -171,6 +320,7 @@ async def generate_advanced_handwriting(
     default_scale: float = Body(1.0),
     segment_styles: Optional[List[Dict[str, Any]]] = Body(None),
     layout: Optional[Dict[str, Any]] = Body(None),
+    seed: Optional[int] = Body(None, ge=0),
 ):
     """
     Generate handwriting with advanced styling and layout options.
@@ -187,6 +337,8 @@ async def generate_advanced_handwriting(
             Format: [{"index": [line_idx, segment_idx], "style_id": 1, "color": "red", ...}]
         layout: Optional layout configuration
             Format: {"line_spacing": 1.2, "word_spacing": 1.0, "alignment": "left", ...}
+        seed: Optional seed that makes the handwriting reproducible. Segments
+            can also be given their own seed in segment_styles.
     """
     try:
         # Process the text into segments
@@ -224,6 +376,10 @@ async def generate_advanced_handwriting(
                             segment.stroke_width = style_override["width"]
                         if "scale" in style_override:
                             segment.scale = style_override["scale"]
+                        if "seed" in style_override:
+                            segment.seed = style_override["seed"]
+
+        hand.seed_segments(segments_by_line, seed)
 
         # Create layout configuration
         layout_config = None
@@ -241,7 +397,7 @@ async def generate_advanced_handwriting(
             output_path = temp_file.name
 
         # Generate the handwriting with segments
-        hand.write_segments(
+        await hand.awrite_segments(
             filename=output_path,
             segments_by_line=segments_by_line,
             layout_config=layout_config,
@@ -264,6 +420,7 @@ async def generate_advanced_handwriting(
             "segmentation_level": segmentation_level,
             "segment_count": segment_count,
             "line_count": len(segments_by_line),
+            "seed": seed,
         }
 
     except Exception as e:
@@ -276,6 +433,298 @@ async def generate_advanced_handwriting(
         )
 
 
+# A4 dimensions in pixels (assuming 96 DPI)
+# A4 is 210mm x 297mm, which is approximately 794 x 1123 pixels at 96 DPI
+A4_PAGE_WIDTH = 794
+A4_PAGE_HEIGHT = 1123
+
+# Margins in pixels: left, top, right, bottom
+A4_MARGINS = (75, 100, 75, 100)
+
+# Width left for text between the margins
+A4_USABLE_WIDTH = A4_PAGE_WIDTH - A4_MARGINS[0] - A4_MARGINS[2]
+
+
+def wrap_a4_lines(text: str) -> List[str]:
+    """Break text into lines that fit the width of an A4 page."""
+    # Estimate characters per line based on average character width
+    # Assuming average character width is about 10px * scale factor
+    char_width = 10
+    chars_per_line = max(1, int(A4_USABLE_WIDTH / char_width))
+
+    # Process and respect newline characters
+    paragraphs = text.split("\n")
+    lines = []
+
+    # Process each paragraph separately to respect newlines
+    for paragraph in paragraphs:
+        if not paragraph.strip():
+            # Keep empty paragraphs as empty lines
+            lines.append("")
+            continue
+
+        words = paragraph.split()
+        current_line = ""
+
+        for word in words:
+            # Check if adding this word would exceed the line width
+            if len(current_line) + len(word) + 1 <= chars_per_line:
+                current_line += " " + word if current_line else word
+            else:
+                # Line is full, add it to lines and start a new line
+                if current_line:
+                    lines.append(current_line)
+                current_line = word
+
+        # Add the last line if it's not empty
+        if current_line:
+            lines.append(current_line)
+
+    return lines
+
+
+def a4_segments(
+    lines: List[str],
+    style_id: int,
+    bias: float,
+    seed: Optional[int],
+    stroke_color: str = "black",
+    stroke_width: float = 2.0,
+) -> List[List[TextSegment]]:
+    """One seeded segment per wrapped line."""
+    segments_by_line = []
+    for line in lines:
+        segment = TextSegment(
+            text=line,
+            style_id=style_id,
+            bias=bias,
+            stroke_color=stroke_color,
+            stroke_width=stroke_width,
+            scale=1.0,
+        )
+        segments_by_line.append([segment])
+
+    hand.seed_segments(segments_by_line, seed)
+    return segments_by_line
+
+
+def a4_layout(line_height: float, paragraph_spacing: float) -> LayoutConfig:
+    """Layout configuration for A4 pages."""
+    return LayoutConfig(
+        line_spacing=line_height,
+        paragraph_spacing=paragraph_spacing,
+        word_spacing=1.0,
+        char_spacing=1.0,
+        alignment="left",
+        max_width=A4_USABLE_WIDTH,
+    )
+
+
+async def render_a4_pages(
+    segments_by_line: List[List[TextSegment]],
+    line_height: float,
+    paragraph_spacing: float,
+    lines_per_page: int,
+) -> List[str]:
+    """Draw sampled segments onto A4 pages and return the pages' SVG."""
+    layout_config = a4_layout(line_height, paragraph_spacing)
+
+    # Create a temporary directory for the SVG output
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Generate template for page filenames
+        output_template = os.path.join(temp_dir, "a4_page_{}.svg")
+
+        # Draw the A4 pages (potentially multiple pages), the model isn't run
+        page_files = await hand.arender_multi_page(
+            filename_template=output_template,
+            segments_by_line=segments_by_line,
+            layout_config=layout_config,
+            page_dimensions=(A4_PAGE_WIDTH, A4_PAGE_HEIGHT),
+            margins=A4_MARGINS,
+            max_lines_per_page=lines_per_page,
+        )
+
+        # Read all the generated SVG files
+        pages_content = []
+        for page_file in page_files:
+            with open(page_file, "r") as f:
+                pages_content.append(f.read())
+
+    return pages_content
+
+
+async def sample_a4_document(
+    text: str,
+    style_id: int,
+    bias: float,
+    seed: Optional[int],
+    document_id: Optional[str] = None,
+    **styling,
+) -> Tuple[List[List[TextSegment]], Optional[str], int]:
+    """
+    Wrap and sample text for A4 pages, storing the sampled document for
+    re-rendering if the document store is enabled.
+
+    With the document_id of an earlier version of the document that is
+    still stored, only the lines that are new or changed since then are
+    sampled. The new version is stored under a new id, leaving the earlier
+    one as it was. Returns the segments, the new version's document id and
+    how many lines were reused.
+    """
+    segments_by_line = a4_segments(wrap_a4_lines(text), style_id, bias, seed, **styling)
+    reused = carry_over_document(segments_by_line, document_id)
+    await hand.asample_document(segments_by_line)
+    document_id = store_document(segments_by_line, style_id, bias, seed)
+    return segments_by_line, document_id, reused
+
+
+def carry_over_document(
+    segments_by_line: List[List[TextSegment]], document_id: Optional[str]
+) -> int:
+    """
+    Give unchanged lines the strokes of the stored document_id, if it is
+    still stored. Returns the number of lines reused.
+    """
+    previous = (
+        documents.get(document_id) if documents is not None and document_id else None
+    )
+    if previous is None:
+        return 0
+    return carry_over_strokes(previous, segments_by_line)
+
+
+def store_document(
+    segments_by_line: List[List[TextSegment]],
+    style_id: int,
+    bias: float,
+    seed: Optional[int],
+) -> Optional[str]:
+    """
+    Store sampled segments under a new id and return it. None if the
+    document store is disabled.
+    """
+    if documents is None:
+        return None
+    document = documents.put(segments_by_line, style_id=style_id, bias=bias, seed=seed)
+    return document.document_id
+
+
+async def sample_document_lines(document, lines: List[int]) -> int:
+    """
+    Sample the given lines of a stored document that are still unsampled.
+    Identical requests for the same version of the document, like a page
+    being requested while it is prefetched, share one sampling. Returns
+    the number of lines sampled.
+    """
+    if not document.missing(lines):
+        return 0
+
+    async def sample():
+        sampled = document.missing(lines)
+        await hand.asample_document(list(sampled.values()))
+        return documents.fill(document, sampled)
+
+    return await coalesce(
+        request_key(
+            "document_lines",
+            document_id=document.document_id,
+            version=document.version,
+            lines=lines,
+        ),
+        sample,
+    )
+
+
+def prefetch_page(document, page: int, lines_per_page: int):
+    """Sample a page of a stored document in the background, if it exists."""
+    if page > document.page_count(lines_per_page):
+        return
+
+    async def prefetch():
+        try:
+            await sample_document_lines(
+                document, list(document.page_lines(page, lines_per_page))
+            )
+        except Exception as e:
+            print(f"Error prefetching page {page} of {document.document_id}: {e}")
+
+    run_in_background(prefetch())
+
+
+async def render_document_page(
+    document,
+    page: int,
+    lines_per_page: int,
+    line_height: float,
+    paragraph_spacing: float,
+    prefetch: bool,
+    **styling,
+) -> str:
+    """
+    Sample a page of a stored document if needed and return its SVG. With
+    prefetch, the next page is sampled in the background meanwhile.
+    """
+    lines = list(document.page_lines(page, lines_per_page))
+    await sample_document_lines(document, lines)
+    if prefetch:
+        prefetch_page(document, page + 1, lines_per_page)
+
+    (svg_content,) = await render_a4_pages(
+        document.restyled(lines, **styling),
+        line_height,
+        paragraph_spacing,
+        lines_per_page,
+    )
+    return svg_content
+
+
+async def render_first_a4_page(
+    lines: List[str],
+    style_id: int,
+    bias: float,
+    seed: Optional[int],
+    document_id: Optional[str],
+    line_height: float,
+    paragraph_spacing: float,
+    lines_per_page: int,
+    prefetch: bool,
+    **styling,
+):
+    """
+    Store a document laid out into pages with its lines unsampled, then
+    sample and draw only its first page.
+
+    Returns the pages drawn, the document id, how many lines were reused
+    from the previous version and the number of pages.
+    """
+    segments_by_line = a4_segments(lines, style_id, bias, seed, **styling)
+    hand.validate_document(segments_by_line)
+    reused = carry_over_document(segments_by_line, document_id)
+    document = documents.put(
+        segments_by_line,
+        style_id=style_id,
+        bias=bias,
+        seed=seed,
+        lines_per_page=lines_per_page,
+    )
+
+    page_count = document.page_count(lines_per_page)
+    pages_content = []
+    if page_count:
+        pages_content.append(
+            await render_document_page(
+                document,
+                1,
+                lines_per_page,
+                line_height,
+                paragraph_spacing,
+                prefetch,
+                **styling,
+            )
+        )
+    return pages_content, document.document_id, reused, page_count
+
+
 @router.post("/a4page")
 async def generate_a4_page(
     text: str = Body(...),
@@ -285,11 +734,26 @@ async def generate_a4_page(
     stroke_width: Optional[float] = Body(2.0),
     line_height: Optional[float] = Body(1.0),  # Reduced from 1.5
     paragraph_spacing: Optional[float] = Body(1.5),  # Reduced from 2.0
-    lines_per_page: Optional[int] = Body(30),  # Increased from 25 to fit more lines
+    lines_per_page: int = Body(30, ge=1),  # Increased from 25 to fit more lines
+    seed: Optional[int] = Body(None, ge=0),
+    document_id: Optional[str] = Body(None),
+    lazy: Optional[bool] = Body(False),
+    prefetch: Optional[bool] = Body(True),
 ):
     """
     Generate handwriting on A4-sized pages, automatically splitting text across multiple pages if needed.
 
+    The response carries a document_id, with which the pages can be
+    re-rendered with other styling and spacing at
+    /documents/{document_id}/render without sampling them again. Passing
+    it back with edited text samples only the lines that changed, and the
+    edited version gets a new document_id.
+
+    With lazy, the text is laid out into pages but only the first one is
+    sampled and returned; the others are sampled when they are requested
+    at /documents/{document_id}/pages/{page}. page_count still counts all
+    pages.
+
     Args:
         text: The text to convert to handwriting
         style_id: The handwriting style ID to use
@@ -299,106 +763,78 @@ async def generate_a4_page(
         line_height: The height of each line (as a multiple of the base line height)
         paragraph_spacing: The spacing between paragraphs (as a multiple of the base line height)
         lines_per_page: Maximum number of lines per page
+        seed: Optional seed that makes the handwriting reproducible
+        document_id: Optional id of an earlier version of the document
+        lazy: Whether to generate only the first page now
+        prefetch: Whether to sample the second page in the background, when lazy
     """
+    if lazy and documents is None:
+        raise HTTPException(status_code=503, detail="Document store is disabled")
+
     try:
-        # A4 dimensions in pixels (assuming 96 DPI)
-        # A4 is 210mm x 297mm, which is approximately 794 x 1123 pixels at 96 DPI
-        page_width = 794
-        page_height = 1123
-
-        # Set margins (in pixels)
-        left_margin = 75
-        right_margin = 75
-        top_margin = 100
-        bottom_margin = 100
-
-        # Calculate usable width for text
-        usable_width = page_width - left_margin - right_margin
-
-        # Estimate characters per line based on average character width
-        # Assuming average character width is about 10px * scale factor
-        char_width = 10
-        chars_per_line = max(1, int(usable_width / char_width))
-
-        # Process and respect newline characters
-        paragraphs = text.split("\n")
-        lines = []
-
-        # Process each paragraph separately to respect newlines
-        for paragraph in paragraphs:
-            if not paragraph.strip():
-                # Keep empty paragraphs as empty lines
-                lines.append("")
-                continue
-
-            words = paragraph.split()
-            current_line = ""
-
-            for word in words:
-                # Check if adding this word would exceed the line width
-                if len(current_line) + len(word) + 1 <= chars_per_line:
-                    current_line += " " + word if current_line else word
-                else:
-                    # Line is full, add it to lines and start a new line
-                    if current_line:
-                        lines.append(current_line)
-                    current_line = word
-
-            # Add the last line if it's not empty
-            if current_line:
-                lines.append(current_line)
-
-        # Create layout configuration for A4 page
-        layout_config = LayoutConfig(
-            line_spacing=line_height,
-            paragraph_spacing=paragraph_spacing,
-            word_spacing=1.0,
-            char_spacing=1.0,
-            alignment="left",
-            max_width=usable_width,
-        )
+        lines = wrap_a4_lines(text)
 
-        # Create segments from lines
-        segments_by_line = []
-        for line in lines:
-            segment = TextSegment(
-                text=line,
-                style_id=style_id,
-                bias=bias,
+        async def render():
+            if lazy:
+                return await render_first_a4_page(
+                    lines,
+                    style_id,
+                    bias,
+                    seed,
+                    document_id,
+                    line_height,
+                    paragraph_spacing,
+                    lines_per_page,
+                    prefetch,
+                    stroke_color=stroke_color,
+                    stroke_width=stroke_width,
+                )
+
+            segments_by_line, new_document_id, reused = await sample_a4_document(
+                text,
+                style_id,
+                bias,
+                seed,
+                document_id,
                 stroke_color=stroke_color,
                 stroke_width=stroke_width,
-                scale=1.0,
             )
-            segments_by_line.append([segment])
-
-        # Create a temporary directory for the SVG output
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Generate template for page filenames
-            output_template = os.path.join(temp_dir, "a4_page_{}.svg")
-
-            # Generate the handwriting with A4 dimensions (potentially multiple pages)
-            page_files = hand.write_multi_page(
-                filename_template=output_template,
-                segments_by_line=segments_by_line,
-                layout_config=layout_config,
-                page_dimensions=(page_width, page_height),
-                margins=(left_margin, top_margin, right_margin, bottom_margin),
-                max_lines_per_page=lines_per_page,
+            pages_content = await render_a4_pages(
+                segments_by_line, line_height, paragraph_spacing, lines_per_page
             )
+            return pages_content, new_document_id, reused, len(pages_content)
 
-            # Read all the generated SVG files
-            pages_content = []
-            for page_file in page_files:
-                with open(page_file, "r") as f:
-                    pages_content.append(f.read())
+        # The wrapped lines stand for the text, so requests differing only
+        # in whitespace coalesce too
+        pages_content, document_id, reused, page_count = await coalesce(
+            request_key(
+                "a4page",
+                lines=lines,
+                style_id=style_id,
+                bias=bias,
+                stroke_color=stroke_color,
+                stroke_width=stroke_width,
+                line_height=line_height,
+                paragraph_spacing=paragraph_spacing,
+                lines_per_page=lines_per_page,
+                seed=seed,
+                document_id=document_id,
+                lazy=lazy,
+                prefetch=prefetch,
+            ),
+            render,
+        )
 
         return {
             "status": "success",
             "pages": pages_content,
             "message": "A4 page handwriting generated successfully",
             "line_count": len(lines),
-            "page_count": len(pages_content),
+            "page_count": page_count,
             "page_format": "A4",
+            "seed": seed,
+            "document_id": document_id,
+            "lines_reused": reused,
         }
     except Exception as e:
         import traceback
@@ -408,3 +844,320 @@ async def generate_a4_page(
             status_code=500,
             detail=f"Error generating A4 page handwriting: {str(e)}\n{error_details}",
         )
+
+
+@router.post("/a4page/stream")
+async def stream_a4_page(
+    text: str = Body(...),
+    style_id: Optional[int] = Body(0),
+    bias: Optional[float] = Body(0.5),
+    stroke_color: Optional[str] = Body("black"),
+    stroke_width: Optional[float] = Body(2.0),
+    line_height: Optional[float] = Body(1.0),
+    paragraph_spacing: Optional[float] = Body(1.5),
+    lines_per_page: int = Body(30, ge=1),
+    seed: Optional[int] = Body(None, ge=0),
+    document_id: Optional[str] = Body(None),
+):
+    """
+    Generate handwriting on A4 pages like /a4page, streaming each page as
+    soon as it is ready instead of answering once all pages are done.
+
+    The response is newline-delimited JSON, one event per line:
+        {"event": "start", "line_count", "page_count", "lines_reused", "seed"}
+        {"event": "progress", "lines_sampled", "pages_done"}
+            whenever a chunk of pages has been sampled
+        {"event": "page", "page", "svg_content", "lines_sampled", "pages_done"}
+            for every page, in order
+        {"event": "done", "page_count", "document_id"} once all pages are sent
+        {"event": "error", "detail"} if generation fails after the start
+
+    Takes the same arguments as /a4page. Text that can't be written is
+    rejected with an error response, like /a4page, before streaming starts.
+    """
+    lines = wrap_a4_lines(text)
+    segments_by_line = a4_segments(
+        lines,
+        style_id,
+        bias,
+        seed,
+        stroke_color=stroke_color,
+        stroke_width=stroke_width,
+    )
+    try:
+        hand.validate_document(segments_by_line)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error generating A4 page handwriting: {str(e)}",
+        )
+    reused = carry_over_document(segments_by_line, document_id)
+    page_count = -(-len(lines) // lines_per_page)
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        progress = {"lines_sampled": 0, "pages_done": 0}
+
+        def send(event: str, **data):
+            queue.put_nowait(json.dumps({"event": event, **data}) + "\n")
+
+        def on_sampled(lines_sampled: int):
+            # Called from the executor thread making the pages
+            def report():
+                progress["lines_sampled"] = lines_sampled
+                send("progress", **progress)
+
+            loop.call_soon_threadsafe(report)
+
+        async def produce():
+            try:
+                send(
+                    "start",
+                    line_count=len(lines),
+                    page_count=page_count,
+                    lines_reused=reused,
+                    seed=seed,
+                )
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    async for page_file in hand.aiter_multi_page(
+                        filename_template=os.path.join(temp_dir, "a4_page_{}.svg"),
+                        segments_by_line=segments_by_line,
+                        layout_config=a4_layout(line_height, paragraph_spacing),
+                        page_dimensions=(A4_PAGE_WIDTH, A4_PAGE_HEIGHT),
+                        margins=A4_MARGINS,
+                        max_lines_per_page=lines_per_page,
+                        on_sampled=on_sampled,
+                    ):
+                        with open(page_file, "r") as f:
+                            svg_content = f.read()
+                        os.unlink(page_file)
+                        progress["pages_done"] += 1
+                        send(
+                            "page",
+                            page=progress["pages_done"],
+                            svg_content=svg_content,
+                            **progress,
+                        )
+                send(
+                    "done",
+                    page_count=progress["pages_done"],
+                    document_id=store_document(segments_by_line, style_id, bias, seed),
+                )
+            except Exception as e:
+                send("error", detail=f"Error generating A4 page handwriting: {str(e)}")
+            finally:
+                queue.put_nowait(None)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            # The client went away or the stream is done
+            producer.cancel()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@router.post("/documents")
+async def sample_document(
+    text: str = Body(...),
+    style_id: Optional[int] = Body(0),
+    bias: Optional[float] = Body(0.5),
+    seed: Optional[int] = Body(None, ge=0),
+    document_id: Optional[str] = Body(None),
+):
+    """
+    Sample handwriting for A4 pages and keep it server-side, without
+    drawing it. Render the pages with /documents/{document_id}/render, as
+    often as needed, for a fraction of the cost of sampling.
+
+    Resubmitting edited text with the document_id of the previous version
+    samples only the lines that are new or changed and keeps the strokes
+    of the others. The edited version is stored under a new id and the
+    previous version stays available under its own until it is evicted.
+    If it has been evicted already, the whole document is sampled.
+
+    Args:
+        text: The text to convert to handwriting
+        style_id: The handwriting style ID to use
+        bias: The bias value (randomness factor)
+        seed: Optional seed that makes the handwriting reproducible
+        document_id: Optional id of the previous version of the document
+    """
+    if documents is None:
+        raise HTTPException(status_code=503, detail="Document store is disabled")
+
+    try:
+        segments_by_line, document_id, reused = await sample_a4_document(
+            text, style_id, bias, seed, document_id
+        )
+
+        return {
+            "status": "success",
+            "document_id": document_id,
+            "message": "Document sampled successfully",
+            "line_count": len(segments_by_line),
+            "lines_reused": reused,
+            "lines_sampled": len(segments_by_line) - reused,
+            "seed": seed,
+        }
+    except Exception as e:
+        import traceback
+
+        error_details = traceback.format_exc()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error sampling document: {str(e)}\n{error_details}",
+        )
+
+
+@router.post("/documents/{document_id}/render")
+async def render_document(
+    document_id: str,
+    stroke_color: Optional[str] = Body("black"),
+    stroke_width: Optional[float] = Body(2.0),
+    line_height: Optional[float] = Body(1.0),
+    paragraph_spacing: Optional[float] = Body(1.5),
+    lines_per_page: int = Body(30, ge=1),
+):
+    """
+    Render a sampled document onto A4 pages with the given styling and
+    spacing. Only the layout and drawing run, not the model.
+
+    Args:
+        document_id: Id returned by /documents or /a4page
+        stroke_color: The color of the handwriting strokes
+        stroke_width: The width of the handwriting strokes
+        line_height: The height of each line (as a multiple of the base line height)
+        paragraph_spacing: The spacing between paragraphs (as a multiple of the base line height)
+        lines_per_page: Maximum number of lines per page
+    """
+    document = documents.get(document_id) if documents is not None else None
+    if document is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Document {document_id} not found, it may have expired",
+        )
+
+    try:
+        # Lines of a lazily generated document may not be sampled yet
+        await sample_document_lines(
+            document, list(range(len(document.segments_by_line)))
+        )
+        pages_content = await render_a4_pages(
+            document.restyled(stroke_color=stroke_color, stroke_width=stroke_width),
+            line_height,
+            paragraph_spacing,
+            lines_per_page,
+        )
+
+        return {
+            "status": "success",
+            "pages": pages_content,
+            "message": "Document rendered successfully",
+            "line_count": len(document.segments_by_line),
+            "page_count": len(pages_content),
+            "page_format": "A4",
+            "seed": document.info.get("seed"),
+            "document_id": document_id,
+        }
+    except Exception as e:
+        import traceback
+
+        error_details = traceback.format_exc()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error rendering document: {str(e)}\n{error_details}",
+        )
+
+
+@router.post("/documents/{document_id}/pages/{page}")
+async def get_document_page(
+    document_id: str,
+    page: int,
+    stroke_color: Optional[str] = Body("black"),
+    stroke_width: Optional[float] = Body(2.0),
+    line_height: Optional[float] = Body(1.0),
+    paragraph_spacing: Optional[float] = Body(1.5),
+    lines_per_page: Optional[int] = Body(None, ge=1),
+    prefetch: Optional[bool] = Body(True),
+):
+    """
+    Render one page of a stored document, sampling its lines first if they
+    haven't been, as with documents started by /a4page with lazy.
+
+    Args:
+        document_id: Id returned by /documents or /a4page
+        page: Page number, starting from 1
+        stroke_color: The color of the handwriting strokes
+        stroke_width: The width of the handwriting strokes
+        line_height: The height of each line (as a multiple of the base line height)
+        paragraph_spacing: The spacing between paragraphs (as a multiple of the base line height)
+        lines_per_page: Maximum number of lines per page, by default the
+            one the document was laid out with
+        prefetch: Whether to sample the next page in the background
+    """
+    document = documents.get(document_id) if documents is not None else None
+    if document is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Document {document_id} not found, it may have expired",
+        )
+
+    if lines_per_page is None:
+        lines_per_page = document.info.get("lines_per_page", 30)
+    page_count = document.page_count(lines_per_page)
+    if not 1 <= page <= page_count:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Page {page} not found, document {document_id} has {page_count}",
+        )
+
+    try:
+        svg_content = await render_document_page(
+            document,
+            page,
+            lines_per_page,
+            line_height,
+            paragraph_spacing,
+            prefetch,
+            stroke_color=stroke_color,
+            stroke_width=stroke_width,
+        )
+
+        return {
+            "status": "success",
+            "svg_content": svg_content,
+            "message": "Document page rendered successfully",
+            "page": page,
+            "page_count": page_count,
+            "page_format": "A4",
+            "seed": document.info.get("seed"),
+            "document_id": document_id,
+        }
+    except Exception as e:
+        import traceback
+
+        error_details = traceback.format_exc()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error rendering document page: {str(e)}\n{error_details}",
+        )
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Report sampling metrics for the handwriting model
+    """
+    return {
+        "status": "success",
+        "sampling": hand.get_sampling_stats(),
+        "single_flight": flights.get_stats() if flights is not None else None,
+        "documents": documents.get_stats() if documents is not None else None,
+    }
@@ -0,0 +1,119 @@
+"""Runtime configuration read from environment variables."""
+
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Read a boolean flag such as KALAM_BATCHING=0 from the environment."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment."""
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_int_list(name: str, default: tuple) -> tuple:
+    """Read a comma-separated list of integers such as "1,8,32"."""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return tuple(int(item) for item in value.split(",") if item.strip())
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment."""
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+class Settings:
+    """Settings for the handwriting service."""
+
+    def __init__(self):
+        """Load settings from the environment."""
+        # Cross-request micro-batching of model calls
+        self.batching_enabled = _env_bool("KALAM_BATCHING", True)
+        self.batch_max_wait_ms = _env_float("KALAM_BATCH_MAX_WAIT_MS", 10.0)
+        self.batch_max_size = _env_int("KALAM_BATCH_MAX_SIZE", 64)
+
+        # Backend running the model: "tensorflow", "xla", "numpy" or
+        # "tflite". The NumPy and TFLite engines read a file converted from
+        # the saved model, next to it by default. The NumPy engine's weight
+        # file is memory-mapped, so all workers on a host share one copy.
+        # Threads are the TFLite interpreter's, 0 leaves the interpreter
+        # default.
+        self.engine = os.environ.get("KALAM_ENGINE", "tensorflow")
+        self.weights_path = os.environ.get("KALAM_WEIGHTS_PATH") or None
+        self.engine_threads = _env_int("KALAM_ENGINE_THREADS", 0)
+
+        # Model precision: "float32", "float16" or "bfloat16". bfloat16
+        # runs on the tensorflow and xla engines on CPUs with native
+        # bfloat16, float16 on the tflite engine; the numpy engine is
+        # float32 only. Loading the model fails for other combinations.
+        self.precision = os.environ.get("KALAM_PRECISION", "float32")
+
+        # Warm-up run on startup before /ready reports healthy
+        self.warmup_enabled = _env_bool("KALAM_WARMUP", True)
+        self.warmup_batch_sizes = _env_int_list("KALAM_WARMUP_BATCH_SIZES", (1, 8, 32))
+        self.warmup_tsteps = _env_int_list("KALAM_WARMUP_TSTEPS", (80, 640))
+
+        # Threads running blocking inference and drawing for async routes
+        self.inference_workers = _env_int("KALAM_INFERENCE_WORKERS", 4)
+
+        # Start primed samples from a cached per-style post-priming state.
+        # The cached state approximates a full prime, replaying only the
+        # primer's last steps against each text, so seeded lines get other
+        # strokes than with it off. See benchmarks/prime_cache_drift.py.
+        self.prime_cache = _env_bool("KALAM_PRIME_CACHE", False)
+
+        # Sample model calls with seeded lines on the NumPy sampler over the
+        # engine's weights, one random generator per line, whatever
+        # KALAM_ENGINE is. This keeps a seed's strokes the same in any batch
+        # but is slower than the tensorflow, xla and tflite engines. Off,
+        # seeded lines run on the engine and repeat only while cached.
+        self.seeded_on_numpy = _env_bool("KALAM_SEEDED_ON_NUMPY", True)
+
+        # In-memory LRU cache of the strokes of seeded segments, in MB.
+        # 0 disables it.
+        self.stroke_cache_mb = _env_float("KALAM_STROKE_CACHE_MB", 64.0)
+
+        # SQLite stroke cache shared by the worker processes of a host, behind
+        # the in-memory one. Empty path disables it, "default" puts it in
+        # /dev/shm. Size in MB.
+        self.shared_cache_path = os.environ.get("KALAM_SHARED_CACHE_PATH", "")
+        self.shared_cache_mb = _env_float("KALAM_SHARED_CACHE_MB", 256.0)
+
+        # Directory of the on-disk stroke cache that survives restarts and
+        # is shared by every process using it, empty disables it. Size in MB.
+        self.disk_cache_dir = os.environ.get("KALAM_DISK_CACHE_DIR", "")
+        self.disk_cache_mb = _env_float("KALAM_DISK_CACHE_MB", 512.0)
+
+        # Library of sampled words that unseeded lines are assembled from,
+        # in MB, 0 disables it. A word keeps up to KALAM_WORD_VARIANTS
+        # variants and, until it has that many, is reused with probability
+        # KALAM_WORD_REUSE_RATE and sampled afresh otherwise.
+        self.word_library_mb = _env_float("KALAM_WORD_LIBRARY_MB", 0.0)
+        self.word_variants = _env_int("KALAM_WORD_VARIANTS", 8)
+        self.word_reuse_rate = _env_float("KALAM_WORD_REUSE_RATE", 0.8)
+
+        # Sampled documents kept server-side so they can be rendered again
+        # with other styling and spacing without the model, in MB. 0
+        # disables it.
+        self.document_store_mb = _env_float("KALAM_DOCUMENT_STORE_MB", 128.0)
+
+        # Let concurrent identical /generate, /a4page and style preview
+        # requests share one generation instead of each running the model
+        self.single_flight = _env_bool("KALAM_SINGLE_FLIGHT", True)
+
+        # Model worker processes, 0 runs the model in the API process.
+        # Threads per worker default to the size of its CPU subset.
+        self.worker_processes = _env_int("KALAM_WORKER_PROCESSES", 0)
+        self.worker_intra_op_threads = _env_int("KALAM_WORKER_INTRA_OP_THREADS", 0)
+
+
+settings = Settings()
@@ -1,4 +1,5 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.routes import handwriting_routes
 
@@ -20,8 +21,24 @@ app.add_middleware(
 # Include all routes
 app.include_router(handwriting_routes.router, prefix="/api/v1")
 
+# Warm the handwriting model up once the server starts
+app.add_event_handler("startup", handwriting_routes.warm_up_model)
+
 
 @app.get("/")
 async def root():
     """Root endpoint to check if the API is running"""
     return {"message": "Welcome to Kalam3 API"}
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe, healthy once the handwriting model has been warmed up"""
+    error = handwriting_routes.warmup_error()
+    if error is not None:
+        return JSONResponse(
+            status_code=503, content={"status": "warmup_failed", "detail": error}
+        )
+    if not handwriting_routes.hand.is_ready():
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready"}
@@ -0,0 +1,187 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+
+class _SampleRequest:
+    """Segments submitted by one caller, waiting to be batched."""
+
+    def __init__(
+        self,
+        lines: List[str],
+        biases: List[float],
+        styles: List[int],
+        seeds: List[Optional[int]],
+    ):
+        self.lines = lines
+        self.biases = biases
+        self.styles = styles
+        self.seeds = seeds
+        self.future = Future()
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching in front of the model.
+
+    Callers on different threads submit their segments and block on a future.
+    A single scheduler thread collects submissions for up to max_wait_ms (or
+    until max_batch_size segments are waiting), runs them through one call to
+    sample_fn and hands each caller back its own slice of the strokes.
+    """
+
+    def __init__(
+        self,
+        sample_fn: Callable[..., List[Any]],
+        max_wait_ms: float = 10.0,
+        max_batch_size: int = 64,
+    ):
+        """Start the scheduler thread around sample_fn(lines, biases, styles, seeds)."""
+        self.sample_fn = sample_fn
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+
+        self._queue = queue.Queue()
+        self._carry: Optional[_SampleRequest] = None
+        self._closed = False
+
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "batches": 0,
+            "requests": 0,
+            "segments": 0,
+            "max_batch_segments": 0,
+        }
+
+        self._thread = threading.Thread(
+            target=self._run, name="kalam-batch-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self,
+        lines: List[str],
+        biases: List[float],
+        styles: List[int],
+        seeds: Optional[List[Optional[int]]] = None,
+    ) -> Future:
+        """Queue segments for the next batch and return a future for their strokes."""
+        if self._closed:
+            raise RuntimeError("Batch scheduler is closed")
+
+        seeds = list(seeds) if seeds is not None else [None] * len(lines)
+        request = _SampleRequest(list(lines), list(biases), list(styles), seeds)
+        if not request.lines:
+            request.future.set_result([])
+            return request.future
+
+        self._queue.put(request)
+        return request.future
+
+    def sample(
+        self,
+        lines: List[str],
+        biases: List[float],
+        styles: List[int],
+        seeds: Optional[List[Optional[int]]] = None,
+    ) -> List[Any]:
+        """Submit segments and wait for their strokes."""
+        return self.submit(lines, biases, styles, seeds).result()
+
+    def close(self):
+        """Stop the scheduler thread once queued requests have been served."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the batching metrics."""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["mean_batch_segments"] = (
+            stats["segments"] / stats["batches"] if stats["batches"] else 0.0
+        )
+        return stats
+
+    def _next_request(self, timeout: Optional[float]) -> Optional[_SampleRequest]:
+        """Take the carried-over request first, then read from the queue."""
+        if self._carry is not None:
+            request, self._carry = self._carry, None
+            return request
+        return self._queue.get(timeout=timeout)
+
+    def _run(self):
+        """Scheduler loop: collect a batch, run it, repeat until closed."""
+        while True:
+            first = self._next_request(timeout=None)
+            if first is None:
+                return
+
+            batch = [first]
+            size = len(first.lines)
+            deadline = time.monotonic() + self.max_wait
+            stopping = False
+
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._next_request(timeout=remaining)
+                except queue.Empty:
+                    break
+
+                if request is None:
+                    stopping = True
+                    break
+
+                if size + len(request.lines) > self.max_batch_size:
+                    # Doesn't fit, start the next batch with it
+                    self._carry = request
+                    break
+
+                batch.append(request)
+                size += len(request.lines)
+
+            self._run_batch(batch)
+
+            if stopping:
+                # Serve anything still carried over before exiting
+                if self._carry is not None:
+                    carry, self._carry = self._carry, None
+                    self._run_batch([carry])
+                return
+
+    def _run_batch(self, batch: List[_SampleRequest]):
+        """Run one model call for the batch and resolve every caller's future."""
+        lines, biases, styles, seeds = [], [], [], []
+        for request in batch:
+            lines.extend(request.lines)
+            biases.extend(request.biases)
+            styles.extend(request.styles)
+            seeds.extend(request.seeds)
+
+        try:
+            samples = self.sample_fn(lines, biases, styles, seeds)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        offset = 0
+        for request in batch:
+            count = len(request.lines)
+            request.future.set_result(samples[offset : offset + count])
+            offset += count
+
+        with self._stats_lock:
+            self.stats["batches"] += 1
+            self.stats["requests"] += len(batch)
+            self.stats["segments"] += len(lines)
+            self.stats["max_batch_segments"] = max(
+                self.stats["max_batch_segments"], len(lines)
+            )
@@ -0,0 +1,131 @@
+import json
+import math
+import os
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+# Calibrated budgets are stored next to the style files under this name
+STEP_BUDGET_FILE = "step_budgets.json"
+
+# Share of calibration samples a style's budget must fit without truncation.
+# The steps used have a long tail of samples whose attention stalls on a
+# character and never finishes, covering those would mostly buy scribbles.
+# Hand samples the lines a budget cuts off again with the flat budget, so
+# this is also the share of lines sampled once.
+DEFAULT_COVERAGE = 0.95
+
+# Steps added to every budget on top of the margin, for very short texts
+BUDGET_SLACK_STEPS = 10
+
+
+def fit_style_budget(
+    texts: Sequence[str],
+    steps: Sequence[int],
+    coverage: float = DEFAULT_COVERAGE,
+    ridge: float = 50.0,
+) -> Dict:
+    """
+    Fit per-character step counts for one style.
+
+    steps[i] is the number of pen steps the model used to write texts[i].
+    The steps of each text are modelled as the sum of a per-character count,
+    fitted by least squares with every character pulled towards the style's
+    mean steps per character so rare characters get a sensible value. The
+    margin is the coverage quantile of actual over predicted steps, so that
+    share of the calibration samples fits within the budget.
+    """
+    chars = sorted({char for text in texts for char in text})
+    index = {char: i for i, char in enumerate(chars)}
+    counts = np.zeros((len(texts), len(chars)))
+    for row, text in enumerate(texts):
+        for char in text:
+            counts[row, index[char]] += 1
+    steps = np.asarray(steps, dtype=np.float64)
+
+    mean = steps.sum() / max(1.0, counts.sum())
+    prior = np.full(len(chars), mean)
+    residual = steps - counts @ prior
+    per_char = prior + np.linalg.solve(
+        counts.T @ counts + ridge * np.eye(len(chars)), counts.T @ residual
+    )
+    per_char = np.clip(per_char, 0.25 * mean, 4.0 * mean)
+
+    predicted = counts @ per_char
+    ratios = steps / np.maximum(predicted, 1.0)
+    margin = max(1.0, float(np.quantile(ratios, coverage)))
+
+    return {
+        "default": round(float(mean), 3),
+        "margin": round(margin, 3),
+        "chars": {char: round(float(value), 3) for char, value in zip(chars, per_char)},
+    }
+
+
+class StepBudget:
+    """
+    Per-style, per-character budget of sampling steps.
+
+    Picks sample_tsteps for a text from the steps its style needs for each
+    character, measured by a calibration run, instead of a flat
+    default_tsteps_per_char for every character. Styles without a
+    calibrated table use the flat default. engine is the engine the tables
+    were calibrated on, the only one they are valid for.
+    """
+
+    def __init__(
+        self,
+        styles: Optional[Dict[int, Dict]] = None,
+        default_tsteps_per_char: int = 40,
+        engine: Optional[str] = None,
+    ):
+        """Create a budget from calibrated tables keyed by style id."""
+        self.styles = styles or {}
+        self.default_tsteps_per_char = default_tsteps_per_char
+        self.engine = engine
+
+    @classmethod
+    def load(
+        cls, path: str, default_tsteps_per_char: int = 40, engine: Optional[str] = None
+    ) -> "StepBudget":
+        """
+        Load a calibrated budget, or an empty one if the file doesn't exist
+        or was calibrated on an engine other than engine.
+        """
+        if not os.path.exists(path):
+            return cls(default_tsteps_per_char=default_tsteps_per_char, engine=engine)
+
+        with open(path, "r") as f:
+            data = json.load(f)
+        calibrated_on = data.get("engine")
+        if engine is not None and calibrated_on not in (None, engine):
+            print(
+                f"Step budgets were calibrated on the {calibrated_on} engine, "
+                f"using the flat budget on {engine}"
+            )
+            return cls(default_tsteps_per_char=default_tsteps_per_char, engine=engine)
+
+        styles = {int(style_id): table for style_id, table in data["styles"].items()}
+        print(f"Loaded calibrated step budgets for {len(styles)} styles")
+        return cls(styles, default_tsteps_per_char, calibrated_on)
+
+    def save(self, path: str):
+        """Write the calibrated tables as JSON."""
+        data = {
+            "engine": self.engine,
+            "styles": {
+                str(style_id): table for style_id, table in sorted(self.styles.items())
+            },
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+    def tsteps(self, style_id: Optional[int], text: str) -> int:
+        """Steps to allow for writing text in a style."""
+        table = self.styles.get(style_id) if style_id is not None else None
+        if table is None:
+            return self.default_tsteps_per_char * len(text)
+
+        chars = table["chars"]
+        predicted = sum(chars.get(char, table["default"]) for char in text)
+        return int(math.ceil(table["margin"] * predicted)) + BUDGET_SLACK_STEPS
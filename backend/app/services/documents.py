@@ -0,0 +1,217 @@
+import copy
+import difflib
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Rough memory of a segment besides its strokes: the object, its text and
+# its styling attributes
+SEGMENT_OVERHEAD_BYTES = 512
+
+
+class SampledDocument:
+    """
+    A document whose segments have been sampled, ready to be rendered.
+
+    The segments' strokes are read-only and shared by every render, which
+    works on restyled copies of the segments. Lines can also be left
+    unsampled and filled in later, page by page, with missing() and fill().
+    """
+
+    def __init__(self, document_id: str, segments_by_line: List[List[Any]], **info):
+        """Wrap sampled segments, with info describing how they were sampled."""
+        self.document_id = document_id
+        self.segments_by_line = segments_by_line
+        self.info = info
+        self.version = 0
+        self._measure()
+
+    def _measure(self):
+        """Make the sampled strokes read-only and count the document's bytes."""
+        self.nbytes = 0
+        for line_segments in self.segments_by_line:
+            for segment in line_segments:
+                if segment.strokes is not None:
+                    strokes = np.asarray(segment.strokes)
+                    strokes.setflags(write=False)
+                    segment.strokes = strokes
+                    self.nbytes += strokes.nbytes
+                self.nbytes += SEGMENT_OVERHEAD_BYTES + len(segment.text)
+
+    def page_lines(self, page: int, lines_per_page: int) -> range:
+        """Indices of the lines on a page, numbered from 1."""
+        start = (page - 1) * lines_per_page
+        return range(start, min(start + lines_per_page, len(self.segments_by_line)))
+
+    def page_count(self, lines_per_page: int) -> int:
+        """Number of pages of lines_per_page lines."""
+        return -(-len(self.segments_by_line) // lines_per_page)
+
+    def missing(self, lines: Iterable[int]) -> Dict[int, List[Any]]:
+        """
+        Copies of the given lines that have unsampled segments, by index.
+        Sample the copies and hand them to fill(), so that renders running
+        meanwhile never see a half-sampled line.
+        """
+        return {
+            i: [copy.copy(segment) for segment in self.segments_by_line[i]]
+            for i in lines
+            if any(segment.strokes is None for segment in self.segments_by_line[i])
+        }
+
+    def fill(self, sampled: Dict[int, List[Any]]) -> int:
+        """
+        Give unsampled segments the strokes of sampled copies from missing().
+        Segments sampled meanwhile keep their strokes. Returns the number of
+        lines that got strokes.
+        """
+        filled = 0
+        for i, line_segments in sampled.items():
+            lines = zip(self.segments_by_line[i], line_segments)
+            missing = [(old, new) for old, new in lines if old.strokes is None]
+            for old, new in missing:
+                old.strokes = new.strokes
+            filled += bool(missing)
+        self._measure()
+        return filled
+
+    def restyled(
+        self, lines: Optional[Iterable[int]] = None, **styling
+    ) -> List[List[Any]]:
+        """
+        Copies of the segments with the given attributes (stroke_color,
+        stroke_width, ...) set on every one, sharing the sampled strokes.
+        With lines, only the lines with those indices are copied.
+        """
+        if lines is None:
+            lines = range(len(self.segments_by_line))
+        restyled = []
+        for line_segments in (self.segments_by_line[i] for i in lines):
+            line = []
+            for segment in line_segments:
+                segment = copy.copy(segment)
+                for name, value in styling.items():
+                    setattr(segment, name, value)
+                line.append(segment)
+            restyled.append(line)
+        return restyled
+
+
+def line_key(line_segments: List[Any]) -> Tuple:
+    """Everything a line's strokes depend on: its segments' text and sampling settings."""
+    return tuple(
+        (segment.text, segment.style_id, float(segment.bias), segment.seed)
+        for segment in line_segments
+    )
+
+
+def carry_over_strokes(
+    previous: SampledDocument, segments_by_line: List[List[Any]]
+) -> int:
+    """
+    Give the lines of a document that are unchanged since a previous version
+    of it the previous version's strokes, leaving the rest to be sampled.
+
+    The two versions' lines are diffed with difflib, so lines keep their
+    strokes when lines are inserted or removed before them. Returns the
+    number of lines that got strokes; unchanged lines the previous version
+    hadn't sampled yet don't count.
+    """
+    old_keys = [line_key(line) for line in previous.segments_by_line]
+    new_keys = [line_key(line) for line in segments_by_line]
+    matcher = difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+
+    reused = 0
+    for old_start, new_start, size in matcher.get_matching_blocks():
+        for offset in range(size):
+            old_line = previous.segments_by_line[old_start + offset]
+            new_line = segments_by_line[new_start + offset]
+            for old_segment, new_segment in zip(old_line, new_line):
+                new_segment.strokes = old_segment.strokes
+            reused += all(segment.strokes is not None for segment in new_line)
+    return reused
+
+
+class DocumentStore:
+    """
+    Sampled documents kept server-side so they can be rendered again with
+    other layout and styling without re-running the model.
+
+    Bounded in-memory LRU holding at most max_bytes of documents. Documents
+    are found by the random id they are stored under.
+    """
+
+    def __init__(self, max_bytes: int):
+        """Create an empty store holding up to max_bytes of documents."""
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._documents: "OrderedDict[str, SampledDocument]" = OrderedDict()
+        self.bytes = 0
+        self.stored = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, segments_by_line: List[List[Any]], **info) -> SampledDocument:
+        """
+        Store sampled segments under a new id and return the document.
+
+        Stored documents are never replaced: an edited version is stored
+        under an id of its own, since identical requests coalesced by
+        single-flight share the id of the version they got.
+        """
+        document = SampledDocument(uuid.uuid4().hex, segments_by_line, **info)
+        with self._lock:
+            self._documents[document.document_id] = document
+            self.bytes += document.nbytes
+            self.stored += 1
+            document.version = self.stored
+            self._evict()
+        return document
+
+    def fill(self, document: SampledDocument, sampled: Dict[int, List[Any]]) -> int:
+        """
+        Fill in lines of a stored document with SampledDocument.fill() and
+        account for the added strokes. Returns the number of lines filled.
+        """
+        with self._lock:
+            nbytes = document.nbytes
+            filled = document.fill(sampled)
+            if self._documents.get(document.document_id) is document:
+                self.bytes += document.nbytes - nbytes
+                self._evict()
+        return filled
+
+    def _evict(self):
+        """Evict least recently used documents until the store fits max_bytes."""
+        while self.bytes > self.max_bytes and len(self._documents) > 1:
+            _, evicted = self._documents.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def get(self, document_id: str) -> Optional[SampledDocument]:
+        """Return the document stored under document_id, or None."""
+        with self._lock:
+            document = self._documents.get(document_id)
+            if document is None:
+                self.misses += 1
+                return None
+            self._documents.move_to_end(document_id)
+            self.hits += 1
+            return document
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return size and usage metrics."""
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "stored": self.stored,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,614 @@
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from app.services.sampler import PRECISIONS, LSTMAttentionSampler, extract_weights
+from app.services.weight_file import map_weight_file, write_weight_file
+
+# Shape buckets the XLA engine compiles for. Batches are padded up to the
+# next batch bucket, step counts and primer lengths rounded up to a multiple
+# of their bucket size.
+XLA_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+XLA_TSTEPS_BUCKET = 256
+XLA_PRIME_LEN_BUCKET = 200
+
+# Precision TensorFlow graphs run in in this process, set by the first
+# TensorFlow engine, see _configure_tf_precision
+_tf_precision = None
+_tf_precision_lock = threading.Lock()
+
+
+class ModelEngine:
+    """
+    Backend that runs the sampling network.
+
+    Every engine takes the inputs of the saved model's serving_default
+    signature as NumPy arrays and returns its sampled_sequence output as a
+    float32 array of shape (num_samples, steps, 3).
+    """
+
+    name = ""
+
+    def sample(
+        self,
+        bias: np.ndarray,
+        c: np.ndarray,
+        c_len: np.ndarray,
+        num_samples: int,
+        prime: bool,
+        sample_tsteps: int,
+        x_prime: np.ndarray,
+        x_prime_len: np.ndarray,
+    ) -> np.ndarray:
+        """Run the sampling loop."""
+        raise NotImplementedError
+
+    def weights(self) -> Dict[str, np.ndarray]:
+        """Return the network weights keyed as in sampler.WEIGHT_NODES."""
+        raise NotImplementedError
+
+    def numpy_sampler(self) -> LSTMAttentionSampler:
+        """Return a NumPy sampler over this engine's weights."""
+        return LSTMAttentionSampler(self.weights())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return engine-specific metrics."""
+        return {}
+
+
+class SavedModelEngine(ModelEngine):
+    """Runs serving_default of the frozen saved model through TensorFlow."""
+
+    name = "tensorflow"
+
+    def __init__(
+        self, model_path: str = "saved_model/saved_model.pb", precision: str = "float32"
+    ):
+        """
+        Load the frozen model.
+
+        With precision "bfloat16", oneDNN's auto mixed precision pass runs
+        the graph's matmuls in bfloat16, which needs a CPU with native
+        support for it. The pass is a process-wide TensorFlow setting, so
+        all TensorFlow engines of a process must share one precision.
+        TensorFlow has no float16 compute on CPU. Raises ValueError for a
+        precision that can't be run.
+        """
+        if precision == "float16" or (
+            precision == "bfloat16" and not cpu_supports_bfloat16()
+        ):
+            raise ValueError(
+                f"The {self.name} engine can't compute in {precision} on this CPU,"
+                " use float32 or the tflite engine for float16"
+            )
+
+        self.tf = _configure_tf_precision(precision)
+        self.model = _load_saved_model(model_path)
+        self.precision = precision
+        self.signature = self.model.signatures["serving_default"]
+        print("Model loaded in native TensorFlow 2.x format!")
+
+    def sample(
+        self,
+        bias,
+        c,
+        c_len,
+        num_samples,
+        prime,
+        sample_tsteps,
+        x_prime,
+        x_prime_len,
+    ) -> np.ndarray:
+        """Call the serving signature."""
+        tf = self.tf
+        output = self.signature(
+            bias=tf.convert_to_tensor(bias, dtype=tf.float32),
+            c=tf.convert_to_tensor(c, dtype=tf.int32),
+            c_len=tf.convert_to_tensor(c_len, dtype=tf.int32),
+            num_samples=tf.convert_to_tensor(num_samples, dtype=tf.int32),
+            prime=tf.convert_to_tensor(prime, dtype=tf.bool),
+            sample_tsteps=tf.convert_to_tensor(sample_tsteps, dtype=tf.int32),
+            x_prime=tf.convert_to_tensor(x_prime, dtype=tf.float32),
+            x_prime_len=tf.convert_to_tensor(x_prime_len, dtype=tf.int32),
+        )
+        return output["sampled_sequence"].numpy()
+
+    def weights(self) -> Dict[str, np.ndarray]:
+        """Read the weight constants out of the frozen graph."""
+        return extract_weights(self.model)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the precision the graph runs in."""
+        return {"precision": self.precision}
+
+
+def _load_saved_model(model_path: str):
+    """Load the frozen saved model with TensorFlow."""
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found: {model_path}")
+
+    import tensorflow as tf
+
+    return tf.saved_model.load(os.path.dirname(model_path))
+
+
+def _configure_tf_precision(precision: str):
+    """
+    Make TensorFlow graphs of this process run in precision, and return the
+    tensorflow module. Raises ValueError if another TensorFlow engine of the
+    process already runs in a different precision.
+    """
+    global _tf_precision
+
+    import tensorflow as tf
+
+    with _tf_precision_lock:
+        if _tf_precision is not None and _tf_precision != precision:
+            raise ValueError(
+                f"TensorFlow already runs in {_tf_precision} in this process,"
+                f" can't also run in {precision}"
+            )
+        if precision == "bfloat16":
+            tf.config.optimizer.set_experimental_options(
+                {"auto_mixed_precision_onednn_bfloat16": True}
+            )
+        _tf_precision = precision
+    return tf
+
+
+class XLAEngine(SavedModelEngine):
+    """
+    Runs serving_default wrapped in XLA-compiled functions.
+
+    The graph's sampling loop runs many small ops per step, which XLA fuses.
+    XLA needs static shapes, so each call is padded to a shape bucket and
+    every bucket gets its own compiled function, built on first use (or by
+    Hand.warmup on startup) and cached. Padding samples have no characters
+    and finish on the first step, and the step count is rounded up and the
+    output cut back to the requested steps, so the result matches the
+    uncompiled signature. XLA compiles a bucket on its first call, and a
+    bucket whose first call fails falls back to the uncompiled signature
+    from then on. Errors of a bucket that has run before are raised.
+    """
+
+    name = "xla"
+
+    def __init__(
+        self, model_path: str = "saved_model/saved_model.pb", precision: str = "float32"
+    ):
+        """Load the frozen model."""
+        super().__init__(model_path, precision)
+        self._lock = threading.Lock()
+        self._compiled = {}
+        self._ran = set()
+        self.calls = 0
+        self.fallback_calls = 0
+
+    @staticmethod
+    def bucket(
+        num_samples: int, sample_tsteps: int, prime_len: int, char_len: int
+    ) -> Tuple[int, int, int, int]:
+        """Shape bucket of a call."""
+        batch = next((b for b in XLA_BATCH_BUCKETS if b >= num_samples), None)
+        if batch is None:
+            largest = XLA_BATCH_BUCKETS[-1]
+            batch = -(-num_samples // largest) * largest
+        tsteps = max(1, -(-sample_tsteps // XLA_TSTEPS_BUCKET)) * XLA_TSTEPS_BUCKET
+        prime_len = max(1, -(-prime_len // XLA_PRIME_LEN_BUCKET)) * XLA_PRIME_LEN_BUCKET
+        return batch, tsteps, prime_len, char_len
+
+    def _compile(self, key, prime: bool):
+        """Build the compiled function of a bucket."""
+        tf = self.tf
+        batch, tsteps, prime_len, char_len = key
+        signature = self.signature
+
+        @tf.function(
+            jit_compile=True,
+            input_signature=[
+                tf.TensorSpec([batch], tf.float32),
+                tf.TensorSpec([batch, char_len], tf.int32),
+                tf.TensorSpec([batch], tf.int32),
+                tf.TensorSpec([batch, prime_len, 3], tf.float32),
+                tf.TensorSpec([batch], tf.int32),
+            ],
+        )
+        def run(bias, c, c_len, x_prime, x_prime_len):
+            return signature(
+                bias=bias,
+                c=c,
+                c_len=c_len,
+                num_samples=tf.constant(batch, dtype=tf.int32),
+                prime=tf.constant(prime),
+                sample_tsteps=tf.constant(tsteps, dtype=tf.int32),
+                x_prime=x_prime,
+                x_prime_len=x_prime_len,
+            )["sampled_sequence"]
+
+        return run
+
+    def _compiled_for(self, key, prime: bool):
+        """
+        Cached function of a bucket, built on first use. XLA only compiles
+        it when it is first called, so this is None only for a bucket whose
+        first call has failed, see sample().
+        """
+        with self._lock:
+            if (key, prime) not in self._compiled:
+                self._compiled[(key, prime)] = self._compile(key, prime)
+            return self._compiled[(key, prime)]
+
+    def sample(
+        self,
+        bias,
+        c,
+        c_len,
+        num_samples,
+        prime,
+        sample_tsteps,
+        x_prime,
+        x_prime_len,
+    ) -> np.ndarray:
+        """Pad the call to its bucket and run the bucket's compiled function."""
+        prime = bool(prime)
+        x_prime_len = np.asarray(x_prime_len, dtype=np.int32)
+        prime_len = int(x_prime_len.max()) if prime and num_samples else 1
+        key = self.bucket(num_samples, sample_tsteps, prime_len, c.shape[1])
+        batch, _, prime_len, _ = key
+
+        run = self._compiled_for(key, prime)
+        with self._lock:
+            self.calls += 1
+        if run is not None:
+            padded_x_prime = np.zeros([batch, prime_len, 3], dtype=np.float32)
+            width = min(prime_len, x_prime.shape[1])
+            padded_x_prime[:num_samples, :width] = x_prime[:, :width]
+            try:
+                output = run(
+                    _pad(np.asarray(bias, dtype=np.float32), batch),
+                    _pad(np.asarray(c, dtype=np.int32), batch),
+                    _pad(np.asarray(c_len, dtype=np.int32), batch),
+                    padded_x_prime,
+                    _pad(x_prime_len, batch),
+                ).numpy()
+            except (self.tf.errors.OpError, TypeError, ValueError) as e:
+                # Tracing and compiling happen in the first call, so only
+                # that call's failure marks the bucket as failed
+                with self._lock:
+                    if (key, prime) in self._ran:
+                        raise
+                    self._compiled[(key, prime)] = None
+                print(f"Warning: XLA compilation failed for bucket {key}: {e}")
+            else:
+                with self._lock:
+                    self._ran.add((key, prime))
+                return output[:num_samples, :sample_tsteps]
+
+        with self._lock:
+            self.fallback_calls += 1
+        return super().sample(
+            bias, c, c_len, num_samples, prime, sample_tsteps, x_prime, x_prime_len
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the compiled buckets and how many calls fell back."""
+        with self._lock:
+            return {
+                **super().get_stats(),
+                "compiled_buckets": sorted(
+                    key for (key, _), run in self._compiled.items() if run is not None
+                ),
+                "failed_buckets": sorted(
+                    key for (key, _), run in self._compiled.items() if run is None
+                ),
+                "calls": self.calls,
+                "fallback_calls": self.fallback_calls,
+            }
+
+
+def _pad(array: np.ndarray, rows: int) -> np.ndarray:
+    """Pad an array with zero rows up to rows."""
+    if len(array) == rows:
+        return array
+    padding = np.zeros((rows - len(array),) + array.shape[1:], dtype=array.dtype)
+    return np.concatenate([array, padding])
+
+
+class NumpyEngine(ModelEngine):
+    """
+    Runs the sampling loop in NumPy over weights exported from the model.
+
+    Needs only NumPy at runtime. The weights are memory-mapped read-only
+    from a page-aligned weight file in the sampler's own layout, so every
+    worker process on a host shares one copy of them in the page cache. The
+    file is exported from the frozen model the first time it is missing,
+    which is the only time TensorFlow gets imported. A .npz weights_path is
+    loaded into private memory instead. NumPy has no half precision matmul,
+    so the engine only runs in float32.
+    """
+
+    name = "numpy"
+
+    def __init__(
+        self,
+        weights_path: str = "saved_model/weights.bin",
+        model_path: str = "saved_model/saved_model.pb",
+        precision: str = "float32",
+    ):
+        """Map the exported weights, exporting them first if needed."""
+        if precision != "float32":
+            raise ValueError(
+                f"The numpy engine computes in float32 only, not {precision}"
+            )
+
+        self.mapped = not weights_path.endswith(".npz")
+        if not os.path.exists(weights_path):
+            if self.mapped:
+                export_weight_file(model_path, weights_path)
+            else:
+                export_weights(model_path, weights_path)
+
+        if self.mapped:
+            arrays, metadata = map_weight_file(weights_path)
+            if metadata["precision"] != precision:
+                raise ValueError(
+                    f"{weights_path} holds {metadata['precision']} weights,"
+                    f" not {precision}"
+                )
+            self.sampler = LSTMAttentionSampler.from_stored_arrays(arrays, precision)
+        else:
+            with np.load(weights_path) as data:
+                weights = {key: data[key] for key in data.files}
+            self.sampler = LSTMAttentionSampler(weights)
+        print(f"Model weights loaded from {weights_path}")
+
+    def sample(
+        self,
+        bias,
+        c,
+        c_len,
+        num_samples,
+        prime,
+        sample_tsteps,
+        x_prime,
+        x_prime_len,
+    ) -> np.ndarray:
+        """Run the NumPy sampler, batched over samples."""
+        return self.sampler.sample(
+            bias=bias,
+            c=c,
+            c_len=c_len,
+            num_samples=num_samples,
+            prime=prime,
+            sample_tsteps=sample_tsteps,
+            x_prime=x_prime,
+            x_prime_len=x_prime_len,
+        )
+
+    def weights(self) -> Dict[str, np.ndarray]:
+        """Return the loaded weights."""
+        return self.sampler.export_weights()
+
+    def numpy_sampler(self) -> LSTMAttentionSampler:
+        """Share the engine's own sampler."""
+        return self.sampler
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the precision and whether the weights are memory-mapped."""
+        return {"precision": self.sampler.precision, "weights_mapped": self.mapped}
+
+
+class TFLiteEngine(ModelEngine):
+    """
+    Runs serving_default converted to a TFLite flatbuffer.
+
+    The flatbuffer is converted from the frozen model the first time it is
+    missing. The graph's Cholesky has no TFLite builtin and runs as a select
+    TF op, everything else uses builtin kernels with XNNPACK on CPU. The
+    standalone tflite_runtime interpreter is used when it is installed and
+    can run the model, otherwise TensorFlow's. With precision "float16" the
+    weights are stored in float16, which XNNPACK computes in natively on
+    CPUs that support it and widens to float32 on load elsewhere. TFLite
+    has no bfloat16 weights.
+    """
+
+    name = "tflite"
+
+    def __init__(
+        self,
+        tflite_path: str = "saved_model/model.tflite",
+        model_path: str = "saved_model/saved_model.pb",
+        num_threads: Optional[int] = None,
+        precision: str = "float32",
+    ):
+        """Load the flatbuffer into an interpreter, converting it first if needed."""
+        if precision == "bfloat16":
+            raise ValueError("The tflite engine has no bfloat16, use float16")
+        self.precision = precision
+        if not os.path.exists(tflite_path):
+            convert_to_tflite(model_path, tflite_path, precision)
+
+        self.interpreter = _tflite_interpreter(tflite_path, num_threads)
+        self.runner = self.interpreter.get_signature_runner("serving_default")
+
+        # An interpreter must not run calls concurrently
+        self._lock = threading.Lock()
+        self._model_path = model_path
+        print(f"TFLite model loaded from {tflite_path}")
+
+    def sample(
+        self,
+        bias,
+        c,
+        c_len,
+        num_samples,
+        prime,
+        sample_tsteps,
+        x_prime,
+        x_prime_len,
+    ) -> np.ndarray:
+        """Run the signature, resizing the inputs to this batch."""
+        with self._lock:
+            output = self.runner(
+                bias=np.asarray(bias, dtype=np.float32),
+                c=np.asarray(c, dtype=np.int32),
+                c_len=np.asarray(c_len, dtype=np.int32),
+                num_samples=np.array(num_samples, dtype=np.int32),
+                prime=np.array(prime, dtype=np.bool_),
+                sample_tsteps=np.array(sample_tsteps, dtype=np.int32),
+                x_prime=np.asarray(x_prime, dtype=np.float32),
+                x_prime_len=np.asarray(x_prime_len, dtype=np.int32),
+            )
+        return output["sampled_sequence"]
+
+    def weights(self) -> Dict[str, np.ndarray]:
+        """Read the weights from the saved model the flatbuffer came from."""
+        return SavedModelEngine(self._model_path).weights()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the precision of the flatbuffer's weights."""
+        return {"precision": self.precision}
+
+
+def _tflite_interpreter(tflite_path: str, num_threads: Optional[int]):
+    """Create an interpreter with tflite_runtime if it can run the model."""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+
+        interpreter = Interpreter(model_path=tflite_path, num_threads=num_threads)
+        interpreter.allocate_tensors()
+        return interpreter
+    except (ImportError, RuntimeError, ValueError):
+        # Not installed, or built without the select TF ops the model needs
+        pass
+
+    import tensorflow as tf
+
+    interpreter = tf.lite.Interpreter(model_path=tflite_path, num_threads=num_threads)
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+ENGINES = {
+    SavedModelEngine.name: SavedModelEngine,
+    NumpyEngine.name: NumpyEngine,
+    TFLiteEngine.name: TFLiteEngine,
+    XLAEngine.name: XLAEngine,
+}
+
+
+def default_weights_path(model_path: str) -> str:
+    """Path of the exported weight file next to the saved model."""
+    return os.path.join(os.path.dirname(model_path), "weights.bin")
+
+
+def default_tflite_path(model_path: str, precision: str = "float32") -> str:
+    """Path of the converted flatbuffer next to the saved model."""
+    suffix = "" if precision == "float32" else f".{precision}"
+    return os.path.join(os.path.dirname(model_path), f"model{suffix}.tflite")
+
+
+def cpu_supports_bfloat16() -> bool:
+    """Whether the CPU has native bfloat16 matmul instructions."""
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def export_weights(model_path: str, weights_path: str):
+    """Export the weight constants of the frozen model to a .npz file."""
+    print(f"Exporting model weights to {weights_path}")
+    weights = extract_weights(_load_saved_model(model_path))
+
+    # Write to a temporary name first so a concurrently starting worker
+    # never loads a half-written file
+    temp_path = f"{weights_path}.{os.getpid()}.tmp.npz"
+    np.savez(temp_path, **weights)
+    os.replace(temp_path, weights_path)
+
+
+def export_weight_file(model_path: str, weights_path: str):
+    """
+    Export the weights of the frozen model to a weight file for mapping.
+
+    The weights come from a weights.npz next to the saved model when there
+    is one, which spares importing TensorFlow.
+    """
+    print(f"Exporting model weights to {weights_path}")
+    npz_path = os.path.join(os.path.dirname(model_path), "weights.npz")
+    if os.path.exists(npz_path):
+        with np.load(npz_path) as data:
+            weights = {key: data[key] for key in data.files}
+    else:
+        weights = extract_weights(_load_saved_model(model_path))
+
+    sampler = LSTMAttentionSampler(weights)
+    write_weight_file(weights_path, sampler.stored_arrays(), {"precision": "float32"})
+
+
+def convert_to_tflite(model_path: str, tflite_path: str, precision: str = "float32"):
+    """Convert the serving signature of the frozen model to a TFLite flatbuffer."""
+    import tensorflow as tf
+
+    print(f"Converting model to TFLite at {tflite_path}")
+    converter = tf.lite.TFLiteConverter.from_saved_model(
+        os.path.dirname(model_path), signature_keys=["serving_default"]
+    )
+    converter.target_spec.supported_ops = [
+        tf.lite.OpsSet.TFLITE_BUILTINS,
+        tf.lite.OpsSet.SELECT_TF_OPS,
+    ]
+    if precision == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    flatbuffer = converter.convert()
+
+    temp_path = f"{tflite_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(flatbuffer)
+    os.replace(temp_path, tflite_path)
+
+
+def load_engine(
+    name: str,
+    model_path: str = "saved_model/saved_model.pb",
+    weights_path: Optional[str] = None,
+    num_threads: Optional[int] = None,
+    precision: str = "float32",
+) -> ModelEngine:
+    """
+    Create the engine registered under name.
+
+    weights_path is the file converted from the saved model for engines that
+    run one: the weight file (or a .npz) of the NumPy engine or the TFLite
+    flatbuffer. It defaults to a file next to the saved model. num_threads sets the
+    interpreter threads of the TFLite engine. precision is one of
+    sampler.PRECISIONS: numpy runs float32 only, tensorflow and xla also
+    bfloat16 on CPUs with native support, tflite also float16. An engine
+    raises ValueError for a precision it can't run.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"Unknown precision '{precision}', expected one of {PRECISIONS}"
+        )
+
+    if name == SavedModelEngine.name:
+        return SavedModelEngine(model_path, precision)
+    if name == XLAEngine.name:
+        return XLAEngine(model_path, precision)
+    if name == NumpyEngine.name:
+        return NumpyEngine(
+            weights_path or default_weights_path(model_path), model_path, precision
+        )
+    if name == TFLiteEngine.name:
+        return TFLiteEngine(
+            weights_path or default_tflite_path(model_path, precision),
+            model_path,
+            num_threads,
+            precision,
+        )
+    raise ValueError(f"Unknown model engine '{name}', expected one of {list(ENGINES)}")
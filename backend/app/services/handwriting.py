@@ -1,9 +1,57 @@
 import os
+import asyncio
+import functools
+import threading
+import time
 import numpy as np
-import tensorflow as tf
 import svgwrite
 from app.utils import drawing
-from typing import List, Dict, Any, Optional, Union, Tuple
+from app.services.batching import BatchScheduler
+from app.services.calibration import STEP_BUDGET_FILE, StepBudget
+from app.services.engines import load_engine
+from app.services.styles import StyleRegistry
+from app.services.sampler import PrimedStateCache, RowGenerators
+from app.services.stroke_cache import (
+    DiskStrokeCache,
+    SharedStrokeCache,
+    StrokeCache,
+)
+from app.services.word_library import WordStrokeLibrary
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    List,
+    Dict,
+    Any,
+    Optional,
+    Union,
+    Tuple,
+    Iterator,
+    AsyncIterator,
+    Callable,
+)
+
+# Upper bounds (in characters) of the length buckets used when batching
+# segments for sampling. Each bucket runs as its own model call so short
+# segments don't pay for the sequential steps of the longest one.
+SAMPLE_LENGTH_BUCKETS = (8, 16, 32, 48, 75)
+
+# Batch sizes and sampling step counts run by warmup()
+WARMUP_BATCH_SIZES = (1, 8, 32)
+WARMUP_TSTEPS = (80, 640)
+
+# Timesteps the sampling loop is allowed per character of text, for styles
+# without a calibrated step budget
+TSTEPS_PER_CHAR = 40
+
+# Most pages iter_multi_page() samples in one model call after the first
+# page. A call's time depends far more on its longest line than on how many
+# lines it has, so fewer, larger chunks finish the document sooner.
+PIPELINE_MAX_CHUNK_PAGES = 8
+
+# Fewest pages for which iter_multi_page() samples the first page on its
+# own. The extra model call costs about as much as the first page saves for
+# shorter documents, so those are sampled in one call.
+PIPELINE_MIN_PAGES = 3
 
 
 class TextSegment:
@@ -20,17 +68,31 @@ class TextSegment:
         stroke_color: str = "black",
         stroke_width: float = 2.0,
         scale: float = 1.0,
+        seed: Optional[int] = None,
     ):
-        """Initialize a text segment with styling properties."""
+        """
+        Initialize a text segment with styling properties.
+
+        With a seed, the segment is sampled reproducibly: the same text,
+        style, bias and seed give the same strokes.
+        """
         self.text = text
         self.style_id = style_id
         self.bias = bias
         self.stroke_color = stroke_color
         self.stroke_width = stroke_width
         self.scale = scale
+        self.seed = seed
         self.strokes = None  # Will be populated after sampling
 
 
+def derive_seed(seed: int, index: int) -> int:
+    """The index-th seed derived from a base seed, index 0 being the seed itself."""
+    if index == 0:
+        return seed
+    return int(np.random.SeedSequence([seed, index]).generate_state(1)[0])
+
+
 class LayoutConfig:
     """Configuration for text layout."""
 
@@ -57,24 +119,296 @@ class LayoutConfig:
 class Hand:
     """Hand implementation that uses the exported frozen model."""
 
-    def __init__(self, model_path="saved_model/saved_model.pb"):
-        """Initialize the hand with the exported frozen model."""
+    def __init__(
+        self,
+        model_path="saved_model/saved_model.pb",
+        max_workers: int = 4,
+        load_model: bool = True,
+        styles_dir: str = "styles",
+        prime_cache: bool = False,
+        engine: str = "tensorflow",
+        weights_path: Optional[str] = None,
+        lazy: bool = False,
+        engine_threads: Optional[int] = None,
+        precision: str = "float32",
+        seeded_on_numpy: bool = True,
+    ):
+        """
+        Initialize the hand with the exported frozen model.
+
+        Pass load_model=False when sampling is delegated to a WorkerPool, so
+        this process doesn't hold a copy of the model it never runs. With
+        prime_cache, primed samples start from a cached per-style state
+        instead of re-running the primer strokes on every call. That state
+        is an approximation, see enable_prime_cache().
+
+        engine selects the backend that runs the model: "tensorflow" calls
+        the saved model's serving signature, "numpy" runs the same sampling
+        loop in NumPy over weights memory-mapped from weights_path and
+        "tflite" runs the signature converted to a TFLite flatbuffer at
+        weights_path, with engine_threads interpreter threads. "xla" runs
+        the signature XLA-compiled per shape bucket. precision ("float32",
+        "float16" or "bfloat16") selects reduced-precision weights or
+        compute, for the engines that support it, see load_engine. With lazy, the model is
+        loaded by warmup() or the first sampling call instead of here, so
+        creating a Hand is cheap.
+
+        With seeded_on_numpy, a call with any seeded line runs on the NumPy
+        sampler over the engine's weights whatever the engine, with one
+        random generator per line, so a seed gives the same strokes in any
+        batch. That path is slower than the tensorflow, xla and tflite
+        engines. Without it seeded lines run on the engine like the others
+        and their seed only picks the stroke cache entry: strokes repeat
+        while cached and are sampled afresh on a miss.
+        """
         os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Only show errors, not warnings/info
         self.model_path = model_path
+        self.engine_name = engine
+        self.weights_path = weights_path
+        self.engine_threads = engine_threads
+        self.precision = precision
+        self.seeded_on_numpy = seeded_on_numpy
+        self.engine = None
         self.session = None
         self.base_line_height = 60  # Base line height in pixels
 
-        # Load the model
-        self._load_model()
+        # Part of the stroke cache key, changes when the model does
+        self.model_version = self._model_version()
+
+        # Primer data for every style, loaded once
+        self.styles = StyleRegistry(styles_dir)
+
+        # Sampling steps allowed per style and character, calibrated by
+        # benchmarks/calibrate_step_budget.py for this hand's engine. Lines
+        # cut off by a calibrated budget are sampled again, see _sample().
+        self.step_budget = StepBudget.load(
+            os.path.join(styles_dir, STEP_BUDGET_FILE), TSTEPS_PER_CHAR, engine
+        )
+
+        # Sampling metrics, see get_sampling_stats()
+        self._stats_lock = threading.Lock()
+        self.sampling_stats = {
+            "model_calls": 0,
+            "segments_sampled": 0,
+            "padded_steps_unbucketed": 0,
+            "padded_steps_bucketed": 0,
+            "steps_budgeted": 0,
+            "steps_run": 0,
+            "steps_used": 0,
+            "truncated_samples": 0,
+            "budget_retries": 0,
+        }
+
+        # Optional cross-request batching, see enable_batching()
+        self.scheduler = None
+
+        # Optional caches of seeded segments' strokes: in memory, shared
+        # with the other worker processes and on disk, looked up in that
+        # order. See enable_stroke_cache(), enable_shared_cache() and
+        # enable_disk_cache().
+        self.stroke_cache = None
+        self.shared_cache = None
+        self.disk_cache = None
+
+        # Optional library of sampled words that unseeded lines are
+        # assembled from, see enable_word_library()
+        self.word_library = None
+
+        # Bounded pool for inference and drawing behind the async methods.
+        # TF releases the GIL while the graph runs, so requests overlap.
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="kalam-hand"
+        )
+
+        # Optional model worker processes, see enable_worker_pool()
+        self.worker_pool = None
+
+        # Set once warmup() has run, see is_ready()
+        self._ready = threading.Event()
+
+        # Sampler over the model weights that can start from a cached
+        # post-priming state, see enable_prime_cache()
+        self.sampler = None
+        self.primed_states = None
+        self._sampler_lock = threading.Lock()
+
+        # Load the model, now or on first use
+        self._model_lock = threading.Lock()
+        self._load_on_use = load_model
+        self._prime_cache_on_load = prime_cache
+        if load_model and not lazy:
+            self._ensure_model()
 
     def _load_model(self):
-        """Load the frozen model."""
-        if not os.path.exists(self.model_path):
-            raise FileNotFoundError(f"Model file not found: {self.model_path}")
+        """Load the model into the configured engine."""
+        self.engine = load_engine(
+            self.engine_name,
+            self.model_path,
+            self.weights_path,
+            self.engine_threads,
+            self.precision,
+        )
 
-        # TensorFlow 2.x way to load saved model
-        self.model = tf.saved_model.load(os.path.dirname(self.model_path))
-        print("Model loaded in native TensorFlow 2.x format!")
+    def _model_version(self) -> str:
+        """Identify the model weights and precision sampling runs with."""
+        try:
+            stat = os.stat(self.model_path)
+        except OSError:
+            return f"unversioned/{self.precision}"
+        return f"{stat.st_size:x}-{int(stat.st_mtime):x}/{self.precision}"
+
+    def _ensure_model(self):
+        """Load the model if this hand runs it and it isn't loaded yet."""
+        if self.engine is not None or not self._load_on_use:
+            return
+        with self._model_lock:
+            if self.engine is None:
+                self._load_model()
+                if self._prime_cache_on_load:
+                    self.enable_prime_cache()
+
+    def enable_batching(self, max_wait_ms: float = 10.0, max_batch_size: int = 64):
+        """
+        Route sampling through a BatchScheduler so segments from concurrent
+        callers share model calls.
+        """
+        if self.scheduler is None:
+            self.scheduler = BatchScheduler(
+                self._sample_lines,
+                max_wait_ms=max_wait_ms,
+                max_batch_size=max_batch_size,
+            )
+
+    def enable_prime_cache(self):
+        """
+        Sample primed segments from cached per-style post-priming states.
+
+        The cached state is primed against the style's own characters and
+        only the last PRIME_TAIL_STEPS primer steps are replayed against
+        each text, so it approximates a full prime rather than matching it.
+        benchmarks/prime_cache_drift.py measures the difference: the hidden
+        state stays within 1e-3 of a full prime on the shipped styles, but
+        a seed's strokes usually differ from the ones it gets without the
+        cache.
+        """
+        self._ensure_model()
+        if self.primed_states is None:
+            self.primed_states = PrimedStateCache(self._numpy_sampler())
+
+    def enable_stroke_cache(self, max_bytes: int):
+        """Cache the strokes of seeded segments, up to max_bytes of them."""
+        if self.stroke_cache is None:
+            self.stroke_cache = StrokeCache(max_bytes)
+
+    def enable_shared_cache(self, path: str, max_bytes: int):
+        """
+        Share the strokes of seeded segments with every worker process that
+        opens the database at path, up to max_bytes of them. Looked up after
+        the in-memory stroke cache, which acts as its local front.
+        """
+        if self.shared_cache is None:
+            self.shared_cache = SharedStrokeCache(path, max_bytes)
+
+    def enable_disk_cache(self, path: str, max_bytes: int):
+        """
+        Persist the strokes of seeded segments in directory path, up to
+        max_bytes of them, so they survive restarts. Looked up after the
+        in-memory and shared caches, if those are enabled too.
+        """
+        if self.disk_cache is None:
+            self.disk_cache = DiskStrokeCache(path, max_bytes)
+
+    def enable_word_library(
+        self, max_bytes: int, max_variants: int = 8, reuse_rate: float = 0.8
+    ):
+        """
+        Keep the strokes of sampled words, up to max_bytes of them, and
+        assemble unseeded segments from them, sampling only the words
+        without a reusable variant. See WordStrokeLibrary for how
+        max_variants and reuse_rate keep repeated words varied.
+        """
+        if self.word_library is None:
+            self.word_library = WordStrokeLibrary(max_bytes, max_variants, reuse_rate)
+
+    def _stroke_caches(self) -> List:
+        """The enabled stroke caches in lookup order."""
+        return [
+            cache
+            for cache in (self.stroke_cache, self.shared_cache, self.disk_cache)
+            if cache is not None
+        ]
+
+    def _numpy_sampler(self):
+        """The NumPy sampler over the engine's weights, created on first use."""
+        if self.sampler is None:
+            with self._sampler_lock:
+                if self.sampler is None:
+                    self.sampler = self.engine.numpy_sampler()
+        return self.sampler
+
+    def enable_worker_pool(self, worker_pool):
+        """Send sampling and render jobs to a WorkerPool instead of running them here."""
+        self.worker_pool = worker_pool
+
+    def warmup(
+        self,
+        batch_sizes: Tuple[int, ...] = WARMUP_BATCH_SIZES,
+        tsteps: Tuple[int, ...] = WARMUP_TSTEPS,
+    ):
+        """
+        Run the model on synthetic inputs so real requests don't pay for
+        initialization, then mark the hand ready.
+
+        Every batch size is run primed with a bundled style at every step
+        count, which covers graph initialization and kernel selection for
+        the common shapes. Primed states of all styles are cached too if
+        the prime cache is enabled.
+        """
+        start = time.perf_counter()
+        self._ensure_model()
+        if self.worker_pool is not None:
+            self.worker_pool.warmup(batch_sizes, tsteps)
+        elif self.engine is not None:
+            style_ids = self.styles.ids()
+            style = self.styles.get(style_ids[0]) if style_ids else None
+            chars_row = (
+                style.encode_text("Warming up")
+                if style is not None
+                else drawing.encode_ascii("Warming up")
+            )
+
+            for num_samples in batch_sizes:
+                x_prime = np.zeros([num_samples, 1200, 3], dtype=np.float32)
+                x_prime_len = np.zeros([num_samples], dtype=np.int32)
+                chars = np.zeros([num_samples, 120], dtype=np.int32)
+                chars[:, : len(chars_row)] = chars_row
+                chars_len = np.full([num_samples], len(chars_row), dtype=np.int32)
+                if style is not None:
+                    x_prime[:, : style.strokes_len] = style.strokes
+                    x_prime_len[:] = style.strokes_len
+
+                for sample_tsteps in tsteps:
+                    self.engine.sample(
+                        bias=np.full([num_samples], 0.5, dtype=np.float32),
+                        c=chars,
+                        c_len=chars_len,
+                        num_samples=num_samples,
+                        prime=style is not None,
+                        sample_tsteps=sample_tsteps,
+                        x_prime=x_prime,
+                        x_prime_len=x_prime_len,
+                    )
+
+            if self.primed_states is not None:
+                for style_id in style_ids:
+                    self.primed_states.get(self.styles.get(style_id), 120)
+
+        self._ready.set()
+        print(f"Model warmed up in {time.perf_counter() - start:.1f}s")
+
+    def is_ready(self) -> bool:
+        """Whether warmup() has finished."""
+        return self._ready.is_set()
 
     def write(
         self,
@@ -85,10 +419,12 @@ class Hand:
         stroke_colors: Optional[List[str]] = None,
         stroke_widths: Optional[List[float]] = None,
         scales: Optional[List[float]] = None,
+        seed: Optional[int] = None,
     ):
         """
         Generate handwriting for the given text lines and save as SVG.
         This method retains backward compatibility with the original API.
+        With a seed the lines are sampled reproducibly, see seed_segments().
         """
         # Create text segments from lines (for backward compatibility)
         segments_by_line = []
@@ -115,6 +451,8 @@ class Hand:
             )
             segments_by_line.append([segment])
 
+        self.seed_segments(segments_by_line, seed)
+
         # Use the new method with the segments
         self.write_segments(filename, segments_by_line)
 
@@ -146,10 +484,42 @@ class Hand:
         self._sample_segments(segments_by_line)
 
         # Draw all segments with their respective styling
-        self._draw_segments(
-            filename, segments_by_line, layout_config, page_dimensions, margins
+        if self.worker_pool is not None:
+            self.worker_pool.submit_draw(
+                filename, segments_by_line, layout_config, page_dimensions, margins
+            ).result()
+        else:
+            self._draw_segments(
+                filename, segments_by_line, layout_config, page_dimensions, margins
+            )
+
+    async def _run_in_executor(self, func, *args, **kwargs):
+        """Run a blocking Hand method in the executor without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
         )
 
+    async def awrite(self, *args, **kwargs):
+        """Async version of write(), runs in the hand's executor."""
+        return await self._run_in_executor(self.write, *args, **kwargs)
+
+    async def awrite_segments(self, *args, **kwargs):
+        """Async version of write_segments(), runs in the hand's executor."""
+        return await self._run_in_executor(self.write_segments, *args, **kwargs)
+
+    async def awrite_multi_page(self, *args, **kwargs) -> List[str]:
+        """Async version of write_multi_page(), runs in the hand's executor."""
+        return await self._run_in_executor(self.write_multi_page, *args, **kwargs)
+
+    async def asample_document(self, *args, **kwargs) -> List[List[TextSegment]]:
+        """Async version of sample_document(), runs in the hand's executor."""
+        return await self._run_in_executor(self.sample_document, *args, **kwargs)
+
+    async def arender_multi_page(self, *args, **kwargs) -> List[str]:
+        """Async version of render_multi_page(), runs in the hand's executor."""
+        return await self._run_in_executor(self.render_multi_page, *args, **kwargs)
+
     def process_text(
         self,
         text: str,
@@ -225,6 +595,29 @@ class Hand:
 
         return segments_by_line
 
+    @staticmethod
+    def seed_segments(segments_by_line: List[List[TextSegment]], seed: Optional[int]):
+        """
+        Give every segment without a seed one derived from seed.
+
+        Repeats of the same text in the same style get different seeds, so
+        a word that appears twice isn't written identically. Otherwise the
+        seed of a segment doesn't depend on the segments around it, so
+        editing one line of a document leaves the others' seeds alone.
+        """
+        if seed is None:
+            return
+
+        occurrences = {}
+        for line_segments in segments_by_line:
+            for segment in line_segments:
+                if segment.seed is not None:
+                    continue
+                key = (segment.text, segment.style_id)
+                index = occurrences.get(key, 0)
+                occurrences[key] = index + 1
+                segment.seed = derive_seed(seed, index)
+
     def _validate_segments(self, segments_by_line: List[List[TextSegment]]):
         """Validate all characters in the segments."""
         valid_char_set = set(drawing.alphabet)
@@ -244,33 +637,343 @@ class Hand:
                             f"segment {segment_num}. Valid character set is {valid_char_set}"
                         )
 
+                if segment.seed is not None and not 0 <= segment.seed < 2**63:
+                    raise ValueError(
+                        f"Seed of line {line_num}, segment {segment_num} must be a "
+                        f"non-negative 64-bit integer, got {segment.seed}"
+                    )
+
     def _sample_segments(self, segments_by_line: List[List[TextSegment]]):
-        """Sample strokes for each segment and store in the segment objects."""
+        """
+        Sample strokes for each segment and store in the segment objects.
+
+        Segments that already have strokes, e.g. carried over from an
+        earlier version of the document, are kept as they are. Seeded
+        segments are looked up in the enabled stroke caches first and only
+        the misses are sampled. With the word library, unseeded
+        segments are assembled from stored words where it offers them: a
+        segment with no reusable word is sampled whole and split into the
+        library, otherwise only its missing words are sampled.
+        """
         # Flatten all segments for batch processing
         all_segments = []
         for line_segments in segments_by_line:
             all_segments.extend(line_segments)
 
+        caching = bool(self._stroke_caches())
+        keys = [None] * len(all_segments)
+        pending = []
+        for i, segment in enumerate(all_segments):
+            if segment.strokes is not None:
+                continue
+            if caching and segment.seed is not None:
+                keys[i] = self._stroke_cache_key(segment)
+                strokes = self._cached_strokes(keys[i])
+                if strokes is not None:
+                    segment.strokes = strokes
+                    continue
+            pending.append(i)
+
         # Skip if no segments
-        if not all_segments:
+        if not pending:
             return
 
-        # Prepare data for model input
-        texts = [segment.text for segment in all_segments]
-        biases = [segment.bias for segment in all_segments]
-        styles = [segment.style_id for segment in all_segments]
+        # Pick stored words for the unseeded segments, a variant at most
+        # once per document
+        plans = {}
+        if self.word_library is not None:
+            used = set()
+            for i in pending:
+                segment = all_segments[i]
+                words = segment.text.split()
+                if segment.seed is None and words:
+                    style_key = self._word_style_key(segment)
+                    runs = [
+                        self.word_library.choose(style_key, word, used)
+                        for word in words
+                    ]
+                    plans[i] = (style_key, words, runs)
+
+        # Sample whole segments, or the missing words of partly stored ones
+        jobs = []
+        for i in pending:
+            plan = plans.get(i)
+            if plan is not None and any(run is not None for run in plan[2]):
+                _, words, runs = plan
+                jobs.extend(
+                    (i, j, word)
+                    for j, (word, run) in enumerate(zip(words, runs))
+                    if run is None
+                )
+            else:
+                jobs.append((i, None, all_segments[i].text))
 
-        # Generate strokes for all segments
-        strokes = self._sample(texts, biases=biases, styles=styles)
+        strokes = self._sample_texts(
+            [all_segments[i] for i, _, _ in jobs], [text for _, _, text in jobs]
+        )
 
-        # Assign strokes back to segments
-        for i, segment in enumerate(all_segments):
-            segment.strokes = strokes[i]
+        # Assign strokes back to segments, caching the seeded ones and
+        # storing words in the library
+        for (i, j, text), segment_strokes in zip(jobs, strokes):
+            plan = plans.get(i)
+            if j is not None:
+                stored = self.word_library.add_line(plan[0], [text], segment_strokes)
+                plan[2][j] = stored[0] if stored else None
+                continue
+            if keys[i] is not None and segment_strokes is not None:
+                segment_strokes = self._cache_strokes(keys[i], segment_strokes)
+            elif plan is not None and segment_strokes is not None:
+                self.word_library.add_line(plan[0], plan[1], segment_strokes)
+            all_segments[i].strokes = segment_strokes
+
+        # A word sampled on its own that didn't split cleanly has no run,
+        # sample its segment whole instead of assembling it without the word
+        retry = [
+            i
+            for i, (_, _, runs) in plans.items()
+            if all_segments[i].strokes is None and any(run is None for run in runs)
+        ]
+        retry_segments = [all_segments[i] for i in retry]
+        retry_strokes = self._sample_texts(
+            retry_segments, [segment.text for segment in retry_segments]
+        )
+        for i, segment_strokes in zip(retry, retry_strokes):
+            style_key, words, _ = plans.pop(i)
+            if segment_strokes is not None:
+                self.word_library.add_line(style_key, words, segment_strokes)
+            all_segments[i].strokes = segment_strokes
+
+        # Assemble the segments made of stored words
+        for i, (style_key, words, runs) in plans.items():
+            if all_segments[i].strokes is None:
+                all_segments[i].strokes = self.word_library.assemble(
+                    style_key, words, runs
+                )
+
+    def _sample_texts(
+        self, segments: List[TextSegment], texts: List[str]
+    ) -> List[np.ndarray]:
+        """
+        Sample texts with the bias, style and seed of the matching segments,
+        batched with other callers if enabled.
+        """
+        if not texts:
+            return []
+        biases = [segment.bias for segment in segments]
+        styles = [segment.style_id for segment in segments]
+        seeds = [segment.seed for segment in segments]
+        if self.scheduler is not None:
+            return self.scheduler.sample(texts, biases, styles, seeds)
+        return self._sample_lines(texts, biases, styles, seeds)
+
+    def _cached_strokes(self, key: Tuple) -> Optional[np.ndarray]:
+        """
+        Look strokes up in each cache in turn and copy a hit into the
+        caches before the one it was found in.
+        """
+        caches = self._stroke_caches()
+        for level, cache in enumerate(caches):
+            strokes = cache.get(key)
+            if strokes is not None:
+                return self._cache_strokes(key, strokes, caches[:level])
+        return None
+
+    def _cache_strokes(
+        self, key: Tuple, strokes: np.ndarray, caches: Optional[List] = None
+    ) -> np.ndarray:
+        """Store strokes in the given caches, all enabled ones by default."""
+        for cache in reversed(caches if caches is not None else self._stroke_caches()):
+            stored = cache.put(key, strokes)
+            if stored is not None:
+                strokes = stored
+        return strokes
+
+    def _sampling_path(self) -> Tuple:
+        """
+        How this hand samples: the engine, its precision, whether seeded
+        lines run on the NumPy sampler and whether primed samples start
+        from cached states. Strokes sampled along another path differ, so
+        this is part of every cache key.
+        """
+        return (
+            self.model_version,
+            self.engine_name,
+            self.precision,
+            self.seeded_on_numpy,
+            self._prime_cache_on_load or self.primed_states is not None,
+        )
+
+    def _stroke_cache_key(self, segment: TextSegment) -> Tuple:
+        """Everything a seeded segment's strokes depend on."""
+        style = self.styles.get(segment.style_id)
+        return (
+            segment.text,
+            segment.style_id,
+            style.fingerprint if style is not None else None,
+            float(segment.bias),
+            segment.seed,
+        ) + self._sampling_path()
+
+    def _word_style_key(self, segment: TextSegment) -> Tuple:
+        """Everything but the text that a segment's words' strokes depend on."""
+        key = self._stroke_cache_key(segment)
+        return key[1:4] + key[5:]
+
+    def _sample_lines(self, lines, biases, styles, seeds=None):
+        """Sample lines on the worker pool if there is one, otherwise in-process."""
+        if self.worker_pool is not None:
+            return self.worker_pool.sample(lines, biases, styles, seeds)
+        return self._sample_bucketed(lines, biases=biases, styles=styles, seeds=seeds)
+
+    def _sample_bucketed(self, lines, biases=None, styles=None, seeds=None):
+        """
+        Sample lines grouped into length buckets, one model call per bucket.
+
+        The sampling loop runs for the largest step budget of a call, so
+        batching a short heading with a long line makes the heading run the
+        long line's step count too. Results come back in input order.
+        """
+        if biases is None:
+            biases = [0.5] * len(lines)
+
+        results = [None] * len(lines)
+        buckets = {}
+        for i, line in enumerate(lines):
+            if not line:
+                # Nothing to write, don't spend model steps on it
+                results[i] = np.zeros((0, 3), dtype=np.float32)
+                continue
+            buckets.setdefault(self._length_bucket(len(line)), []).append(i)
+
+        for bound in sorted(buckets):
+            indices = buckets[bound]
+            samples = self._sample(
+                [lines[i] for i in indices],
+                biases=[biases[i] for i in indices],
+                styles=[styles[i] for i in indices] if styles is not None else None,
+                seeds=[seeds[i] for i in indices] if seeds is not None else None,
+            )
+            for i, sample in zip(indices, samples):
+                results[i] = sample
+
+        self._record_bucket_stats(lines, styles, buckets)
+        return results
+
+    @staticmethod
+    def _length_bucket(length: int) -> int:
+        """Return the upper bound of the length bucket for a text length."""
+        for bound in SAMPLE_LENGTH_BUCKETS:
+            if length <= bound:
+                return bound
+        return SAMPLE_LENGTH_BUCKETS[-1]
 
-    def _sample(self, lines, biases=None, styles=None):
-        """Sample from the model to generate handwriting strokes."""
+    def _record_bucket_stats(self, lines, styles, buckets: Dict[int, List[int]]):
+        """
+        Record how many padded sample-steps bucketing avoided.
+
+        A padded step is one a sample spends in the loop beyond its own step
+        budget because a line with a larger budget shares its call.
+        """
+        if not buckets:
+            return
+
+        budgets = {
+            i: self.step_budget.tsteps(styles[i] if styles is not None else None, line)
+            for i, line in enumerate(lines)
+            if line
+        }
+        longest = max(budgets.values())
+        unbucketed = sum(longest - budget for budget in budgets.values())
+
+        bucketed = 0
+        for indices in buckets.values():
+            bucket_longest = max(budgets[i] for i in indices)
+            bucketed += sum(bucket_longest - budgets[i] for i in indices)
+
+        with self._stats_lock:
+            self.sampling_stats["model_calls"] += len(buckets)
+            self.sampling_stats["segments_sampled"] += len(budgets)
+            self.sampling_stats["padded_steps_unbucketed"] += unbucketed
+            self.sampling_stats["padded_steps_bucketed"] += bucketed
+
+    def get_sampling_stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the sampling metrics."""
+        with self._stats_lock:
+            stats = dict(self.sampling_stats)
+        stats["padded_steps_saved"] = (
+            stats["padded_steps_unbucketed"] - stats["padded_steps_bucketed"]
+        )
+        stats["early_stop_steps_saved"] = stats["steps_budgeted"] - stats["steps_run"]
+        if self.scheduler is not None:
+            stats["batching"] = self.scheduler.get_stats()
+        if self.primed_states is not None:
+            stats["prime_cache"] = self.primed_states.get_stats()
+        if self.stroke_cache is not None:
+            stats["stroke_cache"] = self.stroke_cache.get_stats()
+        if self.shared_cache is not None:
+            stats["shared_cache"] = self.shared_cache.get_stats()
+        if self.disk_cache is not None:
+            stats["disk_cache"] = self.disk_cache.get_stats()
+        if self.word_library is not None:
+            stats["word_library"] = self.word_library.get_stats()
+        if self.engine is not None:
+            stats["engine"] = {"name": self.engine.name, **self.engine.get_stats()}
+        return stats
+
+    def _sample(self, lines, biases=None, styles=None, seeds=None):
+        """
+        Sample from the model to generate handwriting strokes.
+
+        If any line has a seed and seeded_on_numpy is set, the call runs on
+        the NumPy sampler with one random generator and one step limit per
+        line, so a seeded line's strokes don't depend on the lines it is
+        batched with. The engines' own sampling draws from a single random
+        stream for the whole batch, so without seeded_on_numpy seeds are
+        ignored here.
+        """
+        self._ensure_model()
+        style_ids = styles if styles is not None else [None] * len(lines)
+        budgets = [
+            self.step_budget.tsteps(style_id, line)
+            for style_id, line in zip(style_ids, lines)
+        ]
+        samples, limits = self._sample_within(lines, biases, styles, seeds, budgets)
+
+        # A calibrated budget cuts off the few lines that need more steps
+        # than its margin allows. Sample those again with the flat budget
+        # rather than end them mid-word.
+        retry = [
+            i
+            for i, (sample, limit, line) in enumerate(zip(samples, limits, lines))
+            if len(sample) >= limit and limit < TSTEPS_PER_CHAR * len(line)
+        ]
+        if retry:
+
+            def pick(values):
+                return None if values is None else [values[i] for i in retry]
+
+            resampled, _ = self._sample_within(
+                pick(lines),
+                pick(biases),
+                pick(styles),
+                pick(seeds),
+                [TSTEPS_PER_CHAR * len(lines[i]) for i in retry],
+            )
+            for i, sample in zip(retry, resampled):
+                samples[i] = sample
+            with self._stats_lock:
+                self.sampling_stats["budget_retries"] += len(retry)
+        return samples
+
+    def _sample_within(self, lines, biases, styles, seeds, budgets):
+        """
+        Run one model call, each line within its step budget.
+
+        Returns the samples and the step limit each one actually ran with,
+        which is the largest budget of the call unless it is seeded.
+        """
         num_samples = len(lines)
-        max_tsteps = 40 * max([len(i) for i in lines])
+        max_tsteps = max(budgets)
 
         # Convert string biases to float if necessary
         if biases is not None:
@@ -278,34 +981,31 @@ class Hand:
         else:
             biases = [0.5] * num_samples
 
-        x_prime = np.zeros([num_samples, 1200, 3])
-        x_prime_len = np.zeros([num_samples])
-        chars = np.zeros([num_samples, 120])
-        chars_len = np.zeros([num_samples])
-
-        if styles is not None:
-            for i, (cs, style) in enumerate(zip(lines, styles)):
-                try:
-                    # Use the original approach - load style from files
-                    x_p = np.load(f"styles/style-{style}-strokes.npy")
-                    c_p = (
-                        np.load(f"styles/style-{style}-chars.npy")
-                        .tobytes()
-                        .decode("utf-8")
-                    )
+        x_prime = np.zeros([num_samples, 1200, 3], dtype=np.float32)
+        x_prime_len = np.zeros([num_samples], dtype=np.int32)
+        chars = np.zeros([num_samples, 120], dtype=np.int32)
+        chars_len = np.zeros([num_samples], dtype=np.int32)
 
-                    c_p = str(c_p) + " " + cs
-                    c_p = drawing.encode_ascii(c_p)
-                    c_p = np.array(c_p)
+        # Style of every sample, None if any style is missing
+        primer_styles = [] if styles is not None else None
 
-                    x_prime[i, : len(x_p), :] = x_p
-                    x_prime_len[i] = len(x_p)
+        if styles is not None:
+            for i, (cs, style_id) in enumerate(zip(lines, styles)):
+                style = self.styles.get(style_id)
+                if style is not None:
+                    if primer_styles is not None:
+                        primer_styles.append(style)
+                    c_p = style.encode_text(cs)
+
+                    x_prime[i, : style.strokes_len, :] = style.strokes
+                    x_prime_len[i] = style.strokes_len
                     chars[i, : len(c_p)] = c_p
                     chars_len[i] = len(c_p)
-                except (FileNotFoundError, IOError) as e:
+                else:
                     print(
-                        f"Warning: Style file not found for style {style}. Using fallback approach."
+                        f"Warning: Style file not found for style {style_id}. Using fallback approach."
                     )
+                    primer_styles = None
                     # Fallback to the one-hot encoding approach
                     one_hot = np.zeros([1200, 3])
                     one_hot[0 : len(drawing.alphabet)] = np.eye(3)[1]
@@ -321,46 +1021,68 @@ class Hand:
                 chars[i, : len(encoded)] = encoded
                 chars_len[i] = len(encoded)
 
-        # Convert numpy arrays to TensorFlow tensors
-        x_prime_tensor = tf.convert_to_tensor(x_prime, dtype=tf.float32)
-        x_prime_len_tensor = tf.convert_to_tensor(
-            x_prime_len, dtype=tf.int32
-        )  # Changed to int32
-        prime_tensor = tf.convert_to_tensor(styles is not None, dtype=tf.bool)
-        num_samples_tensor = tf.convert_to_tensor(num_samples, dtype=tf.int32)
-        sample_tsteps_tensor = tf.convert_to_tensor(max_tsteps, dtype=tf.int32)
-        chars_tensor = tf.convert_to_tensor(chars, dtype=tf.int32)  # Changed to int32
-        chars_len_tensor = tf.convert_to_tensor(
-            chars_len, dtype=tf.int32
-        )  # Changed to int32
-        biases_tensor = tf.convert_to_tensor(biases, dtype=tf.float32)
-
-        # Run the model using the signature from the saved model
-        # Get the serving signature
-        serving_signature = self.model.signatures["serving_default"]
-
-        # Call the model with the appropriate inputs
-        output = serving_signature(
-            bias=biases_tensor,
-            c=chars_tensor,
-            c_len=chars_len_tensor,
-            num_samples=num_samples_tensor,
-            prime=prime_tensor,
-            sample_tsteps=sample_tsteps_tensor,
-            x_prime=x_prime_tensor,
-            x_prime_len=x_prime_len_tensor,
+        rng, tsteps = None, max_tsteps
+        seeded = (
+            self.seeded_on_numpy
+            and seeds is not None
+            and any(seed is not None for seed in seeds)
         )
-
-        # Extract the sampled sequence from the output dictionary
-        samples = output["sampled_sequence"]
-
-        # Convert to numpy if it's a TensorFlow tensor
-        if isinstance(samples, tf.Tensor):
-            samples = samples.numpy()
+        if seeded:
+            rng = RowGenerators.from_seeds(seeds)
+            tsteps = np.array(budgets)
+
+        if self.primed_states is not None and primer_styles:
+            # Start from the cached post-priming state of each style
+            state = self.primed_states.primed_state(primer_styles, chars, chars_len)
+            samples = self.sampler.free_run(
+                state,
+                chars,
+                chars_len,
+                np.array(biases, dtype=np.float32),
+                tsteps,
+                rng=rng,
+            )
+        else:
+            inputs = dict(
+                bias=np.array(biases, dtype=np.float32),
+                c=chars,
+                c_len=chars_len,
+                num_samples=num_samples,
+                prime=styles is not None,
+                sample_tsteps=tsteps,
+                x_prime=x_prime,
+                x_prime_len=x_prime_len,
+            )
+            if seeded:
+                samples = self._numpy_sampler().sample(**inputs, rng=rng)
+            else:
+                samples = self.engine.sample(**inputs)
 
         # Process samples
         samples = [sample[~np.all(sample == 0.0, axis=1)] for sample in samples]
-        return samples
+        self._record_step_stats(samples, tsteps)
+        return samples, np.broadcast_to(np.asarray(tsteps), (num_samples,))
+
+    def _record_step_stats(self, samples: List[np.ndarray], tsteps):
+        """
+        Record how many sampling steps a model call was allowed and used.
+
+        tsteps is the call's step limit, for the batch or per sample. The
+        loop stops once every sample has finished writing, so steps_run
+        (loop steps times batch size) is usually far below steps_budgeted.
+        steps_used counts only the steps that produced a pen offset, which
+        is all the NumPy sampler computes since it drops finished samples.
+        """
+        limits = np.broadcast_to(np.asarray(tsteps), (len(samples),))
+        with self._stats_lock:
+            self.sampling_stats["steps_budgeted"] += int(limits.sum())
+            self.sampling_stats["steps_run"] += len(samples) * max(
+                (len(sample) for sample in samples), default=0
+            )
+            self.sampling_stats["steps_used"] += sum(len(s) for s in samples)
+            self.sampling_stats["truncated_samples"] += sum(
+                1 for s, limit in zip(samples, limits) if len(s) >= limit
+            )
 
     def _draw_segments(
         self,
@@ -540,8 +1262,9 @@ class Hand:
         y_position: float,
     ):
         """Draw a single text segment at the specified position."""
-        # Set up initial transforms
-        offsets = segment.strokes
+        # Set up initial transforms on a copy, the sampled strokes may be
+        # shared with the stroke cache
+        offsets = np.array(segment.strokes)
         strokes = drawing.offsets_to_coords(offsets)
         strokes = drawing.denoise(strokes)
 
@@ -601,17 +1324,185 @@ class Hand:
         Returns:
             List of filenames for the generated SVG pages
         """
-        # Use default layout config if none provided
-        if layout_config is None:
-            layout_config = LayoutConfig()
+        self.sample_document(segments_by_line)
+        return self.render_multi_page(
+            filename_template,
+            segments_by_line,
+            layout_config,
+            page_dimensions,
+            margins,
+            max_lines_per_page,
+        )
+
+    def validate_document(self, segments_by_line: List[List[TextSegment]]):
+        """
+        Check that the segments of a document can be sampled, raising
+        ValueError if not, for documents whose lines are sampled later.
+        """
+        self._validate_segments(segments_by_line)
 
+    def sample_document(
+        self, segments_by_line: List[List[TextSegment]]
+    ) -> List[List[TextSegment]]:
+        """
+        Validate and sample the segments of a document, which can then be
+        rendered any number of times with render_multi_page().
+        """
         # Validate all characters in segments
         self._validate_segments(segments_by_line)
 
         # Sample strokes for each segment
         self._sample_segments(segments_by_line)
+        return segments_by_line
+
+    def render_multi_page(
+        self,
+        filename_template: str,
+        segments_by_line: List[List[TextSegment]],
+        layout_config: Optional[LayoutConfig] = None,
+        page_dimensions: Optional[Tuple[float, float]] = None,
+        margins: Optional[Tuple[float, float, float, float]] = None,
+        max_lines_per_page: int = 25,
+    ) -> List[str]:
+        """
+        Draw already sampled segments onto pages, without running the model.
+        Takes the same arguments as write_multi_page().
+        """
+        # Use default layout config if none provided
+        if layout_config is None:
+            layout_config = LayoutConfig()
 
         # Split the segments into pages
+        pages_segments = self._paginate(segments_by_line, max_lines_per_page)
+
+        # Generate each page
+        filenames = []
+        pending = []
+        for i, page_content in enumerate(pages_segments):
+            # Generate unique filename for this page
+            page_filename = filename_template.format(i + 1)
+
+            # Draw the page, in parallel on the workers if there are any
+            if self.worker_pool is not None:
+                pending.append(
+                    self.worker_pool.submit_draw(
+                        page_filename,
+                        page_content,
+                        layout_config,
+                        page_dimensions,
+                        margins,
+                    )
+                )
+            else:
+                self._draw_segments(
+                    page_filename, page_content, layout_config, page_dimensions, margins
+                )
+
+            filenames.append(page_filename)
+
+        for future in pending:
+            future.result()
+
+        return filenames
+
+    def iter_multi_page(
+        self,
+        filename_template: str,
+        segments_by_line: List[List[TextSegment]],
+        layout_config: Optional[LayoutConfig] = None,
+        page_dimensions: Optional[Tuple[float, float]] = None,
+        margins: Optional[Tuple[float, float, float, float]] = None,
+        max_lines_per_page: int = 25,
+        on_sampled: Optional[Callable[[int], None]] = None,
+    ) -> Iterator[str]:
+        """
+        Generate handwriting page by page, yielding each page's filename as
+        soon as it is drawn. Takes the same arguments as write_multi_page(),
+        and on_sampled, which is called with the number of lines sampled so
+        far each time a chunk of pages has been sampled.
+
+        Lines are sampled in chunks of pages, each drawn (on the workers if
+        there are any) and handed to the caller before the next chunk is
+        sampled. The first chunk is a single page, so it is ready after
+        sampling one page instead of the whole document, unless the document
+        has fewer than PIPELINE_MIN_PAGES pages. The rest follow in
+        chunks of up to PIPELINE_MAX_CHUNK_PAGES pages, which keeps long
+        documents to few model calls and bounds the samples held at once.
+        Everything runs in the calling thread, so aiter_multi_page() stays
+        within the hand's executor.
+        """
+        # Use default layout config if none provided
+        if layout_config is None:
+            layout_config = LayoutConfig()
+
+        # Validate the whole document before any page is sampled
+        self._validate_segments(segments_by_line)
+
+        pages_segments = self._paginate(segments_by_line, max_lines_per_page)
+        if not pages_segments:
+            return
+
+        first = 1 if len(pages_segments) >= PIPELINE_MIN_PAGES else len(pages_segments)
+        chunks = [pages_segments[:first]] + [
+            pages_segments[start : start + PIPELINE_MAX_CHUNK_PAGES]
+            for start in range(first, len(pages_segments), PIPELINE_MAX_CHUNK_PAGES)
+        ]
+
+        page_number = 0
+        lines_sampled = 0
+        for chunk in chunks:
+            self._sample_segments([line for page in chunk for line in page])
+            lines_sampled += sum(len(page) for page in chunk)
+            if on_sampled is not None:
+                on_sampled(lines_sampled)
+
+            for page_content in chunk:
+                # Generate unique filename for this page
+                page_number += 1
+                page_filename = filename_template.format(page_number)
+                if self.worker_pool is not None:
+                    self.worker_pool.submit_draw(
+                        page_filename,
+                        page_content,
+                        layout_config,
+                        page_dimensions,
+                        margins,
+                    ).result()
+                else:
+                    self._draw_segments(
+                        page_filename,
+                        page_content,
+                        layout_config,
+                        page_dimensions,
+                        margins,
+                    )
+                yield page_filename
+
+    async def aiter_multi_page(self, *args, **kwargs) -> AsyncIterator[str]:
+        """Async version of iter_multi_page(), each page made in the hand's executor."""
+        pages = self.iter_multi_page(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                page_filename = await loop.run_in_executor(
+                    self.executor, next, pages, None
+                )
+                if page_filename is None:
+                    return
+                yield page_filename
+        finally:
+            try:
+                pages.close()
+            except ValueError:
+                # Still making a page for a cancelled caller, the generator
+                # is closed once that's done and it is collected
+                pass
+
+    @staticmethod
+    def _paginate(
+        segments_by_line: List[List[TextSegment]], max_lines_per_page: int
+    ) -> List[List[List[TextSegment]]]:
+        """Split lines into pages of max_lines_per_page lines, empty lines included."""
         pages_segments = []
         current_page = []
         line_count = 0
@@ -625,11 +1516,6 @@ class Hand:
 
             current_page.append(line_segments)
 
-            # Check if this is an empty line (paragraph break)
-            is_empty_line = len(line_segments) == 0 or (
-                len(line_segments) == 1 and not line_segments[0].text.strip()
-            )
-
             # Increment line count - empty lines still count as lines
             line_count += 1
 
@@ -637,17 +1523,4 @@ class Hand:
         if current_page:
             pages_segments.append(current_page)
 
-        # Generate each page
-        filenames = []
-        for i, page_content in enumerate(pages_segments):
-            # Generate unique filename for this page
-            page_filename = filename_template.format(i + 1)
-
-            # Draw the page
-            self._draw_segments(
-                page_filename, page_content, layout_config, page_dimensions, margins
-            )
-
-            filenames.append(page_filename)
-
-        return filenames
+        return pages_segments
@@ -0,0 +1,575 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from app.utils import drawing
+
+# Layer sizes of the exported LSTM-attention-MDN network
+LSTM_SIZE = 400
+NUM_ATTENTION_COMPONENTS = 10
+NUM_OUTPUT_COMPONENTS = 20
+ALPHABET_SIZE = len(drawing.alphabet)
+
+# Names of the weight constants in the frozen graph
+WEIGHT_NODES = {
+    "lstm1_kernel": "rnn/LSTMAttentionCell/lstm_cell/kernel",
+    "lstm1_bias": "rnn/LSTMAttentionCell/lstm_cell/bias",
+    "attention_weights": "rnn/LSTMAttentionCell/attention/weights",
+    "attention_biases": "rnn/LSTMAttentionCell/attention/biases",
+    "lstm2_kernel": "rnn/LSTMAttentionCell/lstm_cell_1/kernel",
+    "lstm2_bias": "rnn/LSTMAttentionCell/lstm_cell_1/bias",
+    "lstm3_kernel": "rnn/LSTMAttentionCell/lstm_cell_2/kernel",
+    "lstm3_bias": "rnn/LSTMAttentionCell/lstm_cell_2/bias",
+    "gmm_weights": "rnn/gmm/weights",
+    "gmm_biases": "rnn/gmm/biases",
+}
+
+# Model precisions, see load_engine and LSTMAttentionSampler
+PRECISIONS = ("float32", "float16", "bfloat16")
+
+# Priming steps replayed against the full character sequence when starting
+# from a cached state, see PrimedStateCache
+PRIME_TAIL_STEPS = 60
+
+
+def extract_weights(model) -> Dict[str, np.ndarray]:
+    """Read the network weights out of a loaded frozen saved model."""
+    import tensorflow as tf
+
+    graph_def = model.signatures["serving_default"].graph.as_graph_def()
+    nodes = {node.name: node for node in graph_def.node}
+
+    weights = {}
+    for key, node_name in WEIGHT_NODES.items():
+        node = nodes.get(node_name)
+        if node is None:
+            # Imported graphs may carry a scope prefix
+            node = next(n for name, n in nodes.items() if name.endswith(node_name))
+        weights[key] = tf.make_ndarray(node.attr["value"].tensor).astype(np.float32)
+    return weights
+
+
+def to_bfloat16(array: np.ndarray) -> np.ndarray:
+    """Round float32 values to bfloat16, returned as their uint16 bit patterns."""
+    bits = np.ascontiguousarray(array, dtype=np.float32).view(np.uint32)
+    rounding = np.uint32(0x7FFF) + ((bits >> 16) & np.uint32(1))
+    return ((bits + rounding) >> 16).astype(np.uint16)
+
+
+def round_to_precision(array: np.ndarray, precision: str) -> np.ndarray:
+    """Round float32 values to a precision, returned as float32."""
+    if precision == "bfloat16":
+        return (to_bfloat16(array).astype(np.uint32) << 16).view(np.float32)
+    if precision == "float16":
+        return np.asarray(array, dtype=np.float16).astype(np.float32)
+    return np.asarray(array, dtype=np.float32)
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _softplus(x):
+    return np.logaddexp(0.0, x)
+
+
+class RowGenerators:
+    """
+    One random generator per sample of a batch.
+
+    Stands in for a single Generator in the sampling loop. Every sample
+    draws from its own stream, so what it writes depends on its own seed
+    and not on which other samples share its batch.
+    """
+
+    def __init__(self, generators):
+        self.generators = list(generators)
+
+    @classmethod
+    def from_seeds(cls, seeds) -> "RowGenerators":
+        """Seeded generators, or freshly seeded from the OS for None seeds."""
+        return cls(np.random.default_rng(seed) for seed in seeds)
+
+    def random(self, size=None) -> np.ndarray:
+        return np.array([g.random() for g in self.generators])
+
+    def standard_normal(self, size=None) -> np.ndarray:
+        return np.array([g.standard_normal() for g in self.generators])
+
+    def take(self, indices) -> "RowGenerators":
+        """Generators of the selected samples."""
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        return RowGenerators(self.generators[i] for i in indices)
+
+
+class LSTMAttentionState:
+    """Recurrent state of the network for a batch of samples."""
+
+    FIELDS = ("h1", "c1", "h2", "c2", "h3", "c3", "kappa", "w", "phi")
+
+    def __init__(self, **arrays):
+        for field in self.FIELDS:
+            setattr(self, field, arrays[field])
+
+    @classmethod
+    def zeros(cls, num_samples: int, char_len: int) -> "LSTMAttentionState":
+        """State of a freshly started network."""
+        shapes = {
+            "h1": LSTM_SIZE,
+            "c1": LSTM_SIZE,
+            "h2": LSTM_SIZE,
+            "c2": LSTM_SIZE,
+            "h3": LSTM_SIZE,
+            "c3": LSTM_SIZE,
+            "kappa": NUM_ATTENTION_COMPONENTS,
+            "w": ALPHABET_SIZE,
+            "phi": char_len,
+        }
+        return cls(
+            **{
+                field: np.zeros((num_samples, size), dtype=np.float32)
+                for field, size in shapes.items()
+            }
+        )
+
+    @classmethod
+    def concat(cls, states: List["LSTMAttentionState"]) -> "LSTMAttentionState":
+        """Stack the states of several batches into one batch."""
+        return cls(
+            **{
+                field: np.concatenate([getattr(s, field) for s in states], axis=0)
+                for field in cls.FIELDS
+            }
+        )
+
+    def take(self, indices) -> "LSTMAttentionState":
+        """Return the state of the selected samples."""
+        return LSTMAttentionState(
+            **{field: getattr(self, field)[indices] for field in self.FIELDS}
+        )
+
+    def where(
+        self, keep: np.ndarray, other: "LSTMAttentionState"
+    ) -> "LSTMAttentionState":
+        """Keep this state where keep is True, take other's elsewhere."""
+        mask = keep[:, None]
+        return LSTMAttentionState(
+            **{
+                field: np.where(mask, getattr(self, field), getattr(other, field))
+                for field in self.FIELDS
+            }
+        )
+
+
+class LSTMAttentionSampler:
+    """
+    NumPy implementation of the sampling network in saved_model.pb.
+
+    Mirrors the graph's LSTM-attention cell, mixture density output and
+    free-running loop, so it can start generation from any recurrent state
+    instead of always priming from scratch.
+
+    Computation is always in float32, NumPy has no half precision matmul.
+    With a float16 or bfloat16 precision the LSTM kernels, nearly all of
+    the weight bytes, are rounded to that precision but kept in float32,
+    which reproduces the numerics of reduced-precision weights for
+    benchmarks/precision_fidelity.py without saving memory or time.
+    """
+
+    def __init__(self, weights: Dict[str, np.ndarray], precision: str = "float32"):
+        """Build the sampler from weights as returned by extract_weights."""
+        if precision not in PRECISIONS:
+            raise ValueError(
+                f"Unknown precision '{precision}', expected one of {PRECISIONS}"
+            )
+        self.precision = precision
+        self.weights = {
+            key: np.ascontiguousarray(value, dtype=np.float32)
+            for key, value in weights.items()
+            if key not in ("lstm1_kernel", "lstm2_kernel", "lstm3_kernel")
+        }
+
+        # LSTM kernels stored as (4 * units, inputs). BLAS multiplies the
+        # small batches of a sampling step several times faster this way
+        # round than against the graph's (inputs, 4 * units) layout.
+        self._kernels_t = {}
+        for layer in (1, 2, 3):
+            kernel_t = np.asarray(weights[f"lstm{layer}_kernel"], dtype=np.float32).T
+            self._kernels_t[layer] = np.ascontiguousarray(
+                round_to_precision(kernel_t, precision)
+            )
+        self.rng = np.random.default_rng()
+
+    @classmethod
+    def from_stored_arrays(
+        cls, arrays: Dict[str, np.ndarray], precision: str
+    ) -> "LSTMAttentionSampler":
+        """
+        Build a sampler on arrays returned by stored_arrays.
+
+        The arrays are used as they are, without copies, so they can be
+        read-only views of a memory-mapped file.
+        """
+        sampler = cls.__new__(cls)
+        sampler.precision = precision
+        sampler.weights = {
+            key: value for key, value in arrays.items() if not key.endswith("_t")
+        }
+        sampler._kernels_t = {
+            layer: arrays[f"lstm{layer}_kernel_t"] for layer in (1, 2, 3)
+        }
+        sampler.rng = np.random.default_rng()
+        return sampler
+
+    def stored_arrays(self) -> Dict[str, np.ndarray]:
+        """The weights in the layout and precision the sampler keeps them in."""
+        arrays = dict(self.weights)
+        for layer, kernel_t in self._kernels_t.items():
+            arrays[f"lstm{layer}_kernel_t"] = kernel_t
+        return arrays
+
+    def kernel_t(self, layer: int) -> np.ndarray:
+        """Transposed float32 kernel of an LSTM layer."""
+        return self._kernels_t[layer]
+
+    def export_weights(self) -> Dict[str, np.ndarray]:
+        """All weights as float32 arrays in the layout of extract_weights."""
+        weights = dict(self.weights)
+        for layer in (1, 2, 3):
+            weights[f"lstm{layer}_kernel"] = np.ascontiguousarray(
+                self.kernel_t(layer).T
+            )
+        return weights
+
+    def _lstm(self, layer: int, inputs, h, c):
+        """One step of an LSTMCell with forget bias 1.0, gates ordered i, j, f, o."""
+        kernel_t = self.kernel_t(layer)
+        bias = self.weights[f"lstm{layer}_bias"]
+        gates = (kernel_t @ np.concatenate([inputs, h], axis=1).T).T + bias
+        i, j, f, o = np.split(gates, 4, axis=1)
+        new_c = c * _sigmoid(f + 1.0) + _sigmoid(i) * np.tanh(j)
+        new_h = _sigmoid(o) * np.tanh(new_c)
+        return new_h, new_c
+
+    def step(
+        self,
+        x: np.ndarray,
+        state: LSTMAttentionState,
+        attention_values: np.ndarray,
+        attention_mask: np.ndarray,
+    ) -> LSTMAttentionState:
+        """
+        Advance the cell by one pen offset.
+
+        Args:
+            x: Pen offsets fed in, shape (batch, 3)
+            state: Current recurrent state
+            attention_values: One-hot characters, shape (batch, char_len, alphabet)
+            attention_mask: 1.0 for real characters, shape (batch, char_len)
+        """
+        h1, c1 = self._lstm(1, np.concatenate([state.w, x], axis=1), state.h1, state.c1)
+
+        attention_inputs = np.concatenate([state.w, x, h1], axis=1)
+        params = _softplus(
+            attention_inputs @ self.weights["attention_weights"]
+            + self.weights["attention_biases"]
+        )
+        alpha, beta, kappa = np.split(params, 3, axis=1)
+        kappa = state.kappa + kappa / 25.0
+        beta = np.maximum(beta, 0.01)
+
+        u = np.arange(attention_values.shape[1], dtype=np.float32)
+        phi = np.sum(
+            alpha[:, :, None]
+            * np.exp(-np.square(kappa[:, :, None] - u) / beta[:, :, None]),
+            axis=1,
+        )
+        w = np.einsum("bu,bua->ba", phi * attention_mask, attention_values)
+
+        h2, c2 = self._lstm(2, np.concatenate([x, h1, w], axis=1), state.h2, state.c2)
+        h3, c3 = self._lstm(3, np.concatenate([x, h2, w], axis=1), state.h3, state.c3)
+
+        return LSTMAttentionState(
+            h1=h1,
+            c1=c1,
+            h2=h2,
+            c2=c2,
+            h3=h3,
+            c3=c3,
+            kappa=kappa,
+            w=w,
+            phi=phi.astype(np.float32),
+        )
+
+    def output_params(self, h3: np.ndarray, bias: np.ndarray):
+        """Mixture parameters of the next pen offset for the given output state."""
+        params = h3 @ self.weights["gmm_weights"] + self.weights["gmm_biases"]
+        k = NUM_OUTPUT_COMPONENTS
+        pis, sigmas, rhos, mus, es = np.split(params, [k, 3 * k, 4 * k, 6 * k], axis=1)
+
+        pis = pis * (1.0 + bias[:, None])
+        pis = np.exp(pis - pis.max(axis=1, keepdims=True))
+        pis = pis / pis.sum(axis=1, keepdims=True)
+        pis = np.where(pis < 0.01, 0.0, pis)
+
+        sigmas = np.maximum(np.exp(sigmas - bias[:, None]), 1e-4)
+        rhos = np.clip(np.tanh(rhos), -1.0, 1.0)
+        es = np.clip(_sigmoid(es), 1e-8, 1.0 - 1e-8)
+        es = np.where(es < 0.01, 0.0, es)
+        return pis, mus, sigmas, rhos, es[:, 0]
+
+    def sample_eos(self, es: np.ndarray, rng) -> np.ndarray:
+        """Draw end-of-stroke flags."""
+        return (rng.random(es.shape) < es).astype(np.float32)
+
+    def sample_output(self, params, rng) -> np.ndarray:
+        """Draw one pen offset (dx, dy, eos) per sample from the mixture."""
+        pis, mus, sigmas, rhos, es = params
+        batch = np.arange(len(pis))
+
+        cumulative = np.cumsum(pis, axis=1)
+        draws = rng.random(len(pis)) * cumulative[:, -1]
+        idx = np.minimum((cumulative < draws[:, None]).sum(axis=1), pis.shape[1] - 1)
+
+        k = NUM_OUTPUT_COMPONENTS
+        mu1, mu2 = mus[batch, idx], mus[batch, k + idx]
+        s1, s2 = sigmas[batch, idx], sigmas[batch, k + idx]
+        rho = rhos[batch, idx]
+
+        z1, z2 = rng.standard_normal(len(pis)), rng.standard_normal(len(pis))
+        dx = mu1 + s1 * z1
+        dy = mu2 + s2 * (rho * z1 + np.sqrt(np.maximum(1.0 - rho * rho, 0.0)) * z2)
+
+        return np.stack([dx, dy, self.sample_eos(es, rng)], axis=1).astype(np.float32)
+
+    @staticmethod
+    def attention_inputs(chars: np.ndarray, chars_len: np.ndarray):
+        """One-hot characters and their length mask, as the graph builds them."""
+        chars = np.asarray(chars, dtype=np.int64)
+        attention_values = np.eye(ALPHABET_SIZE, dtype=np.float32)[chars]
+        attention_mask = (
+            np.arange(chars.shape[1])[None, :] < np.asarray(chars_len)[:, None]
+        ).astype(np.float32)
+        return attention_values, attention_mask
+
+    def prime(
+        self,
+        x_prime: np.ndarray,
+        x_prime_len: np.ndarray,
+        chars: np.ndarray,
+        chars_len: np.ndarray,
+        state: Optional[LSTMAttentionState] = None,
+    ) -> LSTMAttentionState:
+        """
+        Run the primer strokes through the network.
+
+        Each sample's state stops changing after its own x_prime_len steps,
+        like dynamic_rnn with sequence_length.
+        """
+        num_samples = len(x_prime)
+        if state is None:
+            state = LSTMAttentionState.zeros(num_samples, chars.shape[1])
+        attention_values, attention_mask = self.attention_inputs(chars, chars_len)
+
+        x_prime_len = np.asarray(x_prime_len)
+        for t in range(int(x_prime_len.max()) if num_samples else 0):
+            new_state = self.step(
+                x_prime[:, t, :].astype(np.float32),
+                state,
+                attention_values,
+                attention_mask,
+            )
+            state = new_state.where(t < x_prime_len, state)
+        return state
+
+    def _finished(self, state, params, chars_len, rng) -> np.ndarray:
+        """The graph's termination condition for each sample."""
+        char_idx = np.argmax(state.phi, axis=1)
+        is_eos = self.sample_eos(params[4], rng) == 1.0
+        final_char = char_idx >= chars_len - 1
+        past_final_char = char_idx >= chars_len
+        return (final_char & is_eos) | past_final_char
+
+    def free_run(
+        self,
+        state: LSTMAttentionState,
+        chars: np.ndarray,
+        chars_len: np.ndarray,
+        bias: np.ndarray,
+        sample_tsteps,
+        rng=None,
+    ) -> np.ndarray:
+        """
+        Generate pen offsets from the given state.
+
+        Returns an array of shape (batch, steps, 3). Rows after a sample has
+        finished are all zeros, matching serving_default's output, and the
+        loop ends as soon as every sample has finished. sample_tsteps is one
+        step limit for the batch or one per sample. rng is a Generator or
+        RowGenerators.
+
+        Finished samples are dropped from the batch, so each step only
+        computes the samples still writing instead of carrying every
+        finished row along until the longest one is done.
+        """
+        rng = rng or self.rng
+        num_samples = len(chars)
+        chars_len = np.asarray(chars_len)
+        bias = np.asarray(bias, dtype=np.float32)
+        limits = np.broadcast_to(np.asarray(sample_tsteps), (num_samples,)).copy()
+        attention_values, attention_mask = self.attention_inputs(chars, chars_len)
+
+        params = self.output_params(state.h3, bias)
+        finished = (limits <= 0) | self._finished(state, params, chars_len, rng)
+        x = self.sample_output(params, rng)
+
+        max_tsteps = max(int(limits.max()), 0) if num_samples else 0
+        outputs = np.zeros((num_samples, max_tsteps, 3), dtype=np.float32)
+        active = np.flatnonzero(~finished)
+        if len(active) < num_samples:
+            state = state.take(active)
+            x = x[active]
+            chars_len, bias, limits = chars_len[active], bias[active], limits[active]
+            attention_values = attention_values[active]
+            attention_mask = attention_mask[active]
+            if isinstance(rng, RowGenerators):
+                rng = rng.take(active)
+
+        time = 0
+        while len(active):
+            state = self.step(x, state, attention_values, attention_mask)
+            time += 1
+
+            params = self.output_params(state.h3, bias)
+            finished = (time >= limits) | self._finished(state, params, chars_len, rng)
+            x = self.sample_output(params, rng)
+            outputs[active, time - 1] = x
+
+            if finished.any():
+                keep = ~finished
+                active = active[keep]
+                state = state.take(keep)
+                x = x[keep]
+                chars_len, bias, limits = chars_len[keep], bias[keep], limits[keep]
+                attention_values = attention_values[keep]
+                attention_mask = attention_mask[keep]
+                if isinstance(rng, RowGenerators):
+                    rng = rng.take(keep)
+
+        return outputs[:, :time]
+
+    def sample(
+        self,
+        bias,
+        c,
+        c_len,
+        num_samples,
+        prime,
+        sample_tsteps,
+        x_prime,
+        x_prime_len,
+        rng=None,
+    ) -> np.ndarray:
+        """
+        Same inputs and sampled_sequence output as the serving_default
+        signature. sample_tsteps and rng can also be per sample, see
+        free_run.
+        """
+        c = np.asarray(c)
+        if prime:
+            state = self.prime(np.asarray(x_prime), x_prime_len, c, c_len)
+        else:
+            state = LSTMAttentionState.zeros(int(num_samples), c.shape[1])
+        return self.free_run(state, c, c_len, bias, sample_tsteps, rng=rng)
+
+
+class PrimedStateCache:
+    """
+    Post-priming recurrent state per style.
+
+    Priming runs the network over the style's primer strokes (several hundred
+    steps) before generating anything, and the result is the same for every
+    segment of that style. The cache primes each style once against its
+    primer characters and the separating space, stopping tail_steps short of
+    the end. Each sample then replays only those last steps against its full
+    character sequence, so the first characters of the new text still enter
+    the attention window as they do when priming from scratch. The head
+    never saw the new text, so the result approximates a full prime:
+    benchmarks/prime_cache_drift.py measures the drift per style and tail
+    length.
+    """
+
+    def __init__(
+        self, sampler: LSTMAttentionSampler, tail_steps: int = PRIME_TAIL_STEPS
+    ):
+        """Create an empty cache for the sampler."""
+        self.sampler = sampler
+        self.tail_steps = tail_steps
+        self._lock = threading.Lock()
+        self._states: Dict[int, Tuple[object, LSTMAttentionState]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, style, char_len: int) -> LSTMAttentionState:
+        """Return the cached head state of a style, priming it on first use."""
+        key = style.style_id
+        with self._lock:
+            entry = self._states.get(key)
+            # A reloaded style is a new object, so its state is recomputed
+            if (
+                entry is not None
+                and entry[0] is style
+                and entry[1].phi.shape[1] == char_len
+            ):
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        head_len = max(0, style.strokes_len - self._tail_len(style))
+        chars = np.zeros((1, char_len), dtype=np.int32)
+        chars[0, : style.chars_len] = style.encoded_chars
+        state = self.sampler.prime(
+            style.strokes[None, :head_len, :],
+            np.array([head_len]),
+            chars,
+            np.array([style.chars_len]),
+        )
+
+        with self._lock:
+            self._states[key] = (style, state)
+        return state
+
+    def _tail_len(self, style) -> int:
+        return min(self.tail_steps, style.strokes_len)
+
+    def primed_state(self, styles, chars: np.ndarray, chars_len: np.ndarray):
+        """
+        Primed state for a batch, one style per sample.
+
+        Stacks the cached head states and replays the priming tail of every
+        sample against its own characters.
+        """
+        char_len = chars.shape[1]
+        head = LSTMAttentionState.concat(
+            [self.get(style, char_len) for style in styles]
+        )
+
+        tail_lens = np.array([self._tail_len(style) for style in styles])
+        x_tail = np.zeros((len(styles), int(tail_lens.max()), 3), dtype=np.float32)
+        for i, style in enumerate(styles):
+            x_tail[i, : tail_lens[i]] = style.strokes[
+                style.strokes_len - tail_lens[i] :
+            ]
+
+        return self.sampler.prime(x_tail, tail_lens, chars, chars_len, state=head)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return cache hit and miss counts."""
+        with self._lock:
+            return {
+                "styles": len(self._states),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
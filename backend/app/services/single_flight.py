@@ -0,0 +1,68 @@
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Any, Awaitable, Callable, Dict
+
+
+def request_key(kind: str, **params) -> str:
+    """
+    Key identifying a generation by its kind and normalized parameters.
+
+    Parameters are serialized as sorted JSON, so callers should pass them
+    already normalized: defaults filled in and numbers of one type, e.g.
+    float biases.
+    """
+    payload = json.dumps([kind, params], sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent generations.
+
+    The first caller for a key starts the work as a task, and callers with
+    the same key arriving before it finishes await that task instead of
+    running their own. Every caller gets the same result or exception. The
+    key is forgotten once the task is done, so a later call runs again.
+
+    Callers await the task through asyncio.shield(), so a client that
+    disconnects cancels only its own wait, not the generation the others are
+    waiting on.
+    """
+
+    def __init__(self):
+        """Create an empty group, used from one event loop."""
+        self._flights: Dict[str, asyncio.Future] = {}
+
+        self._stats_lock = threading.Lock()
+        self.stats = {"leaders": 0, "coalesced": 0, "in_flight_max": 0}
+
+    async def run(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Await func() for key, or the run of it already in flight."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(func())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda _: self._flights.pop(key, None))
+            self._record(leader=True)
+        else:
+            self._record(leader=False)
+        return await asyncio.shield(flight)
+
+    def _record(self, leader: bool):
+        """Count a call as the one running its key or as joining it."""
+        with self._stats_lock:
+            self.stats["leaders" if leader else "coalesced"] += 1
+            self.stats["in_flight_max"] = max(
+                self.stats["in_flight_max"], len(self._flights)
+            )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the coalescing metrics."""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["in_flight"] = len(self._flights)
+        calls = stats["leaders"] + stats["coalesced"]
+        stats["coalesced_rate"] = stats["coalesced"] / calls if calls else 0.0
+        return stats
@@ -0,0 +1,523 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows, the disk cache is then single-process only
+    fcntl = None
+
+# Data file header: magic and the file's generation id, which changes every
+# time the file is rewritten
+DISK_CACHE_MAGIC = b"KALAMS01"
+_DATA_HEADER = struct.Struct("<8s8s")
+
+# Index record: key hash, generation id of the data file, offset and rows
+_INDEX_RECORD = struct.Struct("<16s8sQI4x")
+
+# Share of max_bytes kept when the disk cache is compacted
+DISK_CACHE_COMPACT_TO = 0.75
+
+
+# Seconds between writes of a worker's hit counts to the shared cache, and
+# between refreshes of an entry's last use time
+SHARED_CACHE_STATS_INTERVAL = 5.0
+SHARED_CACHE_TOUCH_INTERVAL = 60.0
+
+# Worker stats older than this are dropped when a worker opens the cache
+SHARED_CACHE_STATS_MAX_AGE = 24 * 3600.0
+
+
+def default_shared_cache_path() -> str:
+    """Path of the shared cache database in memory-backed storage if there is any."""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "kalam-strokes.sqlite")
+
+
+def stroke_key_hash(key: Hashable) -> bytes:
+    """Stable 16-byte hash of a stroke cache key."""
+    return hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).digest()
+
+
+class StrokeCache:
+    """
+    Bounded in-memory LRU cache of sampled stroke arrays.
+
+    Holds at most max_bytes of strokes and evicts the least recently used
+    entries to make room. Cached arrays are made read-only, since they are
+    handed out to every caller that hits them.
+    """
+
+    def __init__(self, max_bytes: int):
+        """Create an empty cache holding up to max_bytes of strokes."""
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """Return the cached strokes for key, or None."""
+        with self._lock:
+            strokes = self._entries.get(key)
+            if strokes is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return strokes
+
+    def put(self, key: Hashable, strokes: np.ndarray) -> np.ndarray:
+        """Cache strokes under key and return the read-only cached array."""
+        strokes = np.array(strokes, dtype=np.float32)
+        strokes.setflags(write=False)
+        if strokes.nbytes > self.max_bytes:
+            return strokes
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous.nbytes
+            self._entries[key] = strokes
+            self.bytes += strokes.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+        return strokes
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return hit, miss and size metrics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class DiskStrokeCache:
+    """
+    Persistent stroke cache in a directory, surviving restarts.
+
+    Strokes are appended as raw float32 rows to strokes.dat and located
+    through fixed-size records appended to strokes.idx, keyed by a hash of
+    the cache key. Reads are zero-copy, read-only views of strokes.dat
+    memory-mapped. Once the data file grows past max_bytes it is compacted
+    down to the most recently used entries that fit in a share of it.
+
+    Several processes can share the directory: writes and compaction hold
+    an exclusive lock, and readers pick up entries appended by others from
+    the index on a miss. Compaction writes new files under a new generation
+    id and stale index records are ignored, so a crash mid-compaction
+    leaves an empty cache rather than a corrupt one.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        """Open or create the cache in directory path."""
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.data_path = os.path.join(path, "strokes.dat")
+        self.index_path = os.path.join(path, "strokes.idx")
+
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(path, "strokes.lock"), "a+b")
+        self._entries: "OrderedDict[bytes, Tuple[int, int]]" = OrderedDict()
+        self._data = None
+        self._index = None
+        self._generation = None
+        self._index_read = 0
+        self._map = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.compactions = 0
+
+        with self._lock, self._file_lock():
+            if not self._valid_data_file():
+                self._rewrite({})
+            self._sync()
+
+    def _file_lock(self):
+        return _FileLock(self._lock_file)
+
+    def _valid_data_file(self) -> bool:
+        try:
+            with open(self.data_path, "rb") as f:
+                magic, _ = _DATA_HEADER.unpack(f.read(_DATA_HEADER.size))
+        except (OSError, struct.error):
+            return False
+        return magic == DISK_CACHE_MAGIC and os.path.exists(self.index_path)
+
+    def _sync(self):
+        """Reopen files replaced by a compaction and read new index records."""
+        if (
+            self._data is None
+            or _replaced(self._data, self.data_path)
+            or _replaced(self._index, self.index_path)
+        ):
+            for f in (self._data, self._index):
+                if f is not None:
+                    f.close()
+            self._data = open(self.data_path, "r+b")
+            self._index = open(self.index_path, "r+b")
+            header = self._data.read(_DATA_HEADER.size)
+            _, self._generation = _DATA_HEADER.unpack(header)
+            self._entries.clear()
+            self._index_read = 0
+            self._map = None
+
+        self._index.seek(self._index_read)
+        records = self._index.read()
+        count = len(records) // _INDEX_RECORD.size
+        for i in range(count):
+            key_hash, generation, offset, rows = _INDEX_RECORD.unpack_from(
+                records, i * _INDEX_RECORD.size
+            )
+            if generation == self._generation:
+                self._entries[key_hash] = (offset, rows)
+                self._entries.move_to_end(key_hash)
+        self._index_read += count * _INDEX_RECORD.size
+
+    def _view(self, offset: int, rows: int) -> np.ndarray:
+        end = offset + rows * 3 * 4
+        if self._map is None or len(self._map) < end:
+            self._map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+        return np.frombuffer(
+            self._map, dtype=np.float32, count=rows * 3, offset=offset
+        ).reshape(rows, 3)
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """Return the cached strokes for key, or None."""
+        key_hash = stroke_key_hash(key)
+        with self._lock:
+            entry = self._entries.get(key_hash)
+            if entry is None:
+                self._sync()
+                entry = self._entries.get(key_hash)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key_hash)
+            self.hits += 1
+            return self._view(*entry)
+
+    def put(self, key: Hashable, strokes: np.ndarray):
+        """Append strokes for key unless they are already stored."""
+        key_hash = stroke_key_hash(key)
+        data = np.ascontiguousarray(strokes, dtype=np.float32).reshape(-1, 3)
+        with self._lock, self._file_lock():
+            self._sync()
+            if key_hash in self._entries:
+                return
+
+            self._data.seek(0, os.SEEK_END)
+            offset = self._data.tell()
+            self._data.write(data.tobytes())
+            self._data.flush()
+            # The record goes in only once its strokes are on disk
+            self._index.seek(0, os.SEEK_END)
+            self._index.write(
+                _INDEX_RECORD.pack(key_hash, self._generation, offset, len(data))
+            )
+            self._index.flush()
+            self._index_read = self._index.tell()
+            self._entries[key_hash] = (offset, len(data))
+
+            if offset + data.nbytes > self.max_bytes:
+                self._compact()
+
+    def _compact(self):
+        """Rewrite the cache with the most recently used entries that fit."""
+        budget = int(self.max_bytes * DISK_CACHE_COMPACT_TO) - _DATA_HEADER.size
+        kept = OrderedDict()
+        for key_hash in reversed(self._entries):
+            offset, rows = self._entries[key_hash]
+            budget -= rows * 3 * 4
+            if budget < 0:
+                break
+            kept[key_hash] = self._view(offset, rows).copy()
+
+        self.evictions += len(self._entries) - len(kept)
+        self.compactions += 1
+        self._rewrite(OrderedDict(reversed(list(kept.items()))))
+        self._sync()
+
+    def _rewrite(self, entries: Dict[bytes, np.ndarray]):
+        """Write new data and index files under a new generation id."""
+        generation = os.urandom(8)
+        pid = os.getpid()
+        data_temp = f"{self.data_path}.{pid}.tmp"
+        index_temp = f"{self.index_path}.{pid}.tmp"
+        with open(data_temp, "wb") as data, open(index_temp, "wb") as index:
+            data.write(_DATA_HEADER.pack(DISK_CACHE_MAGIC, generation))
+            for key_hash, strokes in entries.items():
+                offset = data.tell()
+                data.write(strokes.tobytes())
+                index.write(
+                    _INDEX_RECORD.pack(key_hash, generation, offset, len(strokes))
+                )
+
+        # Records of the old index don't match the new generation, so a
+        # crash between the two replaces only loses entries
+        os.replace(data_temp, self.data_path)
+        os.replace(index_temp, self.index_path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return hit, miss and size metrics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": os.fstat(self._data.fileno()).st_size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "compactions": self.compactions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        """Close the cache files."""
+        with self._lock:
+            for f in (self._data, self._index, self._lock_file):
+                if f is not None:
+                    f.close()
+            self._map = None
+
+
+class SharedStrokeCache:
+    """
+    Stroke cache shared by all worker processes of a host, in SQLite.
+
+    Every process opens the same database, in WAL mode so lookups don't
+    block on writers, and sees the strokes every other process has sampled.
+    Entries are evicted least recently used first once they total more than
+    max_bytes. Each process records its own hit and miss counts in the
+    database too, so the hit rate can be reported per worker and overall.
+    Meant to sit behind a small in-process StrokeCache.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        """Open or create the shared cache database at path."""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.worker = os.getpid()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_written = 0.0
+
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        with _Transaction(db):
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS strokes (key BLOB PRIMARY KEY,"
+                " rows INTEGER, data BLOB, nbytes INTEGER, last_used REAL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS strokes_last_used ON strokes (last_used)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS worker_stats (worker INTEGER PRIMARY KEY,"
+                " hits INTEGER, misses INTEGER, updated REAL)"
+            )
+            # Running total of the stored bytes, kept in step with strokes
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER)"
+            )
+            db.execute("INSERT OR IGNORE INTO totals VALUES ('bytes', 0)")
+            db.execute(
+                "DELETE FROM worker_stats WHERE updated < ? OR worker = ?",
+                (time.time() - SHARED_CACHE_STATS_MAX_AGE, self.worker),
+            )
+
+    def _db(self) -> sqlite3.Connection:
+        """This thread's connection, SQLite connections can't be shared."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """Return the cached strokes for key, or None."""
+        key_hash = stroke_key_hash(key)
+        db = self._db()
+        row = db.execute(
+            "SELECT rows, data, last_used FROM strokes WHERE key = ?", (key_hash,)
+        ).fetchone()
+
+        now = time.time()
+        if row is not None and now - row[2] > SHARED_CACHE_TOUCH_INTERVAL:
+            with _Transaction(db):
+                db.execute(
+                    "UPDATE strokes SET last_used = ? WHERE key = ?", (now, key_hash)
+                )
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._maybe_write_stats(now)
+
+        if row is None:
+            return None
+        rows, data, _ = row
+        return np.frombuffer(data, dtype=np.float32).reshape(rows, 3)
+
+    def put(self, key: Hashable, strokes: np.ndarray):
+        """Store strokes for key unless another worker already has."""
+        key_hash = stroke_key_hash(key)
+        data = np.ascontiguousarray(strokes, dtype=np.float32).reshape(-1, 3)
+        db = self._db()
+        with _Transaction(db):
+            inserted = db.execute(
+                "INSERT OR IGNORE INTO strokes VALUES (?, ?, ?, ?, ?)",
+                (key_hash, len(data), data.tobytes(), data.nbytes, time.time()),
+            ).rowcount
+            if not inserted:
+                return
+            db.execute(
+                "UPDATE totals SET value = value + ? WHERE name = 'bytes'",
+                (data.nbytes,),
+            )
+            (total,) = db.execute(
+                "SELECT value FROM totals WHERE name = 'bytes'"
+            ).fetchone()
+            if total > self.max_bytes:
+                self._evict(db, total - int(self.max_bytes * DISK_CACHE_COMPACT_TO))
+
+    def _evict(self, db: sqlite3.Connection, excess: int):
+        """Delete the least recently used entries totalling at least excess bytes."""
+        victims, freed = [], 0
+        for key_hash, nbytes in db.execute(
+            "SELECT key, nbytes FROM strokes ORDER BY last_used"
+        ):
+            if freed >= excess:
+                break
+            victims.append((key_hash,))
+            freed += nbytes
+        db.executemany("DELETE FROM strokes WHERE key = ?", victims)
+        db.execute("UPDATE totals SET value = value - ? WHERE name = 'bytes'", (freed,))
+        with self._lock:
+            self.evictions += len(victims)
+
+    def _maybe_write_stats(self, now: float, force: bool = False):
+        """Write this worker's hit counts, at most every few seconds."""
+        if not force and now - self._stats_written < SHARED_CACHE_STATS_INTERVAL:
+            return
+        self._stats_written = now
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        db = self._db()
+        with _Transaction(db):
+            db.execute(
+                "INSERT OR REPLACE INTO worker_stats VALUES (?, ?, ?, ?)",
+                (self.worker, hits, misses, now),
+            )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return this worker's, every worker's and the overall hit rates."""
+        self._maybe_write_stats(time.time(), force=True)
+        db = self._db()
+        (entries,) = db.execute("SELECT COUNT(*) FROM strokes").fetchone()
+        (total,) = db.execute(
+            "SELECT value FROM totals WHERE name = 'bytes'"
+        ).fetchone()
+        workers = {
+            worker: _hit_stats(hits, misses)
+            for worker, hits, misses in db.execute(
+                "SELECT worker, hits, misses FROM worker_stats ORDER BY worker"
+            )
+        }
+        overall = _hit_stats(
+            sum(w["hits"] for w in workers.values()),
+            sum(w["misses"] for w in workers.values()),
+        )
+        with self._lock:
+            own = _hit_stats(self.hits, self.misses)
+            evictions = self.evictions
+        return {
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "worker": self.worker,
+            **own,
+            "evictions": evictions,
+            "workers": workers,
+            "overall": overall,
+        }
+
+
+class _Transaction:
+    """Immediate write transaction on an autocommit SQLite connection."""
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, *exc):
+        self.db.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+
+
+def _hit_stats(hits: int, misses: int) -> Dict[str, Any]:
+    lookups = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / lookups if lookups else 0.0,
+    }
+
+
+class _FileLock:
+    """Exclusive lock on an open file, across processes where fcntl exists."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+
+
+def _replaced(f, path: str) -> bool:
+    """Whether path no longer refers to the open file f."""
+    try:
+        return os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+    except OSError:
+        return True
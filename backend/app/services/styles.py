@@ -0,0 +1,122 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from app.utils import drawing
+
+
+class Style:
+    """Primer strokes and characters for one handwriting style."""
+
+    def __init__(self, style_id: int, strokes: np.ndarray, text: str):
+        """Prepare the primer arrays in the layout the model consumes."""
+        self.style_id = style_id
+        self.text = text
+        self.strokes = np.ascontiguousarray(strokes, dtype=np.float32)
+        self.strokes_len = len(self.strokes)
+
+        # Primer characters plus the space separating them from the text,
+        # without the terminating 0 that encode_ascii appends
+        self.encoded_chars = drawing.encode_ascii(text + " ")[:-1].astype(np.int32)
+        self.chars_len = len(self.encoded_chars)
+
+        # Identifies the primer content, which changes when the file does
+        self.fingerprint = hashlib.sha1(
+            self.strokes.tobytes() + text.encode("utf-8")
+        ).hexdigest()[:16]
+
+    def encode_text(self, text: str) -> np.ndarray:
+        """Encode the primer characters followed by text, as the model expects."""
+        return np.concatenate(
+            [self.encoded_chars, drawing.encode_ascii(text).astype(np.int32)]
+        )
+
+
+class StyleRegistry:
+    """
+    In-memory registry of the styles in the styles directory.
+
+    Every style is loaded once up front. The directory is re-scanned at most
+    every check_interval seconds and the registry reloads when style files
+    are added, removed or modified.
+    """
+
+    def __init__(self, styles_dir: str = "styles", check_interval: float = 2.0):
+        """Load every style found in styles_dir."""
+        self.styles_dir = styles_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._styles: Dict[int, Style] = {}
+        self._signature: Tuple = ()
+        self._last_check = 0.0
+        self.reload()
+
+    def get(self, style_id: int) -> Optional[Style]:
+        """Return the style with the given id, or None if there is none."""
+        self._maybe_reload()
+        return self._styles.get(style_id)
+
+    def ids(self) -> List[int]:
+        """Return the sorted ids of all available styles."""
+        self._maybe_reload()
+        return sorted(self._styles)
+
+    def reload(self):
+        """Load every style from disk, replacing the current set."""
+        with self._lock:
+            signature = self._scan()
+            styles = {}
+            for style_id in sorted({entry[0] for entry in signature}):
+                strokes_path = os.path.join(
+                    self.styles_dir, f"style-{style_id}-strokes.npy"
+                )
+                chars_path = os.path.join(
+                    self.styles_dir, f"style-{style_id}-chars.npy"
+                )
+                if not (os.path.exists(strokes_path) and os.path.exists(chars_path)):
+                    continue
+                try:
+                    strokes = np.load(strokes_path)
+                    text = np.load(chars_path).tobytes().decode("utf-8")
+                except (IOError, ValueError) as e:
+                    print(f"Warning: Could not load style {style_id}: {e}")
+                    continue
+                styles[style_id] = Style(style_id, strokes, text)
+
+            # Swap in one go so readers never see a half-loaded registry
+            self._styles = styles
+            self._signature = signature
+            self._last_check = time.monotonic()
+
+    def _scan(self) -> Tuple:
+        """Return (style_id, filename, mtime, size) for every style file."""
+        if not os.path.isdir(self.styles_dir):
+            return ()
+
+        entries = []
+        for filename in os.listdir(self.styles_dir):
+            if not (
+                filename.startswith("style-")
+                and filename.endswith(("-chars.npy", "-strokes.npy"))
+            ):
+                continue
+            try:
+                style_id = int(filename.split("-")[1])
+                stat = os.stat(os.path.join(self.styles_dir, filename))
+            except (ValueError, OSError):
+                continue
+            entries.append((style_id, filename, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(entries))
+
+    def _maybe_reload(self):
+        """Reload if the style files changed since the last check."""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        if self._scan() != self._signature:
+            print("Style files changed, reloading styles")
+            self.reload()
@@ -0,0 +1,86 @@
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Tuple
+
+import numpy as np
+
+# File layout: magic, little-endian u64 header length, JSON header, then
+# every array at a page-aligned offset so each one maps onto whole pages
+WEIGHT_FILE_MAGIC = b"KALAMW01"
+WEIGHT_FILE_ALIGNMENT = 4096
+
+
+def _align(offset: int) -> int:
+    return -(-offset // WEIGHT_FILE_ALIGNMENT) * WEIGHT_FILE_ALIGNMENT
+
+
+def write_weight_file(path: str, arrays: Dict[str, np.ndarray], metadata: Dict):
+    """
+    Write arrays to a flat weight file that map_weight_file can map.
+
+    The file is written under a temporary name and moved into place, so a
+    concurrently starting worker never maps a half-written file.
+    """
+    entries = {}
+    header = b""
+    # The header size depends on the offsets it lists, so lay the arrays out
+    # until the data start stops moving
+    data_start = 0
+    while True:
+        offset = data_start
+        for name, array in arrays.items():
+            entries[name] = {
+                "dtype": np.dtype(array.dtype).str,
+                "shape": list(array.shape),
+                "offset": offset,
+            }
+            offset = _align(offset + array.nbytes)
+        header = json.dumps({"metadata": metadata, "arrays": entries}).encode()
+        start = _align(len(WEIGHT_FILE_MAGIC) + 8 + len(header))
+        if start == data_start:
+            break
+        data_start = start
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(WEIGHT_FILE_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(entries[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(_align(f.tell()))
+    os.replace(temp_path, path)
+
+
+def map_weight_file(path: str) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """
+    Memory-map a weight file read-only.
+
+    Returns the arrays, as read-only views of the mapping, and the file's
+    metadata. Processes mapping the same file share its pages in the OS
+    page cache instead of each holding a private copy of the weights.
+    """
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mapping[: len(WEIGHT_FILE_MAGIC)] != WEIGHT_FILE_MAGIC:
+        mapping.close()
+        raise ValueError(f"Not a weight file: {path}")
+    (header_len,) = struct.unpack_from("<Q", mapping, len(WEIGHT_FILE_MAGIC))
+    header_start = len(WEIGHT_FILE_MAGIC) + 8
+    header = json.loads(mapping[header_start : header_start + header_len])
+
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        arrays[name] = np.frombuffer(
+            mapping,
+            dtype=dtype,
+            count=int(np.prod(shape, dtype=np.int64)),
+            offset=entry["offset"],
+        ).reshape(shape)
+    return arrays, header["metadata"]
@@ -0,0 +1,235 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+# A boundary between words must be at least this many times wider than the
+# widest gap left inside a word, otherwise the line isn't split
+WORD_GAP_MARGIN = 1.25
+
+# Words of a split line must be within this factor of the line's mean width
+# per character, which catches boundaries that fell inside a word
+WORD_WIDTH_TOLERANCE = 3.0
+
+# Weight of a newly measured word gap in a style's running mean
+WORD_GAP_SMOOTHING = 0.1
+
+
+def _coords(offsets: np.ndarray) -> np.ndarray:
+    """Pen positions of sampled offsets, with their end-of-stroke flags."""
+    coords = np.array(offsets, dtype=np.float32)
+    coords[:, :2] = np.cumsum(coords[:, :2], axis=0)
+    return coords
+
+
+def split_words(
+    offsets: np.ndarray, num_words: int
+) -> Optional[Tuple[List[np.ndarray], List[float]]]:
+    """
+    Split the strokes of a sampled line into one run per word.
+
+    Boundaries are placed at the num_words - 1 widest horizontal gaps
+    between a stroke and everything written before it, so they always fall
+    at a pen-up. Returns the runs as coordinates, each shifted to start at
+    x = 0 with its median height at y = 0, so words from different lines
+    share a baseline, and ending with a pen-up. The widths of the gaps are
+    returned too. Returns None if the line doesn't split cleanly into that
+    many words.
+    """
+    if num_words < 1 or len(offsets) == 0:
+        return None
+
+    coords = _coords(offsets)
+    starts = np.concatenate([[0], np.flatnonzero(coords[:-1, 2] == 1) + 1])
+    ends = np.concatenate([starts[1:], [len(coords)]])
+    if len(starts) < num_words:
+        return None
+
+    left = np.array([coords[s:e, 0].min() for s, e in zip(starts, ends)])
+    right = np.maximum.accumulate(
+        np.array([coords[s:e, 0].max() for s, e in zip(starts, ends)])
+    )
+    # Gap between each stroke and the right edge of everything before it
+    gaps = left[1:] - right[:-1]
+
+    cuts = np.sort(np.argsort(gaps)[::-1][: num_words - 1]) + 1
+    chosen = gaps[cuts - 1]
+    if len(chosen) and chosen.min() <= 0:
+        return None
+    inside = np.delete(gaps, cuts - 1)
+    if len(chosen) and len(inside) and chosen.min() < WORD_GAP_MARGIN * inside.max():
+        return None
+
+    runs = []
+    for first, last in zip(
+        np.concatenate([[0], cuts]), np.concatenate([cuts, [len(starts)]])
+    ):
+        run = coords[starts[first] : ends[last - 1]].copy()
+        run[:, 0] -= run[:, 0].min()
+        run[:, 1] -= np.median(run[:, 1])
+        run[-1, 2] = 1.0
+        runs.append(run)
+    return runs, [float(gap) for gap in chosen]
+
+
+def plausible_widths(runs: List[np.ndarray], words: List[str]) -> bool:
+    """
+    Whether every run is about as wide per character as the line's mean.
+    Words of one or two characters can be much narrower ("I", "l."), so
+    they are only checked for being too wide.
+    """
+    widths = np.array([run[:, 0].max() for run in runs])
+    lengths = np.array([len(word) for word in words])
+    per_char = widths / lengths
+    mean = widths.sum() / lengths.sum()
+    if mean <= 0:
+        return False
+    return bool(
+        np.all(per_char <= mean * WORD_WIDTH_TOLERANCE)
+        and np.all(per_char[lengths > 2] >= mean / WORD_WIDTH_TOLERANCE)
+    )
+
+
+def join_words(runs: List[np.ndarray], gap: float) -> np.ndarray:
+    """Lay word runs out left to right, gap apart, as the offsets of one line."""
+    placed = []
+    cursor = 0.0
+    for run in runs:
+        run = run.copy()
+        run[:, 0] += cursor
+        cursor = float(run[:, 0].max()) + gap
+        placed.append(run)
+
+    coords = np.concatenate(placed)
+    offsets = coords.copy()
+    offsets[1:, :2] = coords[1:, :2] - coords[:-1, :2]
+    return offsets
+
+
+class WordStrokeLibrary:
+    """
+    Strokes of previously sampled words, for assembling new lines.
+
+    Words are kept per style key (style, bias, model) with up to
+    max_variants differently sampled runs each. A word with fewer variants
+    is reused with probability reuse_rate and sampled afresh otherwise, so
+    common words build up a few variants before they are always reused. A
+    document never uses the same variant twice, so repeated words don't
+    look copy-pasted. The library is bounded to max_bytes of runs and evicts
+    the least recently used words.
+    """
+
+    def __init__(self, max_bytes: int, max_variants: int = 8, reuse_rate: float = 0.8):
+        """Create an empty library."""
+        self.max_bytes = max_bytes
+        self.max_variants = max(1, max_variants)
+        self.reuse_rate = reuse_rate
+
+        self._words: "OrderedDict[Tuple, List[np.ndarray]]" = OrderedDict()
+        self._gaps: Dict[Tuple, float] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng()
+
+        self.stats = {
+            "words_reused": 0,
+            "words_sampled": 0,
+            "lines_assembled": 0,
+            "lines_split": 0,
+            "split_failures": 0,
+            "evictions": 0,
+        }
+
+    def choose(
+        self, style_key: Tuple, word: str, used: Set[int]
+    ) -> Optional[np.ndarray]:
+        """
+        Pick a stored run of word to reuse, or None if it should be sampled.
+
+        used holds the ids of runs already placed in the current document and
+        is updated with the pick.
+        """
+        with self._lock:
+            variants = self._words.get((style_key, word))
+            if variants is not None:
+                self._words.move_to_end((style_key, word))
+            available = [run for run in variants or () if id(run) not in used]
+            reuse = bool(available) and (
+                len(variants) >= self.max_variants
+                or self._rng.random() < self.reuse_rate
+            )
+            if not reuse:
+                self.stats["words_sampled"] += 1
+                return None
+            run = available[self._rng.integers(len(available))]
+            used.add(id(run))
+            self.stats["words_reused"] += 1
+            return run
+
+    def add(self, style_key: Tuple, word: str, run: np.ndarray) -> np.ndarray:
+        """Store a new variant of word, replacing its oldest one when full."""
+        run = np.array(run, dtype=np.float32)
+        run.setflags(write=False)
+        key = (style_key, word)
+        with self._lock:
+            variants = self._words.setdefault(key, [])
+            self._words.move_to_end(key)
+            if len(variants) >= self.max_variants:
+                self._bytes -= variants.pop(0).nbytes
+            variants.append(run)
+            self._bytes += run.nbytes
+
+            while self._bytes > self.max_bytes and len(self._words) > 1:
+                _, evicted = self._words.popitem(last=False)
+                self._bytes -= sum(r.nbytes for r in evicted)
+                self.stats["evictions"] += 1
+        return run
+
+    def add_line(
+        self, style_key: Tuple, words: List[str], offsets: np.ndarray
+    ) -> Optional[List[np.ndarray]]:
+        """
+        Split a sampled line into words and store them. Returns the stored
+        runs, or None if the line doesn't split cleanly.
+        """
+        split = split_words(offsets, len(words))
+        if split is None or not plausible_widths(split[0], words):
+            with self._lock:
+                self.stats["split_failures"] += 1
+            return None
+
+        runs, gaps = split
+        runs = [self.add(style_key, word, run) for word, run in zip(words, runs)]
+        with self._lock:
+            self.stats["lines_split"] += 1
+            for gap in gaps:
+                mean = self._gaps.get(style_key)
+                self._gaps[style_key] = (
+                    gap if mean is None else mean + WORD_GAP_SMOOTHING * (gap - mean)
+                )
+        return runs
+
+    def assemble(self, style_key: Tuple, words: List[str], runs: List[np.ndarray]):
+        """Offsets of a line written with the given run for each word."""
+        if not runs:
+            return np.zeros((0, 3), dtype=np.float32)
+        with self._lock:
+            gap = self._gaps.get(style_key)
+            self.stats["lines_assembled"] += 1
+        if gap is None:
+            # No measured word gap for the style yet, use a character width
+            widths = sum(float(run[:, 0].max()) for run in runs)
+            gap = widths / max(1, sum(len(word) for word in words))
+        return join_words(runs, gap)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return a snapshot of the library metrics."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["words"] = len(self._words)
+            stats["variants"] = sum(len(v) for v in self._words.values())
+            stats["bytes"] = self._bytes
+        words = stats["words_reused"] + stats["words_sampled"]
+        stats["reuse_rate"] = stats["words_reused"] / words if words else 0.0
+        return stats
@@ -0,0 +1,350 @@
+import contextlib
+import copy
+import math
+import multiprocessing as mp
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Hand owned by each worker process, created by _init_worker
+_worker_hand = None
+
+# Thread pool sizes read by OpenMP and the BLAS libraries when they load
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+@contextlib.contextmanager
+def _thread_env(threads: int):
+    """Set the thread pool environment variables, restoring them on exit."""
+    saved = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+    os.environ.update({name: str(threads) for name in THREAD_ENV_VARS})
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def pack_strokes(strokes: Sequence[np.ndarray]) -> Tuple[Optional[str], List[int]]:
+    """
+    Copy stroke arrays into a single float32 shared-memory block.
+
+    Returns the block name and the row count of each array. The block is left
+    for the reader to unlink once it has copied the strokes out.
+    """
+    lengths = [len(s) for s in strokes]
+    total = sum(lengths)
+    if total == 0:
+        return None, lengths
+
+    shm = shared_memory.SharedMemory(create=True, size=total * 3 * 4)
+    buffer = np.ndarray((total, 3), dtype=np.float32, buffer=shm.buf)
+    offset = 0
+    for stroke, length in zip(strokes, lengths):
+        buffer[offset : offset + length] = stroke
+        offset += length
+
+    del buffer
+    shm.close()
+    return shm.name, lengths
+
+
+def unpack_strokes(
+    name: Optional[str], lengths: List[int], unlink: bool = True
+) -> List[np.ndarray]:
+    """Copy stroke arrays back out of a block written by pack_strokes."""
+    if name is None:
+        return [np.zeros((0, 3), dtype=np.float32) for _ in lengths]
+
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        buffer = np.ndarray((sum(lengths), 3), dtype=np.float32, buffer=shm.buf)
+        strokes = []
+        offset = 0
+        for length in lengths:
+            strokes.append(buffer[offset : offset + length].copy())
+            offset += length
+        del buffer
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    return strokes
+
+
+def release_strokes(name: Optional[str]):
+    """Unlink a shared-memory block whose strokes are no longer needed."""
+    if name is None:
+        return
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _init_worker(
+    counter,
+    cpu_sets: List[List[int]],
+    intra_op_threads: int,
+    model_path: str,
+    engine: str,
+    weights_path: Optional[str],
+    precision: str,
+):
+    """Pin the worker to its CPU subset, size its thread pools and load the model."""
+    global _worker_hand
+
+    with counter.get_lock():
+        slot = counter.value
+        counter.value += 1
+
+    if cpu_sets and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpu_sets[slot % len(cpu_sets)])
+
+    # NumPy's BLAS was sized from the environment the worker was spawned
+    # with, see WorkerPool; TensorFlow creates its thread pools from here on
+    os.environ["OMP_NUM_THREADS"] = str(intra_op_threads)
+    if engine == "tensorflow":
+        import tensorflow as tf
+
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    from app.services.handwriting import Hand
+
+    from app.core.config import settings
+
+    _worker_hand = Hand(
+        model_path=model_path,
+        max_workers=1,
+        prime_cache=settings.prime_cache,
+        engine=engine,
+        weights_path=weights_path,
+        engine_threads=intra_op_threads,
+        precision=precision,
+        seeded_on_numpy=settings.seeded_on_numpy,
+    )
+
+
+def _worker_sample(lines, biases, styles, seeds=None):
+    """Sample strokes in the worker and hand them back through shared memory."""
+    strokes = _worker_hand._sample_bucketed(
+        lines, biases=biases, styles=styles, seeds=seeds
+    )
+    return pack_strokes(strokes)
+
+
+def _worker_started():
+    """Report the worker's pid once it has been initialized."""
+    return os.getpid()
+
+
+def _worker_warmup(batch_sizes, tsteps):
+    """Warm up the worker's model."""
+    _worker_hand.warmup(batch_sizes, tsteps)
+    return os.getpid()
+
+
+def _worker_draw(
+    filename,
+    segments_by_line,
+    strokes_name,
+    strokes_lengths,
+    layout_config,
+    page_dimensions,
+    margins,
+):
+    """Render sampled segments to an SVG file in the worker."""
+    strokes = unpack_strokes(strokes_name, strokes_lengths, unlink=False)
+    segments = [segment for line in segments_by_line for segment in line]
+    for segment, stroke in zip(segments, strokes):
+        segment.strokes = stroke
+
+    _worker_hand._draw_segments(
+        filename, segments_by_line, layout_config, page_dimensions, margins
+    )
+    return filename
+
+
+def default_cpu_sets(num_workers: int) -> List[List[int]]:
+    """Split the CPUs available to this process into one subset per worker."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+
+    if num_workers >= len(cpus):
+        return [[cpu] for cpu in cpus]
+
+    per_worker = len(cpus) // num_workers
+    return [cpus[i * per_worker : (i + 1) * per_worker] for i in range(num_workers)]
+
+
+class WorkerPool:
+    """
+    Pool of model worker processes, each with its own Hand and TF runtime.
+
+    The API process sends sampling and render jobs to the workers. Stroke
+    arrays travel in both directions through shared memory instead of being
+    pickled.
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        intra_op_threads: Optional[int] = None,
+        model_path: str = "saved_model/saved_model.pb",
+        cpu_sets: Optional[List[List[int]]] = None,
+        min_chunk_size: int = 8,
+        engine: str = "tensorflow",
+        weights_path: Optional[str] = None,
+        precision: str = "float32",
+    ):
+        """
+        Start num_workers processes.
+
+        Args:
+            num_workers: Number of model worker processes
+            intra_op_threads: TF intra-op threads per worker, defaults to the
+                size of the worker's CPU subset
+            model_path: Path to the frozen model loaded by each worker
+            cpu_sets: CPU ids each worker is pinned to, split evenly by default
+            min_chunk_size: Smallest number of segments sent to one worker
+                when a sampling job is spread over several workers
+            engine: Model engine each worker runs, see Hand
+            weights_path: File converted from the saved model for the NumPy
+                and TFLite engines
+            precision: Weight and compute precision of the engine, see Hand
+        """
+        self.num_workers = max(1, num_workers)
+        self.cpu_sets = cpu_sets or default_cpu_sets(self.num_workers)
+        self.intra_op_threads = intra_op_threads or max(
+            1, min(len(cpus) for cpus in self.cpu_sets)
+        )
+        self.min_chunk_size = max(1, min_chunk_size)
+
+        ctx = mp.get_context("spawn")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(
+                ctx.Value("i", 0),
+                self.cpu_sets,
+                self.intra_op_threads,
+                model_path,
+                engine,
+                weights_path,
+                precision,
+            ),
+        )
+
+        # Workers import NumPy, which sizes its BLAS thread pool as it
+        # loads, before the initializer runs, so the pool sizes have to be
+        # in the environment they are spawned with. The executor spawns
+        # workers as jobs are submitted, so start them all now.
+        with _thread_env(self.intra_op_threads):
+            for _ in range(self.num_workers):
+                self._executor.submit(_worker_started)
+
+    def sample(self, lines, biases, styles, seeds=None) -> List[np.ndarray]:
+        """
+        Sample strokes for the lines on the workers.
+
+        Lines are sorted by length and split into contiguous chunks so every
+        worker gets lines of similar length, then put back in input order.
+        """
+        if not lines:
+            return []
+
+        order = sorted(range(len(lines)), key=lambda i: len(lines[i]))
+        chunk_size = max(self.min_chunk_size, math.ceil(len(lines) / self.num_workers))
+
+        jobs = []
+        for start in range(0, len(order), chunk_size):
+            indices = order[start : start + chunk_size]
+            future = self._executor.submit(
+                _worker_sample,
+                [lines[i] for i in indices],
+                [biases[i] for i in indices],
+                [styles[i] for i in indices],
+                [seeds[i] for i in indices] if seeds is not None else None,
+            )
+            jobs.append((indices, future))
+
+        results = [None] * len(lines)
+        for indices, future in jobs:
+            name, lengths = future.result()
+            for i, stroke in zip(indices, unpack_strokes(name, lengths)):
+                results[i] = stroke
+        return results
+
+    def submit_draw(
+        self,
+        filename: str,
+        segments_by_line,
+        layout_config,
+        page_dimensions=None,
+        margins=None,
+    ) -> Future:
+        """Render sampled segments to filename on a worker."""
+        segments = [segment for line in segments_by_line for segment in line]
+        strokes = [
+            (
+                segment.strokes
+                if segment.strokes is not None
+                else np.zeros((0, 3), dtype=np.float32)
+            )
+            for segment in segments
+        ]
+        name, lengths = pack_strokes(strokes)
+
+        # Strokes go through shared memory, the rest is small enough to pickle
+        stripped = []
+        for line in segments_by_line:
+            stripped_line = []
+            for segment in line:
+                segment = copy.copy(segment)
+                segment.strokes = None
+                stripped_line.append(segment)
+            stripped.append(stripped_line)
+
+        future = self._executor.submit(
+            _worker_draw,
+            filename,
+            stripped,
+            name,
+            lengths,
+            layout_config,
+            page_dimensions,
+            margins,
+        )
+        future.add_done_callback(lambda _: release_strokes(name))
+        return future
+
+    def warmup(self, batch_sizes, tsteps):
+        """
+        Start every worker and warm up its model.
+
+        One job is sent per worker. Each one runs for a while, so idle
+        workers pick them up instead of one worker running them all.
+        """
+        jobs = [
+            self._executor.submit(_worker_warmup, batch_sizes, tsteps)
+            for _ in range(self.num_workers)
+        ]
+        pids = {job.result() for job in jobs}
+        print(f"Warmed up {len(pids)} of {self.num_workers} worker processes")
+
+    def close(self):
+        """Shut the worker processes down."""
+        self._executor.shutdown(wait=True)
@@ -1,10 +1,10 @@
 from __future__ import print_function
 from collections import defaultdict
 
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.signal import savgol_filter
-from scipy.interpolate import interp1d
+
+# matplotlib and SciPy are slow to import and only needed by draw() and the
+# stroke filters, so they are imported inside those functions
 
 
 alphabet = [
@@ -146,6 +146,8 @@ def denoise(coords):
     """
     smoothing filter to mitigate some artifacts of the data collection
     """
+    from scipy.signal import savgol_filter
+
     coords = np.split(coords, np.where(coords[:, 2] == 1)[0] + 1, axis=0)
     new_coords = []
     for stroke in coords:
@@ -164,6 +166,8 @@ def interpolate(coords, factor=2):
     """
     interpolates strokes using cubic spline
     """
+    from scipy.interpolate import interp1d
+
     coords = np.split(coords, np.where(coords[:, 2] == 1)[0] + 1, axis=0)
     new_coords = []
     for stroke in coords:
@@ -229,6 +233,8 @@ def draw(
     interpolation_factor=None,
     save_file=None,
 ):
+    import matplotlib.pyplot as plt
+
     strokes = offsets_to_coords(offsets)
 
     if denoise_strokes:
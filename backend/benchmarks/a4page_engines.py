@@ -0,0 +1,54 @@
+"""
+Latency of /a4page-style documents on different model engines.
+
+Samples the lines of A4 documents of several sizes the way /a4page does
+(one Hand._sample_segments call per document) on each engine and prints the
+median time per document. Each engine is warmed up first, which for the
+XLA engine compiles the shape buckets the documents hit, and the warm-up
+time is reported separately.
+
+Run from the backend directory:
+
+    python -m benchmarks.a4page_engines --engines tensorflow xla --lines 5 30 60
+"""
+
+import argparse
+import statistics
+import time
+
+from app.services.handwriting import Hand
+from benchmarks.worker_pool_scaling import make_document
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--engines", nargs="+", default=["tensorflow", "xla"])
+    parser.add_argument("--lines", type=int, nargs="+", default=[5, 30, 60])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    header = f"{'engine':>12} {'warm-up s':>10}"
+    header += "".join(f" {f'{n} lines s':>12}" for n in args.lines)
+    print(header)
+
+    for engine in args.engines:
+        hand = Hand(engine=engine)
+        start = time.perf_counter()
+        hand.warmup()
+        warmup = time.perf_counter() - start
+
+        row = f"{engine:>12} {warmup:>10.1f}"
+        for num_lines in args.lines:
+            timings = []
+            for _ in range(args.repeats):
+                document = make_document(num_lines)
+                start = time.perf_counter()
+                hand._sample_segments(document)
+                timings.append(time.perf_counter() - start)
+            row += f" {statistics.median(timings):>12.2f}"
+        print(row)
+        hand.executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
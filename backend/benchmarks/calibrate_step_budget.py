@@ -0,0 +1,158 @@
+"""
+Calibrate the per-style, per-character sampling step budget.
+
+Samples lines of varied text in every style with a generous step budget,
+records how many pen steps each line actually used and fits per-character
+step counts per style. The budget is fitted on part of the lines and the
+held-out rest is used to report how often the calibrated budget would have
+truncated a line, compared with the flat TSTEPS_PER_CHAR budget, and how
+many budgeted steps it saves. Hand samples truncated lines again with the
+flat budget, so the truncated share is also the share of lines that cost a
+second model call. The budget fitted on all lines is written next to the
+style files with the engine it was calibrated on, and Hand only picks it
+up on start when it runs that engine.
+
+Run from the backend directory:
+
+    python -m benchmarks.calibrate_step_budget --lines 200
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from app.services.calibration import (
+    DEFAULT_COVERAGE,
+    STEP_BUDGET_FILE,
+    StepBudget,
+    fit_style_budget,
+)
+from app.services.handwriting import TSTEPS_PER_CHAR, Hand
+
+CORPUS = (
+    "The quick brown fox jumps over the lazy dog.",
+    "Pack my box with five dozen liquor jugs!",
+    "Dear friend, thank you for the lovely letter you sent last week.",
+    "The garden is finally in bloom and the roses look wonderful.",
+    "We should meet for tea soon, perhaps on Sunday at 4 o'clock?",
+    "Best wishes to you and the family, Sam",
+    "Jackdaws love my big sphinx of quartz (and 2 or 3 others).",
+    "Meeting notes: budget for 2024 is 15,000 - see page 7.",
+    "Sphinx of black quartz, judge my vow; it was #1 in May.",
+    "Yours sincerely, Katherine Wilson & James Quincy Oxford",
+    "How vexingly quick daft zebras jump: 5 6 8 9 0 miles!",
+    "Remember to buy milk, eggs, bread and a bag of apples.",
+)
+
+# Step budget per character while measuring, high enough that no line is cut
+MEASURE_TSTEPS_PER_CHAR = 80
+
+
+def make_lines(rng, count: int):
+    """Draw word-aligned snippets of the corpus with varied lengths."""
+    lines = []
+    while len(lines) < count:
+        words = CORPUS[rng.integers(len(CORPUS))].split()
+        start = rng.integers(len(words))
+        end = rng.integers(start + 1, len(words) + 1)
+        line = " ".join(words[start:end])[:75].strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def measure(hand: Hand, style_id: int, lines, batch_size: int):
+    """Sample every line in the style and return the steps each one used."""
+    steps = []
+    for start in range(0, len(lines), batch_size):
+        batch = lines[start : start + batch_size]
+        samples = hand._sample(batch, styles=[style_id] * len(batch))
+        steps.extend(len(sample) for sample in samples)
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--styles", type=int, nargs="+", default=None)
+    parser.add_argument("--lines", type=int, default=200)
+    parser.add_argument("--holdout", type=float, default=0.25)
+    parser.add_argument("--coverage", type=float, default=DEFAULT_COVERAGE)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--engine", default="tensorflow")
+    parser.add_argument("--weights-path", default=None)
+    parser.add_argument("--styles-dir", default="styles")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    hand = Hand(
+        engine=args.engine, weights_path=args.weights_path, styles_dir=args.styles_dir
+    )
+    hand.step_budget = StepBudget(default_tsteps_per_char=MEASURE_TSTEPS_PER_CHAR)
+    style_ids = args.styles if args.styles is not None else hand.styles.ids()
+    rng = np.random.default_rng(args.seed)
+
+    budget = StepBudget(default_tsteps_per_char=TSTEPS_PER_CHAR, engine=args.engine)
+    totals = {
+        "lines": 0,
+        "truncated": 0,
+        "flat_truncated": 0,
+        "flat": 0,
+        "calibrated": 0,
+    }
+
+    print(
+        f"{'style':>6} {'steps/char':>10} {'margin':>7} {'truncated':>10}"
+        f" {'flat truncated':>15} {'flat steps':>11} {'calibrated':>11} {'saved':>7}"
+    )
+    for style_id in style_ids:
+        lines = make_lines(rng, args.lines)
+        steps = measure(hand, style_id, lines, args.batch_size)
+
+        split = int(len(lines) * (1.0 - args.holdout))
+        held_out = StepBudget(
+            {style_id: fit_style_budget(lines[:split], steps[:split], args.coverage)}
+        )
+        eval_lines, eval_steps = lines[split:], steps[split:]
+        budgets = [held_out.tsteps(style_id, line) for line in eval_lines]
+        flat = sum(TSTEPS_PER_CHAR * len(line) for line in eval_lines)
+        calibrated = sum(budgets)
+        truncated = sum(1 for used, b in zip(eval_steps, budgets) if used >= b)
+        flat_truncated = sum(
+            1
+            for used, line in zip(eval_steps, eval_lines)
+            if used >= TSTEPS_PER_CHAR * len(line)
+        )
+
+        table = fit_style_budget(lines, steps, args.coverage)
+        budget.styles[style_id] = table
+
+        totals["lines"] += len(eval_lines)
+        totals["truncated"] += truncated
+        totals["flat_truncated"] += flat_truncated
+        totals["flat"] += flat
+        totals["calibrated"] += calibrated
+        print(
+            f"{style_id:>6} {table['default']:>10.1f} {table['margin']:>7.2f}"
+            f" {truncated / max(1, len(eval_lines)):>10.2%}"
+            f" {flat_truncated / max(1, len(eval_lines)):>15.2%}"
+            f" {flat:>11} {calibrated:>11} {1 - calibrated / max(1, flat):>7.1%}"
+        )
+
+    print(
+        f"{'all':>6} {'':>10} {'':>7}"
+        f" {totals['truncated'] / max(1, totals['lines']):>10.2%}"
+        f" {totals['flat_truncated'] / max(1, totals['lines']):>15.2%}"
+        f" {totals['flat']:>11} {totals['calibrated']:>11}"
+        f" {1 - totals['calibrated'] / max(1, totals['flat']):>7.1%}"
+    )
+
+    if not args.dry_run:
+        path = os.path.join(args.styles_dir, STEP_BUDGET_FILE)
+        budget.save(path)
+        print(f"Step budgets written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Cold-start time of the API server.
+
+Starts a fresh uvicorn process per run and measures, from the moment the
+process is launched, the time to the first byte of a response on /, on
+/ready once it reports healthy, and on a first /generate request. Also
+reports how long importing the app takes on its own and which heavy
+modules that import pulls in.
+
+Run from the backend directory:
+
+    python -m benchmarks.cold_start --runs 3
+"""
+
+import argparse
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+HEAVY_MODULES = ("tensorflow", "matplotlib", "scipy")
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+heavy = [m for m in {modules!r} if m in sys.modules]
+print(json.dumps({{"import_s": elapsed, "heavy_modules": heavy}}))
+"""
+
+
+def free_port() -> int:
+    """Ask the OS for a free local port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def first_byte(url: str, data=None, timeout: float = 600.0) -> bool:
+    """Send a request and wait for the response headers, True on a 2xx."""
+    headers = {"Content-Type": "application/json"} if data is not None else {}
+    request = urllib.request.Request(url, data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return 200 <= response.status < 300
+    except urllib.error.HTTPError:
+        return False
+
+
+def wait_for(url: str, start: float, deadline: float) -> float:
+    """Poll url until it answers with a 2xx and return the seconds since start."""
+    while time.perf_counter() - start < deadline:
+        try:
+            if first_byte(url, timeout=5.0):
+                return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"{url} did not come up within {deadline}s")
+
+
+def one_run(deadline: float) -> dict:
+    """Launch a server and time its first responses."""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        root = wait_for(f"{base}/", start, deadline)
+
+        body = json.dumps({"lines": ["Hello there"]}).encode()
+        first_byte(f"{base}/api/v1/handwriting/generate", data=body)
+        generate = time.perf_counter() - start
+
+        ready = wait_for(f"{base}/ready", start, deadline)
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {"root_s": root, "generate_s": generate, "ready_s": ready}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--deadline", type=float, default=600.0)
+    args = parser.parse_args()
+
+    probe = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE.format(modules=HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imported = json.loads(probe.stdout.strip().splitlines()[-1])
+    print(f"import app.main: {imported['import_s']:.2f}s")
+    print(f"heavy modules loaded at import: {imported['heavy_modules'] or 'none'}")
+
+    runs = [one_run(args.deadline) for _ in range(args.runs)]
+    print(f"{'time to first byte':>22} {'median s':>9} {'max s':>7}")
+    for key, label in (
+        ("root_s", "GET /"),
+        ("generate_s", "POST /generate"),
+        ("ready_s", "GET /ready (200)"),
+    ):
+        values = [run[key] for run in runs]
+        print(f"{label:>22} {statistics.median(values):>9.2f} {max(values):>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
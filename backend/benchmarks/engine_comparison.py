@@ -0,0 +1,113 @@
+"""
+Startup time, latency and memory of the model engines.
+
+Each engine is measured in a fresh interpreter so import time and peak RSS
+aren't shared between them. Startup covers importing the handwriting module
+and loading the model, latency is the wall time of one sampling call per
+batch size.
+
+Run from the backend directory:
+
+    python -m benchmarks.engine_comparison --engines tensorflow numpy tflite
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+SAMPLE_LINE = "The garden is finally in bloom and the roses look wonderful."
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(engine: str, batch_sizes, repeats: int, weights_path=None) -> dict:
+    """Measure one engine in this process."""
+    start = time.perf_counter()
+    from app.services.handwriting import Hand
+
+    hand = Hand(engine=engine, weights_path=weights_path)
+    startup = time.perf_counter() - start
+    startup_rss = peak_rss_mb()
+
+    # First call includes any lazy initialization in the engine
+    start = time.perf_counter()
+    hand._sample([SAMPLE_LINE], styles=[0])
+    first_call = time.perf_counter() - start
+
+    latency = {}
+    for batch_size in batch_sizes:
+        lines = [SAMPLE_LINE] * batch_size
+        styles = [i % 12 for i in range(batch_size)]
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            hand._sample(lines, styles=styles)
+            timings.append(time.perf_counter() - start)
+        latency[batch_size] = sorted(timings)[len(timings) // 2]
+
+    return {
+        "startup_s": startup,
+        "startup_rss_mb": startup_rss,
+        "first_call_s": first_call,
+        "latency_s": latency,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--engines", nargs="+", default=["tensorflow", "numpy", "tflite"]
+    )
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--weights-path", default=None)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = measure(args.child, args.batch_sizes, args.repeats, args.weights_path)
+        print(json.dumps(result))
+        return
+
+    results = {}
+    for engine in args.engines:
+        command = [
+            sys.executable,
+            "-m",
+            "benchmarks.engine_comparison",
+            "--child",
+            engine,
+            "--repeats",
+            str(args.repeats),
+            "--batch-sizes",
+            *map(str, args.batch_sizes),
+        ]
+        if args.weights_path:
+            command += ["--weights-path", args.weights_path]
+        output = subprocess.run(command, capture_output=True, text=True, check=True)
+        results[engine] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    header = f"{'engine':>12} {'startup s':>10} {'first s':>8}"
+    header += "".join(f" {f'batch {n} s':>10}" for n in args.batch_sizes)
+    header += f" {'startup MB':>11} {'peak MB':>8}"
+    print(header)
+    for engine, result in results.items():
+        row = (
+            f"{engine:>12} {result['startup_s']:>10.2f} {result['first_call_s']:>8.2f}"
+        )
+        row += "".join(
+            f" {result['latency_s'][str(n)]:>10.2f}" for n in args.batch_sizes
+        )
+        row += f" {result['startup_rss_mb']:>11.0f} {result['peak_rss_mb']:>8.0f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
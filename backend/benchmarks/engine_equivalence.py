@@ -0,0 +1,110 @@
+"""
+Statistical equivalence of a model engine and the TensorFlow engine.
+
+Sampling is random, so the two engines can't be compared stroke by stroke.
+Instead the same lines are sampled many times with each engine and the
+distributions of per-sample stroke statistics are compared with a
+two-sample Kolmogorov-Smirnov test. Exits non-zero if any statistic
+differs at the chosen significance level.
+
+Run from the backend directory:
+
+    python -m benchmarks.engine_equivalence --engine numpy --repeats 32
+    python -m benchmarks.engine_equivalence --engine tflite --repeats 32
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+from app.services.handwriting import Hand
+
+LINES = (
+    "The quick brown fox jumps over the lazy dog",
+    "Dear friend,",
+    "Best wishes",
+)
+
+# Critical values of the two-sample KS statistic, c(alpha) in
+# D > c(alpha) * sqrt((n + m) / (n * m))
+KS_CRITICAL = {0.05: 1.358, 0.01: 1.628, 0.001: 1.949}
+
+
+def stroke_stats(strokes: np.ndarray, text: str) -> dict:
+    """Summary statistics of one sampled line of pen offsets."""
+    dx, dy, eos = strokes[:, 0], strokes[:, 1], strokes[:, 2]
+    return {
+        "steps_per_char": len(strokes) / max(1, len(text)),
+        "width": float(np.sum(dx)),
+        "mean_dy": float(np.mean(dy)),
+        "std_dx": float(np.std(dx)),
+        "std_dy": float(np.std(dy)),
+        "path_length": float(np.sum(np.hypot(dx, dy))),
+        "pen_lifts_per_char": float(np.sum(eos)) / max(1, len(text)),
+    }
+
+
+def ks_statistic(a: np.ndarray, b: np.ndarray) -> float:
+    """Two-sample Kolmogorov-Smirnov statistic."""
+    values = np.concatenate([a, b])
+    cdf_a = np.searchsorted(np.sort(a), values, side="right") / len(a)
+    cdf_b = np.searchsorted(np.sort(b), values, side="right") / len(b)
+    return float(np.max(np.abs(cdf_a - cdf_b)))
+
+
+def collect(hand: Hand, styles, repeats: int, bias: float) -> dict:
+    """Sample every line in every style repeats times and gather statistics."""
+    stats = {}
+    for _ in range(repeats):
+        lines = [line for _ in styles for line in LINES]
+        line_styles = [style for style in styles for _ in LINES]
+        samples = hand._sample(lines, biases=[bias] * len(lines), styles=line_styles)
+        for line, strokes in zip(lines, samples):
+            for name, value in stroke_stats(strokes, line).items():
+                stats.setdefault(name, []).append(value)
+    return {name: np.array(values) for name, values in stats.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=32)
+    parser.add_argument("--styles", type=int, nargs="+", default=[0, 3, 7])
+    parser.add_argument("--bias", type=float, default=0.5)
+    parser.add_argument("--alpha", type=float, default=0.01, choices=KS_CRITICAL)
+    parser.add_argument("--engine", default="numpy")
+    parser.add_argument("--weights-path", default=None)
+    args = parser.parse_args()
+
+    reference = collect(Hand(engine="tensorflow"), args.styles, args.repeats, args.bias)
+    candidate = collect(
+        Hand(engine=args.engine, weights_path=args.weights_path),
+        args.styles,
+        args.repeats,
+        args.bias,
+    )
+
+    failed = False
+    print(
+        f"{'statistic':>20} {'tf mean':>10} {args.engine + ' mean':>12}"
+        f" {'KS D':>8} {'limit':>8}"
+    )
+    for name in reference:
+        a, b = reference[name], candidate[name]
+        d = ks_statistic(a, b)
+        limit = KS_CRITICAL[args.alpha] * np.sqrt((len(a) + len(b)) / (len(a) * len(b)))
+        ok = d <= limit
+        failed |= not ok
+        print(
+            f"{name:>20} {a.mean():>10.3f} {b.mean():>12.3f} {d:>8.3f} {limit:>8.3f}"
+            f"{'' if ok else '  DIFFERS'}"
+        )
+
+    if failed:
+        print(f"Engines differ at alpha={args.alpha}")
+        sys.exit(1)
+    print(f"No difference detected at alpha={args.alpha}")
+
+
+if __name__ == "__main__":
+    main()
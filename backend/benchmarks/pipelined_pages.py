@@ -0,0 +1,78 @@
+"""
+Time to first page and total time of pipelined multi-page generation.
+
+Generates seeded documents of several sizes with Hand.write_multi_page(),
+which samples every line before drawing any page, and with
+Hand.iter_multi_page(), which samples and draws the first page on its own
+and then the rest in chunks of pages, and prints when the first page was
+ready and when the last one was. The extra model call for the first page
+is what the earlier first page costs in total time.
+
+Run from the backend directory:
+
+    python -m benchmarks.pipelined_pages --engine numpy --lines 30 90 150
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from app.services.handwriting import Hand, LayoutConfig
+from benchmarks.worker_pool_scaling import make_document
+
+PAGE_ARGS = dict(
+    page_dimensions=(794, 1123),
+    margins=(75, 100, 75, 100),
+    max_lines_per_page=30,
+)
+
+
+def document(hand: Hand, num_lines: int):
+    """A seeded document, so both runs sample the same strokes."""
+    segments_by_line = make_document(num_lines)
+    hand.seed_segments(segments_by_line, 0)
+    return segments_by_line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--engine", default="tensorflow")
+    parser.add_argument("--weights-path", default=None)
+    parser.add_argument("--lines", type=int, nargs="+", default=[30, 90, 150])
+    args = parser.parse_args()
+
+    hand = Hand(engine=args.engine, weights_path=args.weights_path)
+    hand.warmup()
+    layout = LayoutConfig()
+
+    print(
+        f"{'lines':>6} {'first page s':>13} {'pipelined':>10} {'total s':>8} {'pipelined':>10}"
+    )
+    for num_lines in args.lines:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            template = os.path.join(temp_dir, "page_{}.svg")
+
+            start = time.perf_counter()
+            hand.write_multi_page(
+                template, document(hand, num_lines), layout, **PAGE_ARGS
+            )
+            total = time.perf_counter() - start
+
+            start = time.perf_counter()
+            first = None
+            for _ in hand.iter_multi_page(
+                template, document(hand, num_lines), layout, **PAGE_ARGS
+            ):
+                if first is None:
+                    first = time.perf_counter() - start
+            pipelined = time.perf_counter() - start
+
+        print(
+            f"{num_lines:>6} {total:>13.2f} {first:>10.2f} {total:>8.2f} {pipelined:>10.2f}"
+        )
+    hand.executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
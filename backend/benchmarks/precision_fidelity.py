@@ -0,0 +1,135 @@
+"""
+Fidelity of a reduced-precision model against float32.
+
+Two checks on every style. Priming is deterministic, so the recurrent
+state after priming on the style's strokes is compared directly and the
+largest drift of the hidden state and of the attention position is
+reported. This runs the NumPy sampler with LSTM kernels rounded to the
+precision, so it works on any machine. Sampling is random, so the
+distributions of per-sample stroke statistics of the engine in float32
+and in the precision are compared with a two-sample Kolmogorov-Smirnov
+test, as in engine_equivalence, along with their batch latency. That
+check is skipped if the engine can't run the precision here. Exits
+non-zero if the state drifts past the tolerance or any statistic differs.
+
+Run from the backend directory:
+
+    python -m benchmarks.precision_fidelity --precision bfloat16
+    python -m benchmarks.precision_fidelity --precision float16 --engine tflite
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from app.services.handwriting import Hand
+from app.services.sampler import LSTMAttentionSampler
+from benchmarks.engine_equivalence import KS_CRITICAL, collect, ks_statistic
+
+
+def primed_state(sampler: LSTMAttentionSampler, style):
+    """State of the network after priming on the style's own strokes."""
+    chars = style.encoded_chars[None, :].astype(np.int32)
+    return sampler.prime(
+        style.strokes[None, :, :],
+        np.array([style.strokes_len]),
+        chars,
+        np.array([style.chars_len]),
+    )
+
+
+def state_drift(reference, candidate) -> dict:
+    """Largest absolute differences between two primed states."""
+    return {
+        "h": max(
+            float(np.max(np.abs(getattr(reference, f) - getattr(candidate, f))))
+            for f in ("h1", "h2", "h3")
+        ),
+        "kappa": float(np.max(np.abs(reference.kappa - candidate.kappa))),
+    }
+
+
+def batch_latency(hand: Hand, styles, repeats: int = 3) -> float:
+    """Median seconds to sample one batch of a line per style."""
+    lines = ["The quick brown fox"] * len(styles)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        hand._sample(lines, styles=list(styles))
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--precision", default="bfloat16", choices=("float16", "bfloat16")
+    )
+    parser.add_argument("--engine", default="tensorflow")
+    parser.add_argument("--weights-path", default=None)
+    parser.add_argument("--repeats", type=int, default=16)
+    parser.add_argument("--styles", type=int, nargs="+", default=None)
+    parser.add_argument("--bias", type=float, default=0.5)
+    parser.add_argument("--alpha", type=float, default=0.01, choices=KS_CRITICAL)
+    parser.add_argument("--state-tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    reference = Hand(engine=args.engine, weights_path=args.weights_path)
+    style_ids = args.styles if args.styles is not None else reference.styles.ids()
+    failed = False
+
+    # The NumPy sampler runs any engine's weights, so the state check works
+    # for every engine, with kernels rounded to the precision
+    sampler = reference.engine.numpy_sampler()
+    reduced = LSTMAttentionSampler(sampler.export_weights(), args.precision)
+    print(f"{'style':>6} {'max |dh|':>10} {'max |dkappa|':>13}")
+    for style_id in style_ids:
+        style = reference.styles.get(style_id)
+        drift = state_drift(primed_state(sampler, style), primed_state(reduced, style))
+        ok = drift["h"] <= args.state_tolerance
+        failed |= not ok
+        print(
+            f"{style_id:>6} {drift['h']:>10.2e} {drift['kappa']:>13.2e}"
+            f"{'' if ok else '  DRIFTS'}"
+        )
+
+    try:
+        candidate = Hand(
+            engine=args.engine, weights_path=args.weights_path, precision=args.precision
+        )
+    except ValueError as e:
+        print(f"Skipping the sampling check: {e}")
+        sys.exit(1 if failed else 0)
+
+    print(
+        f"batch latency: {batch_latency(reference, style_ids) * 1000:.0f} ms float32,"
+        f" {batch_latency(candidate, style_ids) * 1000:.0f} ms {args.precision}"
+    )
+
+    a_stats = collect(reference, style_ids, args.repeats, args.bias)
+    b_stats = collect(candidate, style_ids, args.repeats, args.bias)
+    print(
+        f"{'statistic':>20} {'fp32 mean':>10} {args.precision + ' mean':>14}"
+        f" {'KS D':>8} {'limit':>8}"
+    )
+    for name in a_stats:
+        a, b = a_stats[name], b_stats[name]
+        d = ks_statistic(a, b)
+        limit = KS_CRITICAL[args.alpha] * np.sqrt((len(a) + len(b)) / (len(a) * len(b)))
+        ok = d <= limit
+        failed |= not ok
+        print(
+            f"{name:>20} {a.mean():>10.3f} {b.mean():>14.3f} {d:>8.3f} {limit:>8.3f}"
+            f"{'' if ok else '  DIFFERS'}"
+        )
+
+    if failed:
+        print(f"{args.precision} differs from float32")
+        sys.exit(1)
+    print(f"No difference from float32 detected at alpha={args.alpha}")
+
+
+if __name__ == "__main__":
+    main()
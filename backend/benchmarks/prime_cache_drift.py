@@ -0,0 +1,134 @@
+"""
+Drift of the prime cache's approximate priming against a full prime.
+
+PrimedStateCache primes each style once against its primer characters and
+replays only the last tail steps of the primer against each new text. For
+every style and several tail lengths this compares the resulting state
+with priming the whole primer against the full character sequence, which
+is what a sample does without the cache. Reports the largest drift of the
+hidden state and of the attention position, how far the mixture means of
+the first pen offset move in units of their standard deviation, and the
+share of lines sampled with the same seeds from both states that come out
+the same. Sampling amplifies any difference, so lines can differ even when
+their first offset's distribution has barely moved. Exits non-zero if the
+state drifts past the tolerance at the tail length the cache uses.
+
+Run from the backend directory:
+
+    python -m benchmarks.prime_cache_drift --engine numpy
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+from app.services.handwriting import TSTEPS_PER_CHAR, Hand
+from app.services.sampler import PRIME_TAIL_STEPS, PrimedStateCache, RowGenerators
+from benchmarks.precision_fidelity import state_drift
+
+LINES = (
+    "The quick brown fox jumps over the lazy dog",
+    "Dear friend,",
+    "Best wishes, Sam",
+    "Meeting at 4 o'clock on Sunday?",
+)
+
+
+def encode(style, lines):
+    """Full character sequences of lines in a style, as Hand._sample builds them."""
+    encoded = [style.encode_text(line) for line in lines]
+    chars = np.zeros((len(lines), max(map(len, encoded))), dtype=np.int32)
+    for i, line_chars in enumerate(encoded):
+        chars[i, : len(line_chars)] = line_chars
+    return chars, np.array([len(line_chars) for line_chars in encoded])
+
+
+def full_prime(sampler, style, chars, chars_len):
+    """State after priming the whole primer against the full sequences."""
+    num_samples = len(chars)
+    return sampler.prime(
+        np.repeat(style.strokes[None, :, :], num_samples, axis=0),
+        np.full(num_samples, style.strokes_len),
+        chars,
+        chars_len,
+    )
+
+
+def output_shift(sampler, full, cached) -> float:
+    """Largest move of a first-offset mixture mean, in standard deviations."""
+    bias = np.full(len(full.h3), 0.5, dtype=np.float32)
+    pis, mus, sigmas, _, _ = sampler.output_params(full.h3, bias)
+    _, cached_mus, _, _, _ = sampler.output_params(cached.h3, bias)
+    shift = np.abs(mus - cached_mus) / sigmas
+    used = np.concatenate([pis, pis], axis=1) > 0.0
+    return float(np.max(np.where(used, shift, 0.0)))
+
+
+def same_strokes(sampler, full, cached, chars, chars_len, lines) -> float:
+    """Share of lines sampled identically from both states with the same seeds."""
+    bias = np.full(len(lines), 0.5, dtype=np.float32)
+    tsteps = np.array([TSTEPS_PER_CHAR * len(line) for line in lines])
+    seeds = list(range(len(lines)))
+    a = sampler.free_run(
+        full, chars, chars_len, bias, tsteps, RowGenerators.from_seeds(seeds)
+    )
+    b = sampler.free_run(
+        cached, chars, chars_len, bias, tsteps, RowGenerators.from_seeds(seeds)
+    )
+    steps = min(a.shape[1], b.shape[1])
+    same = [
+        np.allclose(a[i, :steps], b[i, :steps], atol=1e-3)
+        and not a[i, steps:].any()
+        and not b[i, steps:].any()
+        for i in range(len(lines))
+    ]
+    return float(np.mean(same))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--engine", default="numpy")
+    parser.add_argument("--weights-path", default=None)
+    parser.add_argument("--styles", type=int, nargs="+", default=None)
+    parser.add_argument(
+        "--tail-steps", type=int, nargs="+", default=[0, 15, 30, PRIME_TAIL_STEPS, 120]
+    )
+    parser.add_argument("--state-tolerance", type=float, default=1e-3)
+    args = parser.parse_args()
+
+    hand = Hand(engine=args.engine, weights_path=args.weights_path)
+    sampler = hand.engine.numpy_sampler()
+    style_ids = args.styles if args.styles is not None else hand.styles.ids()
+    failed = False
+
+    print(
+        f"{'style':>6} {'tail':>5} {'max |dh|':>10} {'max |dkappa|':>13}"
+        f" {'max |dmu|/sd':>13} {'same lines':>11}"
+    )
+    for style_id in style_ids:
+        style = hand.styles.get(style_id)
+        chars, chars_len = encode(style, LINES)
+        full = full_prime(sampler, style, chars, chars_len)
+        for tail_steps in args.tail_steps:
+            cached = PrimedStateCache(sampler, tail_steps).primed_state(
+                [style] * len(LINES), chars, chars_len
+            )
+            drift = state_drift(full, cached)
+            shift = output_shift(sampler, full, cached)
+            same = same_strokes(sampler, full, cached, chars, chars_len, LINES)
+            ok = tail_steps != PRIME_TAIL_STEPS or drift["h"] <= args.state_tolerance
+            failed |= not ok
+            print(
+                f"{style_id:>6} {tail_steps:>5} {drift['h']:>10.2e}"
+                f" {drift['kappa']:>13.2e} {shift:>13.2e} {same:>11.0%}{'' if ok else '  DRIFTS'}"
+            )
+
+    hand.executor.shutdown()
+    if failed:
+        print(f"The prime cache drifts past {args.state_tolerance} at its tail length")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Stroke cache hit rate as worker processes are added.
+
+Simulates worker processes serving requests for seeded segments whose
+popularity follows a Zipf distribution, with requests spread evenly over
+the workers. Every worker has its own in-memory stroke cache, with or
+without the SQLite cache shared by all of them behind it. A miss stands in
+for sampling the segment, with synthetic strokes of a typical size. The
+model isn't run.
+
+Run from the backend directory:
+
+    python -m benchmarks.shared_cache --workers 1 2 4 8
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+
+import numpy as np
+
+from app.services.stroke_cache import SharedStrokeCache, StrokeCache
+
+# Rows of a typical sampled line
+STROKE_ROWS = 600
+
+
+def worker(index, keys, memory_bytes, shared_path, shared_bytes, results):
+    memory = StrokeCache(memory_bytes)
+    shared = SharedStrokeCache(shared_path, shared_bytes) if shared_path else None
+    strokes = np.zeros((STROKE_ROWS, 3), dtype=np.float32)
+    sampled = 0
+
+    for key in keys:
+        if memory.get(key) is not None:
+            continue
+        if shared is not None:
+            found = shared.get(key)
+            if found is not None:
+                memory.put(key, found)
+                continue
+        sampled += 1
+        if shared is not None:
+            shared.put(key, strokes)
+        memory.put(key, strokes)
+
+    results.put((index, len(keys), sampled))
+
+
+def run(workers: int, requests: int, distinct: int, zipf: float, shared: bool, args):
+    """Total share of requests served without sampling."""
+    rng = np.random.default_rng(0)
+    keys = [("segment", int(k)) for k in rng.zipf(zipf, requests) % distinct]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        shared_path = os.path.join(temp_dir, "strokes.sqlite") if shared else None
+        if shared_path:
+            SharedStrokeCache(shared_path, args.shared_mb * 1024 * 1024)
+
+        ctx = mp.get_context("spawn")
+        results = ctx.Queue()
+        processes = [
+            ctx.Process(
+                target=worker,
+                args=(
+                    i,
+                    keys[i::workers],
+                    args.memory_mb * 1024 * 1024,
+                    shared_path,
+                    args.shared_mb * 1024 * 1024,
+                    results,
+                ),
+            )
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        counts = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    served = sum(total for _, total, _ in counts)
+    sampled = sum(misses for _, _, misses in counts)
+    return 1.0 - sampled / served
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--distinct", type=int, default=5000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--memory-mb", type=float, default=64.0)
+    parser.add_argument("--shared-mb", type=float, default=64.0)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'memory only':>12} {'with shared':>12}")
+    for workers in args.workers:
+        local = run(workers, args.requests, args.distinct, args.zipf, False, args)
+        shared = run(workers, args.requests, args.distinct, args.zipf, True, args)
+        print(f"{workers:>8} {local:>12.1%} {shared:>12.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Model steps and latency of repeated documents with the word stroke library.
+
+Samples a sequence of unseeded documents built from the same letter lines,
+in one style, the way /a4page does, with and without the word library, and
+prints the model steps used (steps that produced a pen offset) and the time
+of each document. With the library, later documents are assembled mostly
+from stored words and only words without a reusable variant are sampled.
+
+Run from the backend directory:
+
+    python -m benchmarks.word_library --engine numpy --documents 8
+"""
+
+import argparse
+import time
+
+from app.services.handwriting import Hand, TextSegment
+from benchmarks.worker_pool_scaling import SAMPLE_TEXT
+
+
+def make_document(num_lines: int, style_id: int):
+    """A document of letter lines, all in one style."""
+    return [
+        [TextSegment(text=SAMPLE_TEXT[i % len(SAMPLE_TEXT)], style_id=style_id)]
+        for i in range(num_lines)
+    ]
+
+
+def run(hand: Hand, documents: int, lines: int, style_id: int):
+    """Model steps and seconds of each document."""
+    results = []
+    for _ in range(documents):
+        steps = hand.get_sampling_stats()["steps_used"]
+        start = time.perf_counter()
+        hand._sample_segments(make_document(lines, style_id))
+        elapsed = time.perf_counter() - start
+        results.append((hand.get_sampling_stats()["steps_used"] - steps, elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--engine", default="tensorflow")
+    parser.add_argument("--weights-path", default=None)
+    parser.add_argument("--documents", type=int, default=8)
+    parser.add_argument("--lines", type=int, default=10)
+    parser.add_argument("--style", type=int, default=3)
+    parser.add_argument("--variants", type=int, default=8)
+    parser.add_argument("--reuse-rate", type=float, default=0.8)
+    args = parser.parse_args()
+
+    plain = Hand(engine=args.engine, weights_path=args.weights_path)
+    plain.warmup()
+    library = Hand(engine=args.engine, weights_path=args.weights_path)
+    library.warmup()
+    library.enable_word_library(
+        64 * 1024 * 1024, max_variants=args.variants, reuse_rate=args.reuse_rate
+    )
+
+    baseline = run(plain, args.documents, args.lines, args.style)
+    reused = run(library, args.documents, args.lines, args.style)
+
+    print(f"{'document':>8} {'steps':>8} {'s':>6} {'library steps':>14} {'s':>6}")
+    for n, ((steps, seconds), (lib_steps, lib_seconds)) in enumerate(
+        zip(baseline, reused), 1
+    ):
+        print(f"{n:>8} {steps:>8} {seconds:>6.2f} {lib_steps:>14} {lib_seconds:>6.2f}")
+    stats = library.get_sampling_stats()["word_library"]
+    print(
+        f"word reuse rate {stats['reuse_rate']:.1%}, "
+        f"{stats['words']} words in {stats['variants']} variants"
+    )
+
+
+if __name__ == "__main__":
+    main()
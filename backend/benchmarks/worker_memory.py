@@ -0,0 +1,100 @@
+"""
+Memory of NumPy-engine workers with mapped versus private weights.
+
+Starts several worker processes at once, each loading the NumPy engine and
+writing one line, and reads their memory from /proc/<pid>/smaps_rollup
+while all of them are alive. PSS splits shared pages between the processes
+mapping them, so its total is what the workers really cost the host: with
+the memory-mapped weight file the weights are counted once, with a .npz
+every worker holds its own copy. Linux only.
+
+Run from the backend directory:
+
+    python -m benchmarks.worker_memory --workers 8
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+
+import numpy as np
+
+MEMORY_FIELDS = ("Rss", "Pss", "Private_Dirty", "Shared_Clean")
+
+
+def read_memory(pid: int) -> dict:
+    """Memory counters of a process in MB."""
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in MEMORY_FIELDS:
+                memory[name] = int(value.split()[0]) / 1024
+    return memory
+
+
+def worker(model_path, weights_path, loaded, done):
+    from app.services.engines import load_engine
+
+    engine = load_engine("numpy", model_path, weights_path)
+    chars = np.zeros((1, 20), dtype=np.int32)
+    chars[0, :12] = np.arange(10, 22)
+    engine.sample(
+        bias=np.array([0.5], dtype=np.float32),
+        c=chars,
+        c_len=np.array([12]),
+        num_samples=1,
+        prime=False,
+        sample_tsteps=100,
+        x_prime=np.zeros((1, 1, 3), dtype=np.float32),
+        x_prime_len=np.array([0]),
+    )
+    loaded.release()
+    done.wait()
+
+
+def measure(model_path, weights_path, workers: int) -> dict:
+    """Total memory of workers that are alive at the same time."""
+    ctx = mp.get_context("spawn")
+    loaded, done = ctx.Semaphore(0), ctx.Event()
+    processes = [
+        ctx.Process(target=worker, args=(model_path, weights_path, loaded, done))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for _ in processes:
+            loaded.acquire()
+        totals = dict.fromkeys(MEMORY_FIELDS, 0.0)
+        for process in processes:
+            for name, value in read_memory(process.pid).items():
+                totals[name] += value
+    finally:
+        done.set()
+        for process in processes:
+            process.join()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--model-path", default="saved_model/saved_model.pb")
+    args = parser.parse_args()
+
+    model_dir = os.path.dirname(args.model_path)
+    runs = (
+        ("private .npz", os.path.join(model_dir, "weights.npz")),
+        ("mapped .bin", os.path.join(model_dir, "weights.bin")),
+    )
+
+    print(f"{args.workers} workers, totals in MB")
+    print(f"{'weights':>14} " + " ".join(f"{name:>14}" for name in MEMORY_FIELDS))
+    for label, weights_path in runs:
+        totals = measure(args.model_path, weights_path, args.workers)
+        print(f"{label:>14} " + " ".join(f"{totals[n]:>14.1f}" for n in MEMORY_FIELDS))
+
+
+if __name__ == "__main__":
+    main()
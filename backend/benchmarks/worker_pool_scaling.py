@@ -0,0 +1,91 @@
+"""
+Throughput of the model worker pool as the number of worker processes grows.
+
+Runs a fixed set of concurrent A4-style requests (sample every line, then
+render every page) against an in-process Hand and against WorkerPools of
+increasing size, and prints lines per second for each.
+
+Run from the backend directory:
+
+    python -m benchmarks.worker_pool_scaling --workers 1 2 4 8 --requests 16
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.handwriting import Hand, LayoutConfig, TextSegment
+from app.services.worker_pool import WorkerPool
+
+SAMPLE_TEXT = (
+    "Dear friend, thank you for the lovely letter you sent last week.",
+    "The garden is finally in bloom and the roses look wonderful.",
+    "We should meet for tea soon.",
+    "Best wishes to you and the family,",
+    "Sam",
+)
+
+
+def make_document(num_lines: int):
+    """Build an A4-sized document of segments with mixed line lengths."""
+    return [
+        [TextSegment(text=SAMPLE_TEXT[i % len(SAMPLE_TEXT)], style_id=i % 12)]
+        for i in range(num_lines)
+    ]
+
+
+def run_requests(hand: Hand, num_requests: int, lines_per_request: int) -> float:
+    """Run the requests concurrently and return the wall time in seconds."""
+    layout = LayoutConfig()
+
+    def one_request(index: int):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            hand.write_multi_page(
+                os.path.join(temp_dir, "page_{}.svg"),
+                make_document(lines_per_request),
+                layout_config=layout,
+                page_dimensions=(794, 1123),
+                margins=(75, 100, 75, 100),
+                max_lines_per_page=30,
+            )
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_requests) as executor:
+        list(executor.map(one_request, range(num_requests)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--lines", type=int, default=30)
+    parser.add_argument("--threads-per-worker", type=int, default=None)
+    args = parser.parse_args()
+
+    total_lines = args.requests * args.lines
+    print(f"{args.requests} requests x {args.lines} lines, {os.cpu_count()} CPUs")
+    print(f"{'mode':>16} {'seconds':>10} {'lines/s':>10}")
+
+    hand = Hand()
+    run_requests(hand, 1, 2)  # warm up
+    elapsed = run_requests(hand, args.requests, args.lines)
+    print(f"{'in-process':>16} {elapsed:>10.2f} {total_lines / elapsed:>10.1f}")
+    hand.executor.shutdown()
+
+    for num_workers in args.workers:
+        pool = WorkerPool(num_workers, intra_op_threads=args.threads_per_worker)
+        hand = Hand(load_model=False)
+        hand.enable_worker_pool(pool)
+        run_requests(hand, num_workers, 2)  # start and warm up every worker
+        elapsed = run_requests(hand, args.requests, args.lines)
+        label = f"{num_workers} workers"
+        print(f"{label:>16} {elapsed:>10.2f} {total_lines / elapsed:>10.1f}")
+        pool.close()
+        hand.executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+from app.services.handwriting import Hand
+
+STYLES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "styles")
+
+
+@pytest.fixture
+def hand():
+    """A hand that never loads a model, for tests that stub sampling out."""
+    hand = Hand(model_path="missing.pb", styles_dir=STYLES_DIR, lazy=True)
+    yield hand
+    hand.executor.shutdown()
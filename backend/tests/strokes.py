@@ -0,0 +1,25 @@
+import numpy as np
+
+
+def handwritten(text: str) -> np.ndarray:
+    """
+    Offsets of a synthetic line: one short stroke per character, with wide
+    gaps at spaces, so it splits into words like a sampled line does.
+    """
+    coords = []
+    x = 0.0
+    for char in text:
+        if char == " ":
+            x += 4.0
+            continue
+        coords.extend([(x, 0.0, 0.0), (x + 0.5, 1.0, 0.0), (x + 1.0, 0.0, 1.0)])
+        x += 1.5
+    coords = np.array(coords, dtype=np.float32).reshape(-1, 3)
+    offsets = coords.copy()
+    offsets[1:, :2] = coords[1:, :2] - coords[:-1, :2]
+    return offsets
+
+
+def pen_ups(strokes: np.ndarray) -> int:
+    """Number of strokes, one per character for handwritten() lines."""
+    return int(np.asarray(strokes)[:, 2].sum())
@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from app.services.batching import BatchScheduler
+
+
+class RecordingSampler:
+    """sample_fn that returns each line's text and records every call."""
+
+    def __init__(self, gate: threading.Event = None):
+        self.calls = []
+        self.gate = gate
+
+    def __call__(self, lines, biases, styles, seeds):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.calls.append(list(lines))
+        return [
+            f"{line}/{style}/{seed}" for line, style, seed in zip(lines, styles, seeds)
+        ]
+
+
+def test_concurrent_requests_share_a_call_and_get_their_own_slice():
+    sampler = RecordingSampler()
+    scheduler = BatchScheduler(sampler, max_wait_ms=200)
+    first = scheduler.submit(["a", "b"], [0.5, 0.5], [1, 1], [7, None])
+    second = scheduler.submit(["c"], [0.5], [2])
+
+    assert first.result(5) == ["a/1/7", "b/1/None"]
+    assert second.result(5) == ["c/2/None"]
+    assert sampler.calls == [["a", "b", "c"]]
+    scheduler.close()
+
+
+def test_request_that_does_not_fit_starts_the_next_batch():
+    gate = threading.Event()
+    sampler = RecordingSampler(gate)
+    scheduler = BatchScheduler(sampler, max_wait_ms=200, max_batch_size=3)
+    futures = [
+        scheduler.submit(lines, [0.5] * len(lines), [0] * len(lines))
+        for lines in (["a", "b"], ["c", "d"], ["e"])
+    ]
+    gate.set()
+
+    assert [future.result(5) for future in futures] == [
+        ["a/0/None", "b/0/None"],
+        ["c/0/None", "d/0/None"],
+        ["e/0/None"],
+    ]
+    assert sampler.calls == [["a", "b"], ["c", "d", "e"]]
+    assert scheduler.get_stats()["max_batch_segments"] == 3
+    scheduler.close()
+
+
+def test_a_failed_call_fails_every_caller_in_the_batch():
+    def sample_fn(lines, biases, styles, seeds):
+        raise ValueError("model failed")
+
+    scheduler = BatchScheduler(sample_fn, max_wait_ms=200)
+    futures = [scheduler.submit([line], [0.5], [0]) for line in ("a", "b")]
+
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(5)
+    scheduler.close()
+
+
+def test_closed_scheduler_serves_queued_requests_and_rejects_new_ones():
+    scheduler = BatchScheduler(RecordingSampler(), max_wait_ms=1000)
+    future = scheduler.submit(["a"], [0.5], [0])
+    scheduler.close()
+
+    assert future.result(5) == ["a/0/None"]
+    with pytest.raises(RuntimeError):
+        scheduler.submit(["b"], [0.5], [0])
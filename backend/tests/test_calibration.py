@@ -0,0 +1,18 @@
+from app.services.calibration import StepBudget
+
+TABLE = {"default": 10.0, "margin": 1.5, "chars": {"a": 20.0}}
+
+
+def test_budget_adds_margin_and_slack_to_calibrated_steps():
+    budget = StepBudget({1: TABLE}, default_tsteps_per_char=40)
+
+    assert budget.tsteps(1, "ab") == 55
+    assert budget.tsteps(2, "ab") == 80
+
+
+def test_budget_is_only_loaded_for_the_engine_it_was_calibrated_on(tmp_path):
+    path = str(tmp_path / "step_budgets.json")
+    StepBudget({1: TABLE}, engine="numpy").save(path)
+
+    assert StepBudget.load(path, engine="numpy").styles == {1: TABLE}
+    assert StepBudget.load(path, engine="tensorflow").styles == {}
@@ -0,0 +1,75 @@
+from app.services.documents import DocumentStore, SampledDocument, carry_over_strokes
+from app.services.handwriting import TextSegment
+from tests.strokes import handwritten
+
+
+def sampled_lines(texts, sampled=True):
+    lines = []
+    for text in texts:
+        segment = TextSegment(text, style_id=1, seed=3)
+        segment.strokes = handwritten(text) if sampled else None
+        lines.append([segment])
+    return lines
+
+
+def test_carry_over_keeps_strokes_of_lines_after_an_insert():
+    previous = SampledDocument("old", sampled_lines(["one", "two", "three"]))
+    edited = sampled_lines(["one", "new", "two", "three"], sampled=False)
+
+    assert carry_over_strokes(previous, edited) == 3
+    assert edited[1][0].strokes is None
+    assert edited[3][0].strokes is previous.segments_by_line[2][0].strokes
+
+
+def test_carry_over_needs_the_same_sampling_settings():
+    previous = SampledDocument("old", sampled_lines(["one"]))
+    edited = sampled_lines(["one"], sampled=False)
+    edited[0][0].seed = 4
+
+    assert carry_over_strokes(previous, edited) == 0
+    assert edited[0][0].strokes is None
+
+
+def test_carry_over_does_not_count_lines_the_previous_version_left_unsampled():
+    previous = SampledDocument("old", sampled_lines(["one", "two"]))
+    previous.segments_by_line[1][0].strokes = None
+    edited = sampled_lines(["one", "two"], sampled=False)
+
+    assert carry_over_strokes(previous, edited) == 1
+
+
+def test_fill_keeps_strokes_sampled_meanwhile():
+    document = SampledDocument("doc", sampled_lines(["one", "two"], sampled=False))
+    missing = document.missing(range(2))
+    for line in missing.values():
+        line[0].strokes = handwritten(line[0].text)
+    early = handwritten("two")
+    document.segments_by_line[1][0].strokes = early
+
+    assert document.fill(missing) == 1
+    assert document.segments_by_line[0][0].strokes is not None
+    assert document.segments_by_line[1][0].strokes is early
+    assert not document.segments_by_line[0][0].strokes.flags.writeable
+
+
+def test_store_never_replaces_a_document_and_evicts_the_oldest():
+    lines = sampled_lines(["a line of text"])
+    size = SampledDocument("size", sampled_lines(["a line of text"])).nbytes
+    store = DocumentStore(size * 2)
+    first = store.put(lines)
+    second = store.put(sampled_lines(["a line of text"]))
+
+    assert first.document_id != second.document_id
+    assert store.get(first.document_id) is first
+    store.put(sampled_lines(["a line of text"]))
+    assert store.get(second.document_id) is None
+    assert store.get_stats()["evictions"] == 1
+
+
+def test_restyled_copies_share_strokes():
+    document = SampledDocument("doc", sampled_lines(["one", "two"]))
+    (line,) = document.restyled([1], stroke_color="blue")
+
+    assert line[0].stroke_color == "blue"
+    assert document.segments_by_line[1][0].stroke_color == "black"
+    assert line[0].strokes is document.segments_by_line[1][0].strokes
@@ -0,0 +1,53 @@
+"""
+NumPy engine against the TensorFlow engine on the shipped model. Skipped
+where TensorFlow or the saved model is missing.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from app.services.handwriting import Hand
+from benchmarks.engine_equivalence import KS_CRITICAL, collect, ks_statistic
+from tests.conftest import STYLES_DIR
+
+tf = pytest.importorskip("tensorflow")
+
+MODEL_PATH = os.path.join(os.path.dirname(STYLES_DIR), "saved_model", "saved_model.pb")
+
+pytestmark = pytest.mark.skipif(
+    not os.path.exists(MODEL_PATH), reason="saved model not available"
+)
+
+
+@pytest.fixture(scope="module")
+def hands(tmp_path_factory):
+    weights_path = str(tmp_path_factory.mktemp("weights") / "weights.bin")
+    reference = Hand(model_path=MODEL_PATH, styles_dir=STYLES_DIR)
+    numpy_hand = Hand(
+        model_path=MODEL_PATH,
+        styles_dir=STYLES_DIR,
+        engine="numpy",
+        weights_path=weights_path,
+    )
+    yield reference, numpy_hand
+    for hand in (reference, numpy_hand):
+        hand.executor.shutdown()
+
+
+def test_exported_weights_match_the_saved_model(hands):
+    reference, numpy_hand = hands
+    for key, value in reference.engine.weights().items():
+        np.testing.assert_array_equal(numpy_hand.engine.weights()[key], value)
+
+
+def test_numpy_engine_samples_like_tensorflow(hands):
+    reference, numpy_hand = hands
+    expected = collect(reference, [0, 7], repeats=8, bias=0.5)
+    actual = collect(numpy_hand, [0, 7], repeats=8, bias=0.5)
+
+    for name in expected:
+        a, b = expected[name], actual[name]
+        limit = KS_CRITICAL[0.001] * np.sqrt((len(a) + len(b)) / (len(a) * len(b)))
+        assert ks_statistic(a, b) <= limit, name
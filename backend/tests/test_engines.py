@@ -0,0 +1,121 @@
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app.services.engines import SavedModelEngine, XLAEngine, load_engine
+from app.services.sampler import LSTMAttentionSampler, RowGenerators
+from app.services.weight_file import write_weight_file
+from tests.weights import synthetic_weights
+
+
+@pytest.fixture
+def weight_file(tmp_path):
+    path = str(tmp_path / "weights.bin")
+    sampler = LSTMAttentionSampler(synthetic_weights())
+    write_weight_file(path, sampler.stored_arrays(), {"precision": "float32"})
+    return path
+
+
+def test_numpy_engine_maps_the_weight_file(weight_file):
+    engine = load_engine("numpy", "missing.pb", weight_file)
+
+    assert engine.get_stats() == {"precision": "float32", "weights_mapped": True}
+    for key, value in synthetic_weights().items():
+        np.testing.assert_array_equal(engine.weights()[key], value)
+    samples = engine.numpy_sampler().sample(
+        bias=np.array([0.5], dtype=np.float32),
+        c=np.array([[10, 11, 12]]),
+        c_len=np.array([3]),
+        num_samples=1,
+        prime=False,
+        sample_tsteps=10,
+        x_prime=np.zeros((1, 1, 3), dtype=np.float32),
+        x_prime_len=np.array([0]),
+        rng=RowGenerators.from_seeds([0]),
+    )
+    assert samples.shape[0] == 1 and np.all(np.isfinite(samples))
+
+
+@pytest.mark.parametrize(
+    "engine, precision",
+    [
+        ("numpy", "float16"),
+        ("numpy", "bfloat16"),
+        ("tensorflow", "float16"),
+        ("tflite", "bfloat16"),
+        ("numpy", "int8"),
+    ],
+)
+def test_engines_reject_precisions_they_cannot_run(weight_file, engine, precision):
+    with pytest.raises(ValueError):
+        load_engine(engine, "missing.pb", weight_file, precision=precision)
+
+
+def test_unknown_engine_is_rejected(weight_file):
+    with pytest.raises(ValueError):
+        load_engine("onnx", "missing.pb", weight_file)
+
+
+class FakeOpError(Exception):
+    """Stands in for tf.errors.OpError."""
+
+
+def fake_xla_engine(monkeypatch, run):
+    """An XLAEngine without TensorFlow, its buckets compiled to run."""
+    monkeypatch.setattr(
+        SavedModelEngine, "sample", lambda self, *args: np.full((1, 2, 3), -1.0)
+    )
+    engine = XLAEngine.__new__(XLAEngine)
+    engine.tf = SimpleNamespace(errors=SimpleNamespace(OpError=FakeOpError))
+    engine.precision = "float32"
+    engine._lock = threading.Lock()
+    engine._compiled = {}
+    engine._ran = set()
+    engine.calls = 0
+    engine.fallback_calls = 0
+    engine._compile = lambda key, prime: run
+    return engine
+
+
+def xla_sample(engine):
+    return engine.sample(
+        bias=[0.5],
+        c=np.zeros((1, 4), dtype=np.int32),
+        c_len=[4],
+        num_samples=1,
+        prime=False,
+        sample_tsteps=2,
+        x_prime=np.zeros((1, 1, 3), dtype=np.float32),
+        x_prime_len=[0],
+    )
+
+
+def test_xla_bucket_failing_its_first_call_falls_back(monkeypatch):
+    def run(*args):
+        raise FakeOpError("no kernel")
+
+    engine = fake_xla_engine(monkeypatch, run)
+
+    assert xla_sample(engine)[0, 0, 0] == -1.0
+    assert xla_sample(engine)[0, 0, 0] == -1.0
+    stats = engine.get_stats()
+    assert len(stats["failed_buckets"]) == 1 and stats["fallback_calls"] == 2
+
+
+def test_xla_errors_of_a_bucket_that_ran_are_raised(monkeypatch):
+    calls = []
+
+    def run(*args):
+        calls.append(1)
+        if len(calls) > 1:
+            raise FakeOpError("out of memory")
+        return SimpleNamespace(numpy=lambda: np.ones((8, 100, 3)))
+
+    engine = fake_xla_engine(monkeypatch, run)
+
+    assert xla_sample(engine).shape == (1, 2, 3)
+    with pytest.raises(FakeOpError):
+        xla_sample(engine)
+    assert engine.get_stats()["failed_buckets"] == []
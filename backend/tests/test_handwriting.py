@@ -0,0 +1,80 @@
+import numpy as np
+
+from app.services.handwriting import Hand, TextSegment
+from tests.conftest import STYLES_DIR
+
+
+def make_hand(**options) -> Hand:
+    hand = Hand(model_path="missing.pb", styles_dir=STYLES_DIR, lazy=True, **options)
+    hand.executor.shutdown()
+    return hand
+
+
+def test_stroke_cache_key_covers_the_sampling_path():
+    segment = TextSegment("hello", style_id=1, seed=7)
+    keys = {
+        make_hand(**options)._stroke_cache_key(segment)
+        for options in (
+            {},
+            {"engine": "numpy"},
+            {"precision": "bfloat16"},
+            {"seeded_on_numpy": False},
+            {"prime_cache": True},
+        )
+    }
+
+    assert len(keys) == 5
+
+
+def test_word_style_key_leaves_out_text_and_seed():
+    hand = make_hand()
+    first = TextSegment("hello", style_id=1, seed=7)
+    second = TextSegment("world", style_id=1, seed=8)
+
+    assert hand._word_style_key(first) == hand._word_style_key(second)
+    assert hand._word_style_key(first) != make_hand(engine="numpy")._word_style_key(
+        first
+    )
+
+
+def test_lines_cut_off_by_a_calibrated_budget_are_sampled_again():
+    hand = make_hand(load_model=False)
+    hand.step_budget.styles[1] = {"default": 5.0, "margin": 1.0, "chars": {}}
+    calls = []
+
+    def sample_within(lines, biases, styles, seeds, budgets):
+        calls.append(budgets)
+        samples = [np.zeros((budget, 3), dtype=np.float32) for budget in budgets]
+        return samples, np.array(budgets)
+
+    hand._sample_within = sample_within
+    samples = hand._sample(["hi", "hello"], styles=[1, None])
+
+    assert calls == [[20, 200], [80]]
+    assert [len(sample) for sample in samples] == [80, 200]
+    assert hand.get_sampling_stats()["budget_retries"] == 1
+
+
+def test_iter_multi_page_yields_the_first_page_before_sampling_the_rest():
+    hand = make_hand(load_model=False)
+    sampled = []
+    hand._sample_segments = lambda lines: sampled.append(len(lines))
+    hand._draw_segments = lambda filename, *args: None
+    lines = [[TextSegment(f"line {i}")] for i in range(25)]
+
+    pages = hand.iter_multi_page("page_{}.svg", lines, max_lines_per_page=2)
+
+    assert next(pages) == "page_1.svg" and sampled == [2]
+    assert list(pages)[-1] == "page_13.svg"
+    assert sampled == [2, 16, 7]
+
+
+def test_iter_multi_page_samples_short_documents_in_one_call():
+    hand = make_hand(load_model=False)
+    sampled = []
+    hand._sample_segments = lambda lines: sampled.append(len(lines))
+    hand._draw_segments = lambda filename, *args: None
+    lines = [[TextSegment(f"line {i}")] for i in range(4)]
+
+    assert len(list(hand.iter_multi_page("p{}", lines, max_lines_per_page=2))) == 2
+    assert sampled == [4]
@@ -0,0 +1,153 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.services.engines import default_weights_path, load_engine
+from app.services.sampler import (
+    LSTMAttentionSampler,
+    LSTMAttentionState,
+    PrimedStateCache,
+    RowGenerators,
+    round_to_precision,
+)
+from app.services.styles import StyleRegistry
+from app.utils import drawing
+from benchmarks.precision_fidelity import state_drift
+from benchmarks.prime_cache_drift import encode, full_prime
+from tests.conftest import STYLES_DIR
+from tests.weights import synthetic_weights
+
+MODEL_PATH = os.path.join(os.path.dirname(STYLES_DIR), "saved_model", "saved_model.pb")
+WEIGHTS_PATH = default_weights_path(MODEL_PATH)
+
+
+@pytest.fixture(scope="module")
+def sampler():
+    return LSTMAttentionSampler(synthetic_weights())
+
+
+def inputs(texts, tsteps=30, prime_len=0):
+    """sample() arguments for texts, primed with prime_len random offsets."""
+    chars = np.zeros((len(texts), 20), dtype=np.int32)
+    chars_len = np.zeros(len(texts), dtype=np.int32)
+    for i, text in enumerate(texts):
+        encoded = drawing.encode_ascii(text)
+        chars[i, : len(encoded)] = encoded
+        chars_len[i] = len(encoded)
+    x_prime = np.random.default_rng(1).standard_normal((len(texts), 8, 3))
+    return dict(
+        bias=np.full(len(texts), 0.5, dtype=np.float32),
+        c=chars,
+        c_len=chars_len,
+        num_samples=len(texts),
+        prime=prime_len > 0,
+        sample_tsteps=tsteps,
+        x_prime=x_prime.astype(np.float32),
+        x_prime_len=np.full(len(texts), prime_len),
+    )
+
+
+def test_seeded_sample_does_not_depend_on_its_batch(sampler):
+    alone = sampler.sample(
+        **inputs(["hello"], prime_len=8), rng=RowGenerators.from_seeds([5])
+    )
+    batched = sampler.sample(
+        **inputs(["hello", "a longer line"], prime_len=8),
+        rng=RowGenerators.from_seeds([5, 6]),
+    )
+
+    # Only BLAS rounding differs between batch sizes
+    np.testing.assert_allclose(batched[0][: alone.shape[1]], alone[0], atol=1e-5)
+    assert np.all(batched[0][alone.shape[1] :] == 0.0)
+
+
+def test_samples_stop_at_their_own_step_limit(sampler):
+    samples = sampler.sample(
+        **inputs(["hello", "world"], tsteps=np.array([5, 12])),
+        rng=RowGenerators.from_seeds([1, 2]),
+    )
+
+    assert samples.shape[1] <= 12
+    assert np.all(samples[0, 5:] == 0.0)
+    assert np.all(np.isfinite(samples))
+
+
+def test_priming_stops_at_each_samples_own_length(sampler):
+    arguments = inputs(["ab", "ab"], prime_len=8)
+    arguments["x_prime_len"] = np.array([8, 4])
+    state = sampler.prime(
+        arguments["x_prime"],
+        arguments["x_prime_len"],
+        arguments["c"],
+        arguments["c_len"],
+    )
+    short = sampler.prime(
+        arguments["x_prime"][1:, :4],
+        np.array([4]),
+        arguments["c"][1:],
+        arguments["c_len"][1:],
+    )
+
+    for field in LSTMAttentionState.FIELDS:
+        np.testing.assert_allclose(
+            getattr(state, field)[1:], getattr(short, field), rtol=1e-5, atol=1e-6
+        )
+
+
+def test_stored_arrays_rebuild_the_same_sampler(sampler):
+    rebuilt = LSTMAttentionSampler.from_stored_arrays(
+        sampler.stored_arrays(), "float32"
+    )
+    arguments = inputs(["stored"], prime_len=8)
+
+    np.testing.assert_array_equal(
+        sampler.sample(**arguments, rng=RowGenerators.from_seeds([3])),
+        rebuilt.sample(**arguments, rng=RowGenerators.from_seeds([3])),
+    )
+    for key, value in synthetic_weights().items():
+        np.testing.assert_array_equal(rebuilt.export_weights()[key], value)
+
+
+def test_round_to_precision_keeps_the_precisions_mantissa():
+    values = np.array([1.0 + 2.0**-10, 1.0 + 2.0**-6, 3.14159], dtype=np.float32)
+
+    bfloat16 = round_to_precision(values, "bfloat16")
+    float16 = round_to_precision(values, "float16")
+
+    assert bfloat16.dtype == np.float32 and float16.dtype == np.float32
+    np.testing.assert_array_equal(bfloat16[:2], [1.0, 1.0 + 2.0**-6])
+    np.testing.assert_array_equal(float16[:2], values[:2])
+    assert abs(bfloat16[2] - values[2]) <= 2.0**-7 * 2
+    np.testing.assert_array_equal(round_to_precision(values, "float32"), values)
+
+
+def test_unknown_precision_is_rejected():
+    with pytest.raises(ValueError):
+        LSTMAttentionSampler(synthetic_weights(), precision="int8")
+
+
+def test_prime_cache_replaying_the_whole_primer_is_a_full_prime(sampler):
+    style = StyleRegistry(STYLES_DIR).get(3)
+    chars, chars_len = encode(style, ["hi there", "a much longer line of text"])
+    full = full_prime(sampler, style, chars, chars_len)
+    cached = PrimedStateCache(sampler, style.strokes_len).primed_state(
+        [style, style], chars, chars_len
+    )
+
+    assert state_drift(full, cached)["h"] < 1e-5
+
+
+@pytest.mark.skipif(
+    not os.path.exists(WEIGHTS_PATH), reason="exported model weights not available"
+)
+def test_prime_cache_stays_close_to_a_full_prime_on_every_style():
+    sampler = load_engine("numpy", MODEL_PATH, WEIGHTS_PATH).numpy_sampler()
+    styles = StyleRegistry(STYLES_DIR)
+    for style_id in styles.ids():
+        style = styles.get(style_id)
+        chars, chars_len = encode(style, ["The quick brown fox"])
+        full = full_prime(sampler, style, chars, chars_len)
+        cached = PrimedStateCache(sampler).primed_state([style], chars, chars_len)
+
+        assert state_drift(full, cached)["h"] < 1e-3, style_id
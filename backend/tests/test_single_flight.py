@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from app.services.single_flight import SingleFlight, request_key
+
+
+def test_request_key_ignores_parameter_order():
+    assert request_key("a4", text="hi", bias=0.5) == request_key(
+        "a4", bias=0.5, text="hi"
+    )
+    assert request_key("a4", text="hi") != request_key("generate", text="hi")
+
+
+def test_concurrent_callers_share_one_run():
+    group = SingleFlight()
+    runs = []
+
+    async def generate():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "strokes"
+
+    async def main():
+        return await asyncio.gather(*(group.run("key", generate) for _ in range(3)))
+
+    assert asyncio.run(main()) == ["strokes"] * 3
+    assert len(runs) == 1
+    stats = group.get_stats()
+    assert (stats["leaders"], stats["coalesced"], stats["in_flight"]) == (1, 2, 0)
+
+
+def test_every_caller_gets_the_exception():
+    group = SingleFlight()
+
+    async def generate():
+        await asyncio.sleep(0.01)
+        raise ValueError("bad text")
+
+    async def main():
+        return await asyncio.gather(
+            *(group.run("key", generate) for _ in range(2)), return_exceptions=True
+        )
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(main()))
+
+
+def test_cancelled_caller_leaves_the_run_to_the_others():
+    group = SingleFlight()
+
+    async def generate():
+        await asyncio.sleep(0.05)
+        return "strokes"
+
+    async def main():
+        first = asyncio.ensure_future(group.run("key", generate))
+        second = asyncio.ensure_future(group.run("key", generate))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "strokes"
+
+
+def test_key_runs_again_once_done():
+    group = SingleFlight()
+    runs = []
+
+    async def generate():
+        runs.append(1)
+        return len(runs)
+
+    async def main():
+        return [await group.run("key", generate) for _ in range(2)]
+
+    assert asyncio.run(main()) == [1, 2]
@@ -0,0 +1,94 @@
+import numpy as np
+
+from app.services.stroke_cache import DiskStrokeCache, SharedStrokeCache, StrokeCache
+
+
+def strokes(rows: int, value: float = 1.0) -> np.ndarray:
+    return np.full((rows, 3), value, dtype=np.float32)
+
+
+def test_stroke_cache_evicts_least_recently_used():
+    cache = StrokeCache(strokes(10).nbytes * 2)
+    cache.put("a", strokes(10, 1.0))
+    cache.put("b", strokes(10, 2.0))
+    cache.get("a")
+    cache.put("c", strokes(10, 3.0))
+
+    assert cache.get("b") is None
+    assert cache.get("a")[0, 0] == 1.0
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_stroke_cache_hands_out_read_only_copies():
+    original = strokes(4)
+    cached = StrokeCache(1 << 20).put("a", original)
+    original[0, 0] = 5.0
+
+    assert cached[0, 0] == 1.0
+    assert not cached.flags.writeable
+
+
+def test_disk_cache_survives_reopening(tmp_path):
+    cache = DiskStrokeCache(str(tmp_path), 1 << 20)
+    cache.put(("line", 1), strokes(5, 2.0))
+    cache.close()
+
+    reopened = DiskStrokeCache(str(tmp_path), 1 << 20)
+    np.testing.assert_array_equal(reopened.get(("line", 1)), strokes(5, 2.0))
+    reopened.close()
+
+
+def test_disk_cache_sees_entries_written_by_another_handle(tmp_path):
+    first = DiskStrokeCache(str(tmp_path), 1 << 20)
+    second = DiskStrokeCache(str(tmp_path), 1 << 20)
+    first.put("a", strokes(3, 4.0))
+
+    assert second.get("a")[0, 0] == 4.0
+    first.close()
+    second.close()
+
+
+def test_disk_cache_compacts_to_the_most_recently_used(tmp_path):
+    entry = strokes(100).nbytes
+    cache = DiskStrokeCache(str(tmp_path), entry * 4)
+    for i in range(3):
+        cache.put(i, strokes(100, float(i)))
+    cache.get(0)
+    cache.put(3, strokes(100, 3.0))
+    cache.put(4, strokes(100, 4.0))
+
+    stats = cache.get_stats()
+    assert stats["compactions"] == 1
+    assert stats["bytes"] <= entry * 4
+    assert cache.get(1) is None
+    for key in (0, 4):
+        assert cache.get(key)[0, 0] == float(key)
+    cache.close()
+
+
+def test_disk_cache_reset_by_a_corrupt_data_file(tmp_path):
+    cache = DiskStrokeCache(str(tmp_path), 1 << 20)
+    cache.put("a", strokes(3))
+    cache.close()
+    with open(tmp_path / "strokes.dat", "r+b") as f:
+        f.write(b"garbage!")
+
+    reopened = DiskStrokeCache(str(tmp_path), 1 << 20)
+    assert reopened.get("a") is None
+    reopened.close()
+
+
+def test_shared_cache_is_shared_between_handles_and_evicts(tmp_path):
+    path = str(tmp_path / "strokes.sqlite")
+    entry = strokes(100).nbytes
+    first = SharedStrokeCache(path, entry * 2)
+    second = SharedStrokeCache(path, entry * 2)
+    first.put("a", strokes(100, 1.0))
+
+    assert second.get("a")[0, 0] == 1.0
+
+    second.put("b", strokes(100, 2.0))
+    second.put("c", strokes(100, 3.0))
+    stats = first.get_stats()
+    assert stats["bytes"] <= entry * 2
+    assert first.get("c")[0, 0] == 3.0
@@ -0,0 +1,108 @@
+import numpy as np
+
+from app.services.handwriting import TextSegment
+from app.services.word_library import (
+    WordStrokeLibrary,
+    join_words,
+    plausible_widths,
+    split_words,
+)
+from tests.strokes import handwritten, pen_ups
+
+
+def test_split_words_cuts_at_word_gaps():
+    runs, gaps = split_words(handwritten("hello big world"), 3)
+
+    assert [pen_ups(run) for run in runs] == [5, 3, 5]
+    assert len(gaps) == 2 and min(gaps) > 1.0
+    for run in runs:
+        assert run[:, 0].min() == 0.0
+        assert run[-1, 2] == 1.0
+
+
+def test_split_words_rejects_too_few_gaps():
+    assert split_words(handwritten("hello"), 2) is None
+
+
+def test_plausible_widths_rejects_collapsed_word():
+    runs, _ = split_words(handwritten("hello world"), 2)
+    runs[1] = runs[1].copy()
+    runs[1][:, 0] = 0.0
+
+    assert plausible_widths(runs, ["hello", "world"]) is False
+
+
+def test_join_words_round_trips_runs():
+    runs, _ = split_words(handwritten("one two"), 2)
+    joined = join_words(runs, 4.0)
+
+    assert pen_ups(joined) == 6
+    rejoined, _ = split_words(joined, 2)
+    for run, original in zip(rejoined, runs):
+        np.testing.assert_allclose(run, original, atol=1e-5)
+
+
+def test_library_never_reuses_a_variant_twice_in_a_document():
+    library = WordStrokeLibrary(1 << 20, max_variants=1, reuse_rate=1.0)
+    library.add_line(("style",), ["hi"], handwritten("hi"))
+    used = set()
+
+    assert library.choose(("style",), "hi", used) is not None
+    assert library.choose(("style",), "hi", used) is None
+
+
+def test_library_evicts_least_recently_used_words():
+    run = split_words(handwritten("word"), 1)[0][0]
+    library = WordStrokeLibrary(run.nbytes * 2)
+    for word in ("a", "b", "c"):
+        library.add(("style",), word, run)
+
+    assert library.get_stats()["words"] == 2
+    assert library.choose(("style",), "a", set()) is None
+
+
+def test_unsplittable_word_resamples_the_whole_line(hand, monkeypatch):
+    hand.enable_word_library(1 << 20, max_variants=1, reuse_rate=1.0)
+    segment = TextSegment("hello world")
+    hand.word_library.add_line(
+        hand._word_style_key(segment), ["hello"], handwritten("hello")
+    )
+
+    sampled = []
+
+    def sample_lines(lines, biases, styles, seeds=None):
+        sampled.extend(lines)
+        # A lone "world" collapses to zero width and can't be stored
+        return [
+            (
+                np.array([[0.0, 0.0, 0.0]] * 4 + [[0.0, 0.0, 1.0]], dtype=np.float32)
+                if line == "world"
+                else handwritten(line)
+            )
+            for line in lines
+        ]
+
+    monkeypatch.setattr(hand, "_sample_lines", sample_lines)
+    hand._sample_segments([[segment]])
+
+    assert sampled == ["world", "hello world"]
+    # One stroke per letter: every word of the line made it into the strokes
+    assert pen_ups(segment.strokes) == len("helloworld")
+
+
+def test_assembled_line_has_every_word(hand, monkeypatch):
+    hand.enable_word_library(1 << 20, max_variants=1, reuse_rate=1.0)
+    segment = TextSegment("hello there world")
+    hand.word_library.add_line(
+        hand._word_style_key(segment), ["hello", "world"], handwritten("hello world")
+    )
+    monkeypatch.setattr(
+        hand,
+        "_sample_lines",
+        lambda lines, biases, styles, seeds=None: [handwritten(l) for l in lines],
+    )
+
+    hand._sample_segments([[segment]])
+
+    assert pen_ups(segment.strokes) == len("hellothereworld")
+    assert split_words(segment.strokes, 3) is not None
@@ -0,0 +1,33 @@
+import numpy as np
+
+from app.services.sampler import (
+    ALPHABET_SIZE,
+    LSTM_SIZE,
+    NUM_ATTENTION_COMPONENTS,
+    NUM_OUTPUT_COMPONENTS,
+)
+
+
+def synthetic_weights(seed: int = 0, scale: float = 0.05) -> dict:
+    """Random weights with the shapes extract_weights() reads from the model."""
+    rng = np.random.default_rng(seed)
+    gates = 4 * LSTM_SIZE
+    shapes = {
+        "lstm1_kernel": (ALPHABET_SIZE + 3 + LSTM_SIZE, gates),
+        "lstm1_bias": (gates,),
+        "attention_weights": (
+            ALPHABET_SIZE + 3 + LSTM_SIZE,
+            3 * NUM_ATTENTION_COMPONENTS,
+        ),
+        "attention_biases": (3 * NUM_ATTENTION_COMPONENTS,),
+        "lstm2_kernel": (3 + LSTM_SIZE + ALPHABET_SIZE + LSTM_SIZE, gates),
+        "lstm2_bias": (gates,),
+        "lstm3_kernel": (3 + LSTM_SIZE + ALPHABET_SIZE + LSTM_SIZE, gates),
+        "lstm3_bias": (gates,),
+        "gmm_weights": (LSTM_SIZE, 6 * NUM_OUTPUT_COMPONENTS + 1),
+        "gmm_biases": (6 * NUM_OUTPUT_COMPONENTS + 1,),
+    }
+    return {
+        key: (scale * rng.standard_normal(shape)).astype(np.float32)
+        for key, shape in shapes.items()
+    }